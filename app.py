@@ -1,19 +1,41 @@
 import os
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+import math
+import uuid
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash
 from flask_login import LoginManager, login_required, login_user, logout_user
+from flask_migrate import Migrate
 from werkzeug.security import check_password_hash
-from rq import Queue
 from models import User, Message, MessageTemplate, TwilioNumber, db
-from utils.twilio_handler import process_twilio_webhook, reset_daily_counts
+from config import Config
+from utils.twilio_handler import process_twilio_webhook, process_coalesced_messages, reset_daily_counts
 from utils.redis_handler import (
-    get_queue_stats, get_queue_history, record_queue_stats,
-    get_processing_stats, update_processing_stats
+    get_queue_stats, get_queue_history,
+    get_processing_stats, update_processing_stats, get_default_processing_stats,
+    get_default_queue_stats
 )
 from utils.redis_helper import RedisHelper
+from utils.template_matcher import bump_template_version
+from utils.template_usage import get_pending_template_usage
+from utils.sender_allocator import rebuild_sender_pool, get_pending_sender_usage
+from utils.message_store import get_unpersisted_messages
+from utils.message_browser import InvalidQuery, parse_query, browse_messages, serialize_messages
+from utils.message_search import SearchUnavailable, decode_search_cursor, search_messages
+from utils.dashboard_events import DashboardBroadcaster, get_latest_dashboard_stats
+from utils.priority_queues import get_queues, classify_message
+from utils.job_payload import build_payload
+from utils.webhook_dedup import claim_message_sid, point_message_sid, release_message_sid
+from utils.metrics import render_metrics, record_pool_stats, maybe_record_pool_stats
+from utils.message_coalescer import (
+    add_fragment, abandon_batch, get_coalesce_window, set_coalesce_window, get_coalesce_stats, MAX_COALESCE_WINDOW
+)
+from utils.response_cache import (
+    get_response_cache_stats, get_cached_entries, clear_response_cache, remove_cached_response
+)
+import queue
 import logging
 from urllib.parse import urlparse, parse_qs
-from redis.exceptions import RedisError
+from redis.exceptions import RedisError, ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,9 +44,12 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "your-secret-key")
 
-# Parse the database URL and add sslmode=require
+# Parse the database URL and add sslmode=require (Postgres only; a local
+# SQLite database, e.g. for load tests, is used as given)
 db_url = os.environ.get("DATABASE_URL")
-if db_url:
+if db_url and not db_url.startswith(("postgres://", "postgresql")):
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+elif db_url:
     try:
         url = urlparse(db_url)
         query_dict = parse_qs(url.query) if url.query else {}
@@ -50,12 +75,19 @@ login_manager.login_view = "login"
 redis_helper = RedisHelper()
 redis_conn = redis_helper.get_connection()
 if redis_conn:
-    message_queue = Queue('messages', connection=redis_conn)
+    # Queue and stats traffic use their own clients on the shared pool, so
+    # pool usage is reported per purpose
+    message_queues = get_queues(redis_helper.get_connection('queue'))
 else:
-    message_queue = None
+    message_queues = []
     logger.error("Failed to initialize Redis queue - some features may be unavailable")
+dashboard_events = DashboardBroadcaster(redis_helper.get_connection('stats')) if redis_conn else None
+
+STREAM_KEEPALIVE = 15  # seconds between comments that keep idle streams open
 
 db.init_app(app)
+# Schema changes are applied with migrations: `flask db upgrade` (see migrations/)
+migrate = Migrate(app, db, render_as_batch=True)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -87,21 +119,18 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    messages = Message.query.order_by(Message.timestamp.desc()).limit(50).all()
-    queue_stats = {'queued': 0, 'started': 0, 'finished': 0, 'failed': 0, 'deferred': 0, 'scheduled': 0}
-    processing_stats = {
-        'avg_processing_time': 0,
-        'total_processed': 0,
-        'success_rate': 100,
-        'hourly_volume': []
-    }
+    # Messages still being processed (or waiting for a batched write) live in Redis
+    messages = get_unpersisted_messages(redis_conn, limit=50)
+    # Older pages are fetched from /api/messages as the table is scrolled
+    persisted, next_cursor = browse_messages(limit=max(50 - len(messages), 1))
+    messages += persisted
+    queue_stats = get_default_queue_stats()
+    processing_stats = get_default_processing_stats()
     
-    if message_queue and redis_helper.health_check():
+    if message_queues and redis_helper.health_check():
         try:
-            queue_stats = get_queue_stats(message_queue)
+            queue_stats = get_queue_stats(message_queues)
             processing_stats = get_processing_stats(redis_conn)
-            # Record current stats for historical tracking
-            record_queue_stats(redis_conn, message_queue)
         except Exception as e:
             logger.error(f"Error fetching queue stats: {str(e)}")
             flash("Unable to fetch queue statistics", "error")
@@ -110,20 +139,41 @@ def dashboard():
     
     return render_template('dashboard.html', 
                          messages=messages, 
+                         next_cursor=next_cursor,
                          stats=queue_stats,
-                         processing_stats=processing_stats)
+                         processing_stats=processing_stats,
+                         coalesce_window=get_coalesce_window(redis_conn, Config.COALESCE_WINDOW),
+                         max_coalesce_window=MAX_COALESCE_WINDOW,
+                         coalesce_stats=get_coalesce_stats(redis_conn))
+
+@app.route('/coalescing/window', methods=['POST'])
+@login_required
+def update_coalesce_window():
+    try:
+        window = float(request.form['window'])
+        if not math.isfinite(window) or not 0 <= window <= MAX_COALESCE_WINDOW:
+            raise ValueError(f"window must be between 0 and {MAX_COALESCE_WINDOW} seconds")
+        set_coalesce_window(redis_conn, window)
+        flash('Coalescing window updated')
+    except (ValueError, RedisError) as e:
+        flash(f'Error updating coalescing window: {str(e)}')
+    return redirect(url_for('dashboard'))
 
 @app.route('/templates')
 @login_required
 def templates():
     templates = MessageTemplate.query.order_by(MessageTemplate.created_at.desc()).all()
-    return render_template('templates.html', templates=templates)
+    # Include hits still buffered in Redis so counts are current
+    pending_usage = get_pending_template_usage(redis_conn)
+    return render_template('templates.html', templates=templates, pending_usage=pending_usage)
 
 @app.route('/twilio-numbers')
 @login_required
 def twilio_numbers():
     numbers = TwilioNumber.query.order_by(TwilioNumber.priority.desc()).all()
-    return render_template('twilio_numbers.html', numbers=numbers)
+    # Include sends still buffered in the Redis allocator so counts are current
+    pending_usage = get_pending_sender_usage(redis_conn)
+    return render_template('twilio_numbers.html', numbers=numbers, pending_usage=pending_usage)
 
 @app.route('/twilio-numbers/add', methods=['POST'])
 @login_required
@@ -133,10 +183,12 @@ def add_number():
             phone_number=request.form['phone_number'],
             friendly_name=request.form['friendly_name'],
             priority=int(request.form['priority']),
+            send_rate=float(request.form.get('send_rate') or Config.DEFAULT_SEND_RATE),
             is_active=True
         )
         db.session.add(number)
         db.session.commit()
+        rebuild_sender_pool(redis_conn)
         flash('Twilio number added successfully')
     except Exception as e:
         flash(f'Error adding Twilio number: {str(e)}')
@@ -150,7 +202,9 @@ def edit_number(number_id):
         number.phone_number = request.form['phone_number']
         number.friendly_name = request.form['friendly_name']
         number.priority = int(request.form['priority'])
+        number.send_rate = float(request.form.get('send_rate') or Config.DEFAULT_SEND_RATE)
         db.session.commit()
+        rebuild_sender_pool(redis_conn)
         flash('Twilio number updated successfully')
     except Exception as e:
         flash(f'Error updating Twilio number: {str(e)}')
@@ -163,6 +217,7 @@ def toggle_number(number_id):
     try:
         number.is_active = not number.is_active
         db.session.commit()
+        rebuild_sender_pool(redis_conn)
         flash(f'Twilio number {"activated" if number.is_active else "deactivated"} successfully')
     except Exception as e:
         flash(f'Error toggling Twilio number: {str(e)}')
@@ -178,20 +233,39 @@ def reset_number_counts():
         flash(f'Error resetting daily counts: {str(e)}')
     return redirect(url_for('twilio_numbers'))
 
+@app.route('/response-cache')
+@login_required
+def response_cache():
+    stats = get_response_cache_stats(redis_conn)
+    entries = get_cached_entries(redis_conn)
+    return render_template('response_cache.html', stats=stats, entries=entries,
+                           max_bytes=Config.RESPONSE_CACHE_MAX_BYTES)
+
+@app.route('/response-cache/clear', methods=['POST'])
+@login_required
+def clear_cache():
+    clear_response_cache(redis_conn)
+    flash('Response cache cleared')
+    return redirect(url_for('response_cache'))
+
+@app.route('/response-cache/remove/<digest>', methods=['POST'])
+@login_required
+def remove_cache_entry(digest):
+    remove_cached_response(redis_conn, digest)
+    flash('Cached response removed')
+    return redirect(url_for('response_cache'))
+
 @app.route('/api/queue-stats')
 @login_required
 def queue_stats():
-    if not message_queue or not redis_helper.health_check():
+    if not message_queues or not redis_helper.health_check():
         return jsonify({
-            "queue": {
-                'queued': 0, 'started': 0, 'finished': 0, 
-                'failed': 0, 'deferred': 0, 'scheduled': 0
-            },
+            "queue": get_default_queue_stats(),
             "processing": get_default_processing_stats()
         })
         
     try:
-        stats = get_queue_stats(message_queue)
+        stats = get_queue_stats(message_queues)
         processing_stats = get_processing_stats(redis_conn)
         return jsonify({
             "queue": stats,
@@ -200,13 +274,84 @@ def queue_stats():
     except Exception as e:
         logger.error(f"Error fetching queue stats: {str(e)}")
         return jsonify({
-            "queue": {
-                'queued': 0, 'started': 0, 'finished': 0, 
-                'failed': 0, 'deferred': 0, 'scheduled': 0
-            },
+            "queue": get_default_queue_stats(),
             "processing": get_default_processing_stats()
         })
 
+@app.route('/api/messages')
+@login_required
+def api_messages():
+    """Stored messages newest first, filtered and paginated by an opaque cursor"""
+    try:
+        query = parse_query(request.args)
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+    messages, next_cursor = browse_messages(query['filters'], query['cursor'], query['limit'])
+    return jsonify({
+        "messages": serialize_messages(messages),
+        "next_cursor": next_cursor
+    })
+
+@app.route('/api/messages/search')
+@login_required
+def api_search_messages():
+    """Full-text search over message content and replies, best match first"""
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "q is required"}), 400
+    try:
+        query = parse_query(request.args, cursor_decoder=decode_search_cursor)
+        results, next_cursor = search_messages(text, query['filters'], query['cursor'], query['limit'])
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+    except SearchUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+
+    messages = serialize_messages([message for message, _, _ in results])
+    for message, (_, score, snippet) in zip(messages, results):
+        message['score'] = score
+        message['snippet'] = snippet
+    return jsonify({
+        "messages": messages,
+        "next_cursor": next_cursor
+    })
+
+@app.route('/metrics')
+def metrics():
+    # Scraped by Prometheus, so a bearer token stands in for the login session
+    if Config.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {Config.METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    record_pool_stats(redis_conn, 'web', redis_helper.pool_stats())
+    return Response(render_metrics(redis_conn), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stream')
+@login_required
+def stream():
+    """Server-Sent Events with queue and processing stats, published by the sampler"""
+    if not dashboard_events or not redis_helper.health_check():
+        return jsonify({"error": "Live updates unavailable"}), 503
+    # No recent snapshot means no sampler is publishing; the page falls back to polling
+    latest = get_latest_dashboard_stats(redis_conn)
+    if not latest:
+        return jsonify({"error": "Live updates unavailable"}), 503
+
+    def events():
+        client = dashboard_events.subscribe()
+        try:
+            yield f"event: stats\ndata: {latest}\n\n"
+            while True:
+                try:
+                    payload = client.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: stats\ndata: {payload}\n\n"
+        finally:
+            dashboard_events.unsubscribe(client)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/queue-history')
 @login_required
 def queue_history():
@@ -221,8 +366,11 @@ def queue_history():
         except ValueError:
             logger.warning(f"Invalid period value: {period}, using default 24")
             period = 24
+
+        # Bucket size in seconds (60, 300 or 3600); chosen from the period if absent
+        resolution = request.args.get('resolution', type=int)
             
-        history = get_queue_history(redis_conn, period)
+        history = get_queue_history(redis_conn, period, resolution)
         return jsonify(history)
     except RedisError as e:
         logger.error(f"Redis error in queue history: {str(e)}")
@@ -243,6 +391,7 @@ def add_template():
         )
         db.session.add(template)
         db.session.commit()
+        bump_template_version(redis_conn)
         flash('Template added successfully')
     except Exception as e:
         flash(f'Error adding template: {str(e)}')
@@ -258,6 +407,7 @@ def edit_template(template_id):
         template.trigger_keywords = request.form['keywords']
         template.response_template = request.form['template']
         db.session.commit()
+        bump_template_version(redis_conn)
         flash('Template updated successfully')
     except Exception as e:
         flash(f'Error updating template: {str(e)}')
@@ -270,6 +420,7 @@ def toggle_template(template_id):
     try:
         template.active = not template.active
         db.session.commit()
+        bump_template_version(redis_conn)
         flash(f'Template {"activated" if template.active else "deactivated"} successfully')
     except Exception as e:
         flash(f'Error toggling template: {str(e)}')
@@ -277,21 +428,60 @@ def toggle_template(template_id):
 
 @app.route('/webhook/twilio', methods=['POST'])
 def twilio_webhook():
-    if not message_queue or not redis_helper.health_check():
+    if not message_queues or not redis_helper.health_check():
         logger.error("Queue system unavailable - cannot process webhook")
         return jsonify({"error": "Queue system unavailable"}), 503
         
+    payload = build_payload(request.form)
+    message_sid = payload.get('MessageSid')
+    job_id = str(uuid.uuid4())
     try:
         start_time = datetime.utcnow()
-        job = message_queue.enqueue(process_twilio_webhook, request.form)
+        # Twilio retries webhooks it thinks timed out; answer a retry with the
+        # job that already took the message instead of processing it again
+        if message_sid:
+            original_job_id = claim_message_sid(redis_conn, message_sid, job_id, Config.WEBHOOK_DEDUP_TTL)
+            if original_job_id:
+                logger.info(f"Duplicate webhook for {message_sid}, already handled by job {original_job_id}")
+                return jsonify({"status": "duplicate", "job_id": original_job_id}), 200
+
+        queue_name, priority = classify_message(redis_conn, payload.get('From'), payload.get('To'))
+        message_queue = next(q for q in message_queues if q.name == queue_name)
+        # Fragments of one long text arrive as separate webhooks: the first one
+        # schedules a job after the window, later ones are added to it
+        window, batch_job_id = add_fragment(redis_conn, payload.get('From'), payload.get('Body'),
+                                            Config.COALESCE_WINDOW, job_id)
+        status = "queued"
+        if window is None:
+            message_queue.enqueue(process_twilio_webhook, payload, priority, job_id=job_id)
+        elif window:
+            try:
+                message_queue.enqueue_in(timedelta(seconds=window), process_coalesced_messages, payload, priority,
+                                         job_id=job_id)
+            except Exception:
+                # No job will claim the batch; end it so the sender's next text starts a new one
+                abandon_batch(redis_conn, payload.get('From'), job_id)
+                raise
+        else:
+            status = "coalesced"
+            job_id = batch_job_id
+            if message_sid:
+                point_message_sid(redis_conn, message_sid, job_id, Config.WEBHOOK_DEDUP_TTL)
         processing_time = (datetime.utcnow() - start_time).total_seconds()
         update_processing_stats(redis_conn, processing_time, True)
-        return jsonify({"status": "queued", "job_id": job.id}), 200
+        maybe_record_pool_stats(redis_conn, 'web', redis_helper.pool_stats(), Config.POOL_STATS_INTERVAL)
+        return jsonify({"status": status, "job_id": job_id}), 200
+    except (RedisConnectionError, RedisTimeoutError) as e:
+        # The circuit breaker has recorded the failure; later requests fail fast
+        logger.error(f"Queue system unavailable while enqueueing webhook: {str(e)}")
+        if message_sid:
+            release_message_sid(redis_conn, message_sid, job_id)
+        return jsonify({"error": "Queue system unavailable"}), 503
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
         if redis_conn:
             update_processing_stats(redis_conn, 0, False)
+            if message_sid:
+                # Nothing was queued, so let Twilio's retry through
+                release_message_sid(redis_conn, message_sid, job_id)
         return jsonify({"error": str(e)}), 500
-
-with app.app_context():
-    db.create_all()
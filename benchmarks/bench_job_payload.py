@@ -0,0 +1,84 @@
+"""Job size and enqueue latency: pickled request.form vs the compact JSON payload.
+
+Enqueues the same inbound SMS webhook both ways, as the webhook did before
+(the whole werkzeug form, pickled) and does now (build_payload with the
+compact JSON serializer), and reports the bytes stored per job hash and the
+enqueue latency. Run from the repository root:
+
+    python benchmarks/bench_job_payload.py --jobs 5000
+
+Needs Redis (REDIS_URL); it only touches its own bench_* queues and deletes
+them afterwards.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redis import Redis
+from rq import Queue
+from werkzeug.datastructures import ImmutableMultiDict
+
+from config import Config
+from utils.job_payload import CompactJSONSerializer, build_payload
+
+FUNC = 'utils.twilio_handler.process_twilio_webhook'
+
+def twilio_form():
+    """A webhook body as Twilio posts it for an inbound SMS"""
+    account = 'AC' + uuid.uuid4().hex
+    return ImmutableMultiDict({
+        'ToCountry': 'US', 'ToState': 'CA', 'SmsMessageSid': 'SM' + uuid.uuid4().hex,
+        'NumMedia': '0', 'ToCity': 'SAN FRANCISCO', 'FromZip': '94105', 'SmsSid': 'SM' + uuid.uuid4().hex,
+        'FromState': 'CA', 'SmsStatus': 'received', 'FromCity': 'SAN FRANCISCO',
+        'Body': 'Hi, is my order #48213 shipping today? I need it by Friday.',
+        'FromCountry': 'US', 'To': '+14155550100', 'MessagingServiceSid': 'MG' + uuid.uuid4().hex,
+        'ToZip': '94107', 'NumSegments': '1', 'ReferralNumMedia': '0',
+        'MessageSid': 'SM' + uuid.uuid4().hex, 'AccountSid': account,
+        'From': '+14155550123', 'ApiVersion': '2010-04-01',
+    })
+
+def job_bytes(redis_conn, job_id):
+    return sum(len(field) + len(value) for field, value in redis_conn.hgetall(f"rq:job:{job_id}").items())
+
+def run(queue, jobs, make_args):
+    latencies, sizes = [], []
+    for _ in range(jobs):
+        args = make_args(twilio_form())
+        start = time.perf_counter()
+        job = queue.enqueue(FUNC, *args)
+        latencies.append((time.perf_counter() - start) * 1000)
+        sizes.append(job_bytes(queue.connection, job.id))
+    return latencies, sizes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=2000)
+    args = parser.parse_args()
+
+    redis_conn = Redis.from_url(Config.REDIS_URL)
+    variants = [
+        ('pickled form', Queue('bench_pickled_form', connection=redis_conn),
+         lambda form: (form, 0)),
+        ('json payload', Queue('bench_json_payload', connection=redis_conn, serializer=CompactJSONSerializer),
+         lambda form: (build_payload(form), 0)),
+    ]
+    print(f"{args.jobs} jobs per variant")
+    print(f"{'variant':<16}{'bytes/job':>11}{'p50 ms':>9}{'p99 ms':>9}")
+    try:
+        for name, queue, make_args in variants:
+            latencies, sizes = run(queue, args.jobs, make_args)
+            latencies.sort()
+            print(f"{name:<16}{statistics.mean(sizes):>11.0f}{latencies[len(latencies) // 2]:>9.3f}"
+                  f"{latencies[int(len(latencies) * 0.99)]:>9.3f}")
+    finally:
+        for _, queue, _ in variants:
+            queue.empty()
+            queue.delete(delete_jobs=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Dashboard and sender queries with and without the message/number indexes.
+
+Seeds a throwaway database, times each query with the indexes dropped, then
+recreates them and times again. Run from the repository root:
+
+    python benchmarks/bench_message_indexes.py --rows 1000000
+
+Uses BENCH_DATABASE_URL if set, otherwise a temporary SQLite file. Point it
+at a scratch database only: the tables are dropped and recreated.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, select
+
+from models import Message, TwilioNumber, db
+
+NUMBERS = 50
+SENDERS = 20000
+STATUSES = ['completed'] * 90 + ['failed'] * 8 + ['processing'] * 2
+BATCH = 10000
+REPEAT = 20
+
+def seed(engine, rows, rng):
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(TwilioNumber), [
+            {'id': i + 1, 'phone_number': f"+1555{i:07d}", 'priority': rng.randint(0, 3),
+             'is_active': i % 5 != 0, 'daily_message_count': rng.randint(0, 500)}
+            for i in range(NUMBERS)
+        ])
+        start = datetime.utcnow() - timedelta(days=90)
+        for offset in range(0, rows, BATCH):
+            conn.execute(insert(Message), [
+                {'from_number': f"+1444{rng.randrange(SENDERS):07d}",
+                 'to_number': f"+1555{rng.randrange(NUMBERS):07d}",
+                 'content': 'hello', 'response': 'hi', 'status': rng.choice(STATUSES),
+                 'timestamp': start + timedelta(seconds=offset + i * 7.7),
+                 'twilio_number_id': rng.randint(1, NUMBERS)}
+                for i in range(min(BATCH, rows - offset))
+            ])
+
+def queries():
+    return {
+        'dashboard latest 50': select(Message).order_by(Message.timestamp.desc()).limit(50),
+        'sender history': select(Message).where(Message.from_number == '+14440000042')
+            .order_by(Message.timestamp.desc()).limit(20),
+        'failed messages': select(Message).where(Message.status == 'failed').limit(50),
+        'messages per number': select(Message.id).where(Message.twilio_number_id == 7).limit(100),
+        'sender selection': select(TwilioNumber).where(TwilioNumber.is_active.is_(True))
+            .order_by(TwilioNumber.priority.desc(), TwilioNumber.daily_message_count).limit(1),
+    }
+
+def indexes():
+    return [index for table in (Message.__table__, TwilioNumber.__table__) for index in table.indexes]
+
+def time_queries(engine):
+    results = {}
+    with engine.connect() as conn:
+        for name, query in queries().items():
+            conn.execute(query).fetchall()  # warm the cache
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                conn.execute(query).fetchall()
+            results[name] = (time.perf_counter() - start) / REPEAT * 1000
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    url = os.environ.get('BENCH_DATABASE_URL')
+    if not url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_engine(url)
+
+    print(f"Seeding {args.rows} messages into {engine.url.render_as_string(hide_password=True)}")
+    seed(engine, args.rows, random.Random(42))
+
+    for index in indexes():
+        index.drop(engine)
+    without = time_queries(engine)
+
+    for index in indexes():
+        index.create(engine)
+    with_indexes = time_queries(engine)
+
+    print(f"{'query':<22} {'no index ms':>12} {'indexed ms':>11} {'speedup':>8}")
+    for name in without:
+        print(f"{name:<22} {without[name]:>12.3f} {with_indexes[name]:>11.3f} "
+              f"{without[name] / with_indexes[name]:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
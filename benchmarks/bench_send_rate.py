@@ -0,0 +1,106 @@
+"""Outbound send throughput against a fake Twilio, with and without the rate limiter.
+
+Starts benchmarks/fake_twilio.py in-process (1 msg/s per number, like a long
+code), then pushes the same burst of replies through send_message from many
+threads: once with each number's token bucket enforced and once unlimited.
+Rate limited sends are retried after the reported delay, as the worker does
+with a deferred job. Run from the repository root:
+
+    python benchmarks/bench_send_rate.py --messages 60 --numbers 3
+
+Needs Redis (REDIS_URL) and rebuilds the sender pool there, so point it at a
+scratch instance. Numbers are kept in a temporary SQLite database.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_twilio import FakeTwilio
+
+fake = FakeTwilio(rate=1.0).start()
+os.environ['TWILIO_API_BASE_URL'] = fake.base_url
+os.environ.setdefault('TWILIO_ACCOUNT_SID', 'AC' + '0' * 32)
+os.environ.setdefault('TWILIO_AUTH_TOKEN', 'bench')
+os.environ.setdefault('OPENAI_API_KEY', 'bench')
+
+from flask import Flask
+
+from models import TwilioNumber, db
+from utils.redis_helper import get_redis_connection
+from utils.sender_allocator import rebuild_sender_pool, SenderRateLimited
+from utils.twilio_handler import send_message
+
+def make_app(numbers):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            TwilioNumber(phone_number=f"+1555{i:07d}", priority=0, is_active=True, daily_message_count=0)
+            for i in range(numbers)
+        ])
+        db.session.commit()
+    return app
+
+def run(app, messages, threads, send_rate):
+    with app.app_context():
+        TwilioNumber.query.update({TwilioNumber.send_rate: send_rate, TwilioNumber.daily_message_count: 0})
+        db.session.commit()
+        rebuild_sender_pool(get_redis_connection())
+    fake.accepted.clear()
+    fake.rejected.clear()
+
+    pending = list(range(messages))
+    lock = threading.Lock()
+    deferrals = [0]
+
+    def worker():
+        with app.app_context():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    pending.pop()
+                while True:
+                    try:
+                        send_message('+14440000001', 'benchmark reply')
+                        break
+                    except SenderRateLimited as e:
+                        with lock:
+                            deferrals[0] += 1
+                        time.sleep(e.retry_after + random.uniform(0, 0.1))
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stats = fake.stats()
+    return elapsed, sum(stats['accepted'].values()), sum(stats['rejected'].values()), deferrals[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=60)
+    parser.add_argument('--numbers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app(args.numbers)
+    print(f"{args.messages} replies, {args.numbers} numbers at {fake.rate:g} msg/s each, {args.threads} threads")
+    print(f"{'mode':<12}{'seconds':>10}{'sent':>8}{'sent/s':>9}{'429s':>8}{'deferred':>10}")
+    for mode, send_rate in (('limited', fake.rate), ('unlimited', 0)):
+        elapsed, accepted, rejected, deferrals = run(app, args.messages, args.threads, send_rate)
+        print(f"{mode:<12}{elapsed:>10.2f}{accepted:>8}{accepted / elapsed:>9.2f}{rejected:>8}{deferrals:>10}")
+    fake.stop()
+
+if __name__ == '__main__':
+    main()
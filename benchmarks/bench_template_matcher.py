@@ -0,0 +1,76 @@
+"""Template matching latency: per-template keyword scan vs the compiled matcher.
+
+Run from the repository root:
+
+    python benchmarks/bench_template_matcher.py
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.template_matcher import KeywordMatcher, TemplateMatch
+
+KEYWORDS_PER_TEMPLATE = 4
+MESSAGES = 2000
+
+def _word(rng, length=8):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+def make_templates(count, rng):
+    return [
+        (TemplateMatch(i, f"template-{i}", f"response {i}"),
+         ','.join(_word(rng) for _ in range(KEYWORDS_PER_TEMPLATE)))
+        for i in range(count)
+    ]
+
+def make_messages(templates, rng):
+    messages = []
+    for i in range(MESSAGES):
+        words = [_word(rng, rng.randint(2, 9)) for _ in range(20)]
+        # Roughly a third of the traffic hits a template
+        if i % 3 == 0:
+            _, keywords = rng.choice(templates)
+            words.insert(rng.randrange(len(words)), rng.choice(keywords.split(',')).upper())
+        messages.append(' '.join(words))
+    return messages
+
+def scan_match(templates, message):
+    """The previous implementation: re-split every template for every message"""
+    for template, trigger_keywords in templates:
+        keywords = [k.strip().lower() for k in trigger_keywords.split(',')]
+        message_lower = message.lower()
+        if any(keyword in message_lower for keyword in keywords):
+            return template
+    return None
+
+def _per_message_us(func, messages):
+    start = time.perf_counter()
+    for message in messages:
+        func(message)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+def main():
+    rng = random.Random(42)
+    print(f"{'templates':>10} {'scan us/msg':>12} {'compiled us/msg':>16} {'build ms':>9} {'speedup':>8}")
+    for count in (10, 100, 1000):
+        templates = make_templates(count, rng)
+        messages = make_messages(templates, rng)
+
+        start = time.perf_counter()
+        matcher = KeywordMatcher(templates)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        for message in messages:
+            expected = scan_match(templates, message)
+            assert matcher.match(message) == expected, message
+
+        scan_us = _per_message_us(lambda m: scan_match(templates, m), messages)
+        compiled_us = _per_message_us(matcher.match, messages)
+        print(f"{count:>10} {scan_us:>12.1f} {compiled_us:>16.1f} {build_ms:>9.2f} {scan_us / compiled_us:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""A local stand-in for the OpenAI chat completions API with configurable latency and errors.
+
+Answers POST /v1/chat/completions like OpenAI does: the first token comes
+after ``latency`` seconds (plus up to ``jitter``) and each further word after
+``token_interval``, sent as server-sent events when the request asks to
+stream. A share of calls fails with a 500 when ``error_rate`` is set. Point
+the app at it with OPENAI_BASE_URL:
+
+    python benchmarks/fake_openai.py --port 8098 --latency 0.8 --token-interval 0.03
+    OPENAI_BASE_URL=http://127.0.0.1:8098/v1 python worker.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = ("Thanks for your message. I have looked up your order and it left our warehouse yesterday "
+         "afternoon. Delivery usually takes two to three business days, so it should reach you by Friday. "
+         "You can follow it from the tracking link in your confirmation email. "
+         "A member of our team will follow up if anything changes.")
+
+class FakeOpenAI:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.5,
+                 jitter: float = 0.0, error_rate: float = 0.0, token_interval: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors}
+
+    def start(self) -> 'FakeOpenAI':
+        threading.Thread(target=self.server.serve_forever, name='fake-openai', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.endswith('/chat/completions'):
+                    self._reply(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+                    return
+
+                time.sleep(fake.latency + random.uniform(0, fake.jitter))
+                with fake._lock:
+                    fake.calls += 1
+                    failed = random.random() < fake.error_rate
+                    if failed:
+                        fake.errors += 1
+                if failed:
+                    self._reply(500, {'error': {'message': 'Injected failure', 'type': 'server_error'}})
+                    return
+
+                tokens = REPLY.split(' ')
+                if request.get('stream'):
+                    self._stream(request, tokens)
+                    return
+                time.sleep(fake.token_interval * (len(tokens) - 1))
+                prompt = ' '.join(str(message.get('content', '')) for message in request.get('messages', []))
+                self._reply(200, {
+                    'id': 'chatcmpl-' + uuid.uuid4().hex,
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': request.get('model', 'gpt-4'),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': REPLY},
+                        'finish_reason': 'stop',
+                    }],
+                    'usage': {
+                        'prompt_tokens': len(prompt) // 4,
+                        'completion_tokens': len(REPLY) // 4,
+                        'total_tokens': (len(prompt) + len(REPLY)) // 4,
+                    },
+                })
+
+            def _stream(self, request, tokens):
+                completion_id = 'chatcmpl-' + uuid.uuid4().hex
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+
+                def event(delta, finish_reason=None):
+                    chunk = {
+                        'id': completion_id,
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': request.get('model', 'gpt-4'),
+                        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+
+                event({'role': 'assistant', 'content': ''})
+                for index, token in enumerate(tokens):
+                    if index:
+                        time.sleep(fake.token_interval)
+                    event({'content': token if index == 0 else ' ' + token})
+                event({}, 'stop')
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--latency', type=float, default=0.5, help="seconds to the first token")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many seconds added at random")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of calls answered with a 500")
+    parser.add_argument('--token-interval', type=float, default=0.0, help="seconds between streamed words")
+    args = parser.parse_args()
+    fake = FakeOpenAI(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      token_interval=args.token_interval)
+    print(f"Fake OpenAI listening on {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
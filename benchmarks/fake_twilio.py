@@ -0,0 +1,139 @@
+"""A local stand-in for the Twilio Messages API that enforces per-number throughput.
+
+Accepts POST /2010-04-01/Accounts/<sid>/Messages.json like Twilio does and
+answers 429 when a From number sends faster than its rate, so sending code
+can be load tested without a Twilio account. ``error_rate`` fails a share of
+sends with a 500. GET /stats returns the counts.
+Run standalone and point the app at it with TWILIO_API_BASE_URL:
+
+    python benchmarks/fake_twilio.py --port 8099 --rate 1
+    TWILIO_API_BASE_URL=http://127.0.0.1:8099 python worker.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+JITTER_ALLOWANCE = 0.05  # seconds a send may arrive early, as network delay varies
+
+class FakeTwilio:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, rate: float = 1.0, latency: float = 0.0,
+                 error_rate: float = 0.0):
+        self.rate = rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.accepted = Counter()
+        self.rejected = Counter()
+        self.errors = 0
+        self.delivered = {}  # To number -> monotonic time of its first accepted message
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self, from_number: str, to_number: str = '') -> bool:
+        """Twilio-style per-number limit: one message every 1/rate seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_allowed.get(from_number, 0) - JITTER_ALLOWANCE:
+                self.rejected[from_number] += 1
+                return False
+            self._next_allowed[from_number] = max(now, self._next_allowed.get(from_number, 0)) + 1 / self.rate
+            self.accepted[from_number] += 1
+            self.delivered.setdefault(to_number, now)
+            return True
+
+    def fail(self) -> bool:
+        """Whether to answer this send with an injected server error"""
+        with self._lock:
+            failed = random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def deliveries(self):
+        """To number -> monotonic time its first message was accepted"""
+        with self._lock:
+            return dict(self.delivered)
+
+    def stats(self):
+        with self._lock:
+            return {'accepted': dict(self.accepted), 'rejected': dict(self.rejected), 'errors': self.errors}
+
+    def start(self) -> 'FakeTwilio':
+        threading.Thread(target=self.server.serve_forever, name='fake-twilio', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == '/stats':
+                    self._reply(200, fake.stats())
+                else:
+                    self._reply(404, {'code': 20404, 'message': 'Not Found', 'status': 404})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                if not self.path.endswith('/Messages.json'):
+                    self._reply(404, {'code': 20404, 'message': 'Not Found', 'status': 404})
+                    return
+                if fake.latency:
+                    time.sleep(fake.latency)
+                from_number = form.get('From', '')
+                if fake.fail():
+                    self._reply(500, {'code': 20500, 'message': 'Internal Server Error', 'status': 500})
+                    return
+                if not fake.admit(from_number, form.get('To', '')):
+                    self._reply(429, {'code': 20429, 'message': 'Too Many Requests', 'status': 429})
+                    return
+                self._reply(201, {
+                    'sid': 'SM' + uuid.uuid4().hex,
+                    'from': from_number,
+                    'to': form.get('To'),
+                    'body': form.get('Body'),
+                    'status': 'queued',
+                })
+
+        return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--rate', type=float, default=1.0, help="messages per second accepted per From number")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every send")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of sends answered with a 500")
+    args = parser.parse_args()
+    fake = FakeTwilio(port=args.port, rate=args.rate, latency=args.latency, error_rate=args.error_rate)
+    print(f"Fake Twilio listening on {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,369 @@
+"""End-to-end load test: webhook traffic through the app and workers to a fake Twilio.
+
+Starts fake Twilio and OpenAI servers in-process (see fake_twilio.py and
+fake_openai.py), then ``main.py`` and N ``worker.py`` processes pointed at
+them, and posts synthetic inbound SMS webhooks at a fixed rate. Every message
+comes from its own sender, so its reply is matched at the fake Twilio to time
+the whole trip. Reports:
+
+- webhook latency (p50/p90/p99/max) and errors
+- end-to-end latency from webhook to the first reply SMS reaching Twilio
+- worker throughput in replies per second
+- Redis commands and database operations per message
+
+Run from the repository root:
+
+    python benchmarks/loadtest.py --rate 20 --duration 30 --workers 4 --flush-redis
+
+Needs a real Redis (REDIS_URL): RQ workers run in their own processes, which
+fakeredis cannot serve. Use a scratch instance; the run refuses to start on
+a non-empty database unless --flush-redis is given. The database is a
+temporary SQLite file unless BENCH_DATABASE_URL is set; database operation
+counts come from pg_stat_database, so they are only reported on Postgres.
+
+Results are written as JSON to benchmarks/results/ (or --output) together with
+the commit they were measured on; pass --baseline with an earlier file to see
+the change per metric.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from redis import Redis
+from sqlalchemy import create_engine, text
+
+from fake_openai import FakeOpenAI
+from fake_twilio import FakeTwilio
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+BUSINESS_NUMBER = '+15550000000'
+# No template keywords, so every message goes through the LLM
+BODY = "Hi, I placed an order last week and wanted to check on delivery for reference {n}."
+
+# Metrics compared against a baseline; True when higher is better
+COMPARED_METRICS = {
+    'webhook.p50_ms': False,
+    'webhook.p99_ms': False,
+    'end_to_end.p50_ms': False,
+    'end_to_end.p99_ms': False,
+    'throughput.replies_per_second': True,
+    'redis.commands_per_message': False,
+    'database.transactions_per_message': False,
+    'database.rows_written_per_message': False,
+}
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+def latency_summary(seconds):
+    millis = [value * 1000 for value in seconds]
+    return {
+        'count': len(millis),
+        'p50_ms': percentile(millis, 50),
+        'p90_ms': percentile(millis, 90),
+        'p99_ms': percentile(millis, 99),
+        'max_ms': max(millis) if millis else None,
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def redis_commands(redis_conn):
+    return redis_conn.info('stats')['total_commands_processed']
+
+def database_counters(engine):
+    """Cumulative transaction and row counters for the database, or None if not Postgres"""
+    if engine.dialect.name != 'postgresql':
+        return None
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_stat_clear_snapshot()"))
+        row = conn.execute(text(
+            "SELECT xact_commit + xact_rollback, tup_fetched, tup_inserted, tup_updated, tup_deleted "
+            "FROM pg_stat_database WHERE datname = current_database()")).one()
+    return dict(zip(['transactions', 'rows_fetched', 'rows_inserted', 'rows_updated', 'rows_deleted'], row))
+
+def seed_database(env, engine, numbers, send_rate):
+    """Migrate and seed through init_db.py, then add sender numbers at the given rate"""
+    subprocess.run([sys.executable, 'init_db.py'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    with engine.begin() as conn:
+        for i in range(1, numbers):
+            conn.execute(text(
+                "INSERT INTO twilio_number (phone_number, friendly_name, priority, is_active, "
+                "daily_message_count, send_rate) VALUES (:phone, :name, 0, :active, 0, :rate)"),
+                {'phone': f"+1555000{i:04d}", 'name': f"Load test {i}", 'active': True, 'rate': send_rate})
+        conn.execute(text("UPDATE twilio_number SET send_rate = :rate"), {'rate': send_rate})
+
+def wait_for_app(base_url, processes, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if any(process.poll() is not None for process in processes):
+            raise RuntimeError("a load test process exited during startup")
+        try:
+            urllib.request.urlopen(f"{base_url}/login", timeout=1).close()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f"app did not answer on {base_url} within {timeout}s")
+
+def post_webhook(url, sender, n):
+    form = urllib.parse.urlencode({
+        'From': sender,
+        'To': BUSINESS_NUMBER,
+        'Body': BODY.format(n=n),
+        'MessageSid': 'SM' + uuid.uuid4().hex,
+        'NumMedia': '0',
+    }).encode('utf-8')
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(url, data=form, timeout=10) as response:
+            ok = response.status == 200
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        ok = False
+    return start, time.monotonic() - start, ok
+
+def generate_traffic(url, rate, duration, threads):
+    """Post webhooks open-loop at a fixed rate; returns sender -> (sent at, latency, ok)"""
+    results = {}
+    lock = threading.Lock()
+
+    def send(sender, n):
+        outcome = post_webhook(url, sender, n)
+        with lock:
+            results[sender] = outcome
+
+    total = int(rate * duration)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for n in range(total):
+            delay = start + n / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, f"+1999{n:07d}", n)
+    return results
+
+def summarize(sent, twilio, openai, redis_delta, db_before, db_after, traffic_seconds):
+    webhook_ok = [latency for _, latency, ok in sent.values() if ok]
+    accepted = {sender: started for sender, (started, _, ok) in sent.items() if ok}
+    deliveries = twilio.deliveries()
+    delivered = {sender: deliveries[sender] for sender in accepted if sender in deliveries}
+    end_to_end = [delivered[sender] - accepted[sender] for sender in delivered]
+
+    throughput = None
+    if delivered:
+        elapsed = max(delivered.values()) - min(accepted.values())
+        throughput = len(delivered) / elapsed if elapsed > 0 else None
+
+    database = None
+    if db_before is not None and db_after is not None and accepted:
+        delta = {key: db_after[key] - db_before[key] for key in db_before}
+        database = {
+            **delta,
+            'transactions_per_message': delta['transactions'] / len(accepted),
+            'rows_written_per_message':
+                (delta['rows_inserted'] + delta['rows_updated'] + delta['rows_deleted']) / len(accepted),
+        }
+
+    twilio_stats = twilio.stats()
+    return {
+        'webhook': {
+            **latency_summary(webhook_ok),
+            'sent': len(sent),
+            'errors': len(sent) - len(webhook_ok),
+            'achieved_rate': len(sent) / traffic_seconds if traffic_seconds else None,
+        },
+        'end_to_end': {
+            **latency_summary(end_to_end),
+            'undelivered': len(accepted) - len(delivered),
+        },
+        'throughput': {
+            'replies': len(delivered),
+            'replies_per_second': throughput,
+        },
+        'redis': {
+            'commands': redis_delta,
+            'commands_per_message': redis_delta / len(accepted) if accepted else None,
+        },
+        'database': database,
+        'fake_openai': openai.stats(),
+        'fake_twilio': {
+            'accepted': sum(twilio_stats['accepted'].values()),
+            'rejected': sum(twilio_stats['rejected'].values()),
+            'errors': twilio_stats['errors'],
+        },
+    }
+
+def metric(results, path):
+    value = results
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+def print_report(results, baseline=None):
+    webhook, e2e = results['webhook'], results['end_to_end']
+    print(f"webhooks      {webhook['sent']} sent at {webhook['achieved_rate'] or 0:.1f}/s, {webhook['errors']} errors")
+    for path, better_higher in COMPARED_METRICS.items():
+        value = metric(results, path)
+        if value is None:
+            continue
+        line = f"{path:<38}{value:>12.2f}"
+        previous = metric(baseline['results'], path) if baseline else None
+        if previous:
+            change = (value - previous) / previous * 100
+            worse = change < 0 if better_higher else change > 0
+            line += f"   {change:+7.1f}% vs {baseline['commit']}{'  (worse)' if worse and abs(change) >= 5 else ''}"
+        print(line)
+    print(f"{'undelivered replies':<38}{e2e['undelivered']:>12}")
+
+def stop_processes(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    deadline = time.monotonic() + 10
+    for process in processes:
+        try:
+            process.wait(timeout=max(deadline - time.monotonic(), 0.1))
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=10, help="webhooks per second")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of traffic")
+    parser.add_argument('--workers', type=int, default=2, help="worker.py processes")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="run workers in async mode")
+    parser.add_argument('--numbers', type=int, default=5, help="sender numbers in the pool")
+    parser.add_argument('--send-rate', type=float, default=100, help="messages per second per sender number")
+    parser.add_argument('--openai-latency', type=float, default=0.5)
+    parser.add_argument('--openai-jitter', type=float, default=0.2)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--openai-token-interval', type=float, default=0.03, help="seconds between generated words")
+    parser.add_argument('--stream', action='store_true', help="stream replies as SMS segments (STREAM_REPLIES)")
+    parser.add_argument('--twilio-latency', type=float, default=0.05)
+    parser.add_argument('--twilio-error-rate', type=float, default=0.0)
+    parser.add_argument('--threads', type=int, default=64, help="concurrent webhook requests at most")
+    parser.add_argument('--drain-timeout', type=float, default=60, help="seconds to wait for replies after traffic")
+    parser.add_argument('--flush-redis', action='store_true', help="empty the Redis database before the run")
+    parser.add_argument('--output', help="results file (default: benchmarks/results/loadtest-<commit>-<time>.json)")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+    redis_conn = Redis.from_url(redis_url)
+    if redis_conn.dbsize() and not args.flush_redis:
+        sys.exit(f"Redis at {redis_url} is not empty; use a scratch database or pass --flush-redis")
+    redis_conn.flushdb()
+
+    database_url = os.environ.get('BENCH_DATABASE_URL') or f"sqlite:///{tempfile.mkdtemp()}/loadtest.db"
+    engine = create_engine(database_url)
+
+    twilio = FakeTwilio(rate=args.send_rate, latency=args.twilio_latency,
+                        error_rate=args.twilio_error_rate).start()
+    openai = FakeOpenAI(latency=args.openai_latency, jitter=args.openai_jitter,
+                        error_rate=args.openai_error_rate, token_interval=args.openai_token_interval).start()
+    port = free_port()
+    env = {
+        **os.environ,
+        'DATABASE_URL': database_url,
+        'REDIS_URL': redis_url,
+        'PORT': str(port),
+        'TWILIO_API_BASE_URL': twilio.base_url,
+        'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32,
+        'TWILIO_AUTH_TOKEN': 'loadtest',
+        'TWILIO_PHONE_NUMBER': BUSINESS_NUMBER,
+        'OPENAI_BASE_URL': openai.base_url,
+        'OPENAI_API_KEY': 'loadtest',
+        'COALESCE_WINDOW': '0',
+        'STREAM_REPLIES': 'true' if args.stream else 'false',
+        'DEFAULT_SEND_RATE': str(args.send_rate),
+    }
+    seed_database(env, engine, args.numbers, args.send_rate)
+
+    worker_args = [sys.executable, 'worker.py'] + (['--async'] if args.use_async else [])
+    processes = [subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+    processes += [subprocess.Popen(worker_args, cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                  for _ in range(args.workers)]
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_for_app(base_url, processes)
+
+        # Idle workers poll Redis too; measure that so it can be taken out
+        idle_start, idle_commands = time.monotonic(), redis_commands(redis_conn)
+        time.sleep(2)
+        idle_rate = (redis_commands(redis_conn) - idle_commands) / (time.monotonic() - idle_start)
+
+        print(f"{args.rate:g} webhooks/s for {args.duration:g}s, {args.workers} "
+              f"{'async' if args.use_async else 'forking'} workers")
+        db_before = database_counters(engine)
+        commands_before, started = redis_commands(redis_conn), time.monotonic()
+        sent = generate_traffic(f"{base_url}/webhook/twilio", args.rate, args.duration, args.threads)
+        traffic_seconds = time.monotonic() - started
+
+        accepted = {sender for sender, (_, _, ok) in sent.items() if ok}
+        deadline = time.monotonic() + args.drain_timeout
+        while time.monotonic() < deadline and not accepted <= twilio.deliveries().keys():
+            time.sleep(0.2)
+        redis_delta = redis_commands(redis_conn) - commands_before
+        redis_delta = max(int(redis_delta - idle_rate * (time.monotonic() - started)), 0)
+        time.sleep(1)  # Postgres publishes its statistics about once a second
+        db_after = database_counters(engine)
+        results = summarize(sent, twilio, openai, redis_delta, db_before, db_after, traffic_seconds)
+    finally:
+        stop_processes(processes)
+        twilio.stop()
+        openai.stop()
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {**vars(args), 'database': engine.dialect.name},
+        'results': results,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"loadtest-{commit}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
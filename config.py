@@ -15,6 +15,65 @@ class Config:
     TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
     TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
     TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER")
+    SENDER_USAGE_FLUSH_INTERVAL = float(os.environ.get("SENDER_USAGE_FLUSH_INTERVAL", 30))  # seconds
+    TWILIO_API_BASE_URL = os.environ.get("TWILIO_API_BASE_URL")  # e.g. a local fake Twilio for load tests
+    WEBHOOK_DEDUP_TTL = int(os.environ.get("WEBHOOK_DEDUP_TTL", 86400))  # seconds a MessageSid is remembered
+
+    # Send rate limiting
+    DEFAULT_SEND_RATE = float(os.environ.get("DEFAULT_SEND_RATE", 1))  # messages/s for numbers without a rate
+    SEND_BURST_SECONDS = float(os.environ.get("SEND_BURST_SECONDS", 1))  # unused rate a number may save up
+    SEND_RETRY_AFTER = float(os.environ.get("SEND_RETRY_AFTER", 1))  # seconds to wait after a Twilio 429
+    SEND_MAX_DEFERRALS = int(os.environ.get("SEND_MAX_DEFERRALS", 30))  # before a reply is marked failed
     
     # OpenAI
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+    STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "false").lower() == "true"  # send replies as SMS segments as they stream
+
+    # Conversation window
+    CONVERSATION_MAX_MESSAGES = int(os.environ.get("CONVERSATION_MAX_MESSAGES", 20))  # per sender, replies included
+    CONVERSATION_TTL = int(os.environ.get("CONVERSATION_TTL", 86400))  # seconds since the last message
+    CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", 2000))  # history + new message
+
+    # Response cache
+    RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 86400))  # seconds
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    RESPONSE_CACHE_LOCAL_SIZE = int(os.environ.get("RESPONSE_CACHE_LOCAL_SIZE", 1000))  # entries per async worker; 0 = off
+
+    # Templates
+    TEMPLATE_USAGE_FLUSH_INTERVAL = float(os.environ.get("TEMPLATE_USAGE_FLUSH_INTERVAL", 30))  # seconds
+
+    # Worker
+    WORKER_MODE = os.environ.get("WORKER_MODE", "fork")  # "fork" (stock RQ) or "async"
+    WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 20))  # jobs in flight in async mode
+    JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 500))  # seconds finished jobs are kept; 0 = not kept
+
+    # Metrics
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # bearer token required by /metrics when set
+    POOL_STATS_INTERVAL = float(os.environ.get("POOL_STATS_INTERVAL", 15))  # seconds between pool stats reports
+
+    # Message coalescing
+    COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", 0))  # seconds to collect a sender's fragments; 0 = off
+
+    # Priority queues
+    # Share of dequeues each queue gets while all of them have work
+    QUEUE_WEIGHTS = {
+        name: int(weight) for name, weight in (
+            item.split(':') for item in os.environ.get(
+                "QUEUE_WEIGHTS", "messages_high:6,messages:3,messages_low:1"
+            ).split(',')
+        )
+    }
+    PRIORITY_SENDERS = {number.strip() for number in os.environ.get("PRIORITY_SENDERS", "").split(',') if number.strip()}
+    HIGH_PRIORITY_THRESHOLD = int(os.environ.get("HIGH_PRIORITY_THRESHOLD", 5))  # number priority at or above -> high queue
+    LOW_PRIORITY_THRESHOLD = int(os.environ.get("LOW_PRIORITY_THRESHOLD", -1))  # number priority at or below -> low queue
+
+    # Queue history
+    QUEUE_SAMPLE_INTERVAL = float(os.environ.get("QUEUE_SAMPLE_INTERVAL", 5))  # seconds; also the dashboard push cadence
+    QUEUE_SAMPLER_LOCK_TTL = float(os.environ.get("QUEUE_SAMPLER_LOCK_TTL", 30))  # seconds before a standby takes over
+
+    # Message persistence
+    MESSAGE_WRITE_MODE = os.environ.get("MESSAGE_WRITE_MODE", "immediate")  # "immediate" or "batched"
+    MESSAGE_WRITE_BATCH_SIZE = int(os.environ.get("MESSAGE_WRITE_BATCH_SIZE", 500))
+    MESSAGE_WRITE_FLUSH_INTERVAL = float(os.environ.get("MESSAGE_WRITE_FLUSH_INTERVAL", 2))  # seconds
+    INFLIGHT_REAP_INTERVAL = float(os.environ.get("INFLIGHT_REAP_INTERVAL", 60))  # seconds between checks for abandoned messages
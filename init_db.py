@@ -1,14 +1,12 @@
 from app import app, db
+from flask_migrate import upgrade
 from models import User, MessageTemplate, TwilioNumber
 import os
 
 def create_admin():
     with app.app_context():
-        # Drop all tables
-        db.drop_all()
-        
-        # Create tables in correct order
-        db.create_all()
+        # Bring the schema up to date; existing data is kept
+        upgrade()
         
         # Check if admin user exists
         if not User.query.filter_by(username='admin').first():
@@ -0,0 +1,39 @@
+"""message and twilio number indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 22:18:27.304916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_message_timestamp', 'message', ['timestamp']),
+    ('ix_message_from_number_timestamp', 'message', ['from_number', 'timestamp']),
+    ('ix_message_status', 'message', ['status']),
+    ('ix_message_twilio_number_id', 'message', ['twilio_number_id']),
+    ('ix_twilio_number_sender_selection', 'twilio_number', ['is_active', 'priority', 'daily_message_count']),
+]
+
+
+def upgrade():
+    # On Postgres build the indexes without locking out writes to a live table;
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=concurrently, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
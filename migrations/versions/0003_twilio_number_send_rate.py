@@ -0,0 +1,26 @@
+"""twilio number send rate
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 23:41:05.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('twilio_number', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('send_rate', sa.Float(), nullable=True, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('twilio_number', schema=None) as batch_op:
+        batch_op.drop_column('send_rate')
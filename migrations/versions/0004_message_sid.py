@@ -0,0 +1,34 @@
+"""message sid
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:27:43.902117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_sid', sa.String(length=34), nullable=True))
+
+    # Existing rows have no sid, and NULLs never collide, so the unique index
+    # can be built on a live table; on Postgres without blocking writes
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index('ix_message_message_sid', 'message', ['message_sid'], unique=True,
+                        postgresql_concurrently=concurrently, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_message_message_sid', table_name='message')
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_column('message_sid')
@@ -0,0 +1,54 @@
+"""message browsing indexes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 02:14:36.550817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+# /api/messages pages on (timestamp, id) under an optional filter, so each
+# filter column gets a (column, timestamp, id) index
+INDEXES = [
+    ('ix_message_timestamp_id', 'message', ['timestamp', 'id']),
+    ('ix_message_status_timestamp_id', 'message', ['status', 'timestamp', 'id']),
+    ('ix_message_from_number_timestamp_id', 'message', ['from_number', 'timestamp', 'id']),
+    ('ix_message_to_number_timestamp_id', 'message', ['to_number', 'timestamp', 'id']),
+    ('ix_message_template_used_timestamp_id', 'message', ['template_used', 'timestamp', 'id']),
+    ('ix_message_twilio_number_id_timestamp_id', 'message', ['twilio_number_id', 'timestamp', 'id']),
+]
+
+# Prefixes of the indexes above, dropped so every insert maintains fewer indexes
+REPLACED_INDEXES = [
+    ('ix_message_timestamp', 'message', ['timestamp']),
+    ('ix_message_status', 'message', ['status']),
+    ('ix_message_from_number_timestamp', 'message', ['from_number', 'timestamp']),
+    ('ix_message_twilio_number_id', 'message', ['twilio_number_id']),
+]
+
+
+def upgrade():
+    # Build the new indexes before dropping the ones they cover, without
+    # locking out writes on Postgres
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=concurrently, if_not_exists=True)
+        for name, table, _ in REPLACED_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=concurrently, if_exists=True)
+
+
+def downgrade():
+    for name, table, columns in REPLACED_INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
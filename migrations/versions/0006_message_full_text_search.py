@@ -0,0 +1,71 @@
+"""message full text search
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 03:02:51.417093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# Postgres computes the vector on every insert and update of the row; words
+# in the message rank above words in the reply
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce(content, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(response, '')), 'B')
+"""
+
+# SQLite keeps an external content FTS5 table in step with message. Triggers
+# are dropped when SQLite batch migrations rebuild the message table, so such
+# a migration has to recreate them
+SQLITE_TRIGGERS = [
+    """CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts (rowid, content, response) VALUES (new.id, new.content, new.response);
+    END""",
+    """CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content, response)
+        VALUES ('delete', old.id, old.content, old.response);
+    END""",
+    """CREATE TRIGGER message_fts_update AFTER UPDATE OF content, response ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content, response)
+        VALUES ('delete', old.id, old.content, old.response);
+        INSERT INTO message_fts (rowid, content, response) VALUES (new.id, new.content, new.response);
+    END""",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # Adding a stored generated column rewrites the table under an
+        # exclusive lock; the GIN index is then built without blocking writes
+        op.execute(f"ALTER TABLE message ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                   f"GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED")
+        with op.get_context().autocommit_block():
+            op.create_index('ix_message_search_vector', 'message', ['search_vector'], unique=False,
+                            postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+                   "content, response, content='message', content_rowid='id', tokenize='porter unicode61')")
+        for trigger in SQLITE_TRIGGERS:
+            op.execute(trigger)
+        # Index the messages stored so far
+        op.execute("INSERT INTO message_fts (message_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_message_search_vector', table_name='message')
+        op.execute("ALTER TABLE message DROP COLUMN search_vector")
+    elif dialect == 'sqlite':
+        for name in ('message_fts_insert', 'message_fts_delete', 'message_fts_update'):
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+        op.execute("DROP TABLE IF EXISTS message_fts")
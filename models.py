@@ -14,12 +14,18 @@ class User(UserMixin, db.Model):
         self.password_hash = generate_password_hash(password)
 
 class TwilioNumber(db.Model):
+    __table_args__ = (
+        # Sender selection: active numbers by priority, then by load
+        db.Index('ix_twilio_number_sender_selection', 'is_active', 'priority', 'daily_message_count'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), unique=True, nullable=False)
     friendly_name = db.Column(db.String(100))
     priority = db.Column(db.Integer, default=0)  # Higher number = higher priority
     is_active = db.Column(db.Boolean, default=True)
     daily_message_count = db.Column(db.Integer, default=0)
+    send_rate = db.Column(db.Float, default=1.0)  # Messages per second Twilio accepts from this number; 0 = no limit
     last_used = db.Column(db.DateTime)
     messages = db.relationship('Message', backref='twilio_number', lazy=True)
 
@@ -35,6 +41,17 @@ class MessageTemplate(db.Model):
     messages = db.relationship('Message', backref='template', lazy=True)
 
 class Message(db.Model):
+    __table_args__ = (
+        # Browsing newest first, keyed on (timestamp, id) and optionally filtered
+        # by one column; the from_number index also serves conversation history
+        db.Index('ix_message_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_message_status_timestamp_id', 'status', 'timestamp', 'id'),
+        db.Index('ix_message_from_number_timestamp_id', 'from_number', 'timestamp', 'id'),
+        db.Index('ix_message_to_number_timestamp_id', 'to_number', 'timestamp', 'id'),
+        db.Index('ix_message_template_used_timestamp_id', 'template_used', 'timestamp', 'id'),
+        db.Index('ix_message_twilio_number_id_timestamp_id', 'twilio_number_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     from_number = db.Column(db.String(20), nullable=False)
     to_number = db.Column(db.String(20), nullable=False)
@@ -46,3 +63,6 @@ class Message(db.Model):
     processed_at = db.Column(db.DateTime)
     template_used = db.Column(db.Integer, db.ForeignKey('message_template.id'), nullable=True)
     twilio_number_id = db.Column(db.Integer, db.ForeignKey('twilio_number.id'))
+    message_sid = db.Column(db.String(34), unique=True, index=True)  # Twilio MessageSid; one row per inbound message
+    # Full-text search lives outside the model: a generated search_vector column
+    # on Postgres, a message_fts table on SQLite (migration 0006)
@@ -0,0 +1,30 @@
+import signal
+import logging
+from config import Config
+from utils.redis_helper import RedisHelper
+from utils.queue_sampler import QueueStatsSampler
+from utils.priority_queues import get_queues
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def initialize_sampler():
+    redis_conn = RedisHelper().get_connection('stats')
+    if not redis_conn:
+        logger.error("Failed to connect to Redis - sampler cannot start")
+        return None
+    return QueueStatsSampler(redis_conn, get_queues(redis_conn),
+                             interval=Config.QUEUE_SAMPLE_INTERVAL,
+                             lock_ttl=Config.QUEUE_SAMPLER_LOCK_TTL)
+
+if __name__ == '__main__':
+    sampler = initialize_sampler()
+    if sampler:
+        signal.signal(signal.SIGTERM, lambda *_: sampler.stop())
+        try:
+            sampler.run()
+        except KeyboardInterrupt:
+            logger.info("Sampler stopped by user")
+    else:
+        logger.error("Failed to start sampler due to initialization errors")
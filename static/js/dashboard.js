@@ -6,7 +6,8 @@ const CONFIG = {
     retryAttempts: 3,
     retryDelay: 2000,
     updateInterval: 5000,
-    historyInterval: 60000
+    historyInterval: 60000,
+    streamRetryDelay: 30000
 };
 
 const CHART_DEFAULTS = {
@@ -92,39 +93,71 @@ function cleanupChart(chart) {
     return null;
 }
 
-async function updateQueueStats() {
-    try {
-        const data = await fetchWithRetry('/api/queue-stats');
-        
-        // Update queue stats
-        const queue = data?.queue || {};
-        for (const [key, value] of Object.entries(queue)) {
-            const element = document.getElementById(`${key}-count`);
-            if (element) {
-                element.textContent = value;
-            }
+function applyQueueStats(data) {
+    // Update queue stats
+    const queue = data?.queue || {};
+    for (const [key, value] of Object.entries(queue)) {
+        const element = document.getElementById(`${key}-count`);
+        if (element) {
+            element.textContent = value;
         }
+    }
 
-        // Update processing stats
-        const processing = data?.processing;
-        if (processing) {
-            const elements = {
-                'avg-processing-time': processing.avg_processing_time.toFixed(2) + 's',
-                'total-processed': processing.total_processed,
-                'success-rate': processing.success_rate.toFixed(1) + '%'
-            };
-
-            for (const [id, value] of Object.entries(elements)) {
-                const element = document.getElementById(id);
-                if (element) {
-                    element.textContent = value;
-                }
+    // Backlog indicators
+    const backlog = {
+        'oldest-job-age': queue.oldest_job_age !== undefined ? queue.oldest_job_age.toFixed(1) + 's' : null,
+        'jobs-per-second': queue.jobs_per_second !== undefined ? queue.jobs_per_second.toFixed(2) : null
+    };
+    for (const [id, value] of Object.entries(backlog)) {
+        const element = document.getElementById(id);
+        if (element && value !== null) {
+            element.textContent = value;
+        }
+    }
+
+    // Per-queue depth and wait time
+    const queueRows = document.getElementById('priority-queues');
+    if (queueRows && Array.isArray(queue.queues)) {
+        queueRows.replaceChildren(...queue.queues.map(item => {
+            const row = document.createElement('tr');
+            row.dataset.queue = item.name;
+            for (const value of [item.name, item.queued, item.started, item.oldest_job_age.toFixed(1) + 's']) {
+                const cell = document.createElement('td');
+                cell.textContent = value;
+                row.appendChild(cell);
             }
+            return row;
+        }));
+    }
 
-            if (processing.hourly_volume) {
-                updateVolumeChart(processing.hourly_volume);
+    // Update processing stats
+    const processing = data?.processing;
+    if (processing) {
+        const elements = {
+            'avg-processing-time': processing.avg_processing_time.toFixed(2) + 's',
+            'total-processed': processing.total_processed,
+            'success-rate': processing.success_rate.toFixed(1) + '%',
+            'duplicates-suppressed': processing.duplicates_suppressed ?? 0,
+            'time-to-first-sms': (processing.avg_time_to_first_sms ?? 0).toFixed(2) + 's'
+        };
+
+        for (const [id, value] of Object.entries(elements)) {
+            const element = document.getElementById(id);
+            if (element) {
+                element.textContent = value;
             }
         }
+
+        if (processing.hourly_volume) {
+            updateVolumeChart(processing.hourly_volume);
+        }
+    }
+}
+
+async function updateQueueStats() {
+    try {
+        const data = await fetchWithRetry('/api/queue-stats');
+        applyQueueStats(data);
     } catch (error) {
         console.warn('Queue stats temporarily unavailable:', error.message);
     }
@@ -266,24 +299,148 @@ function updateVolumeChart(volumeData) {
     });
 }
 
-// Update stats at regular intervals
+// Recent messages: older pages are loaded from /api/messages as the end of
+// the table scrolls into view, following the cursor each page returns
+let messagesObserver = null;
+let messagesLoading = false;
+
+function statusBadgeClass(status) {
+    if (status === 'completed') return 'bg-success';
+    if (status === 'processing') return 'bg-warning';
+    return 'bg-danger';
+}
+
+function createMessageRow(message) {
+    const row = document.createElement('tr');
+    const time = (message.timestamp || '').replace('T', ' ').slice(0, 19);
+    for (const value of [time, message.from_number, message.content]) {
+        const cell = document.createElement('td');
+        cell.textContent = value;
+        row.appendChild(cell);
+    }
+    const statusCell = document.createElement('td');
+    const badge = document.createElement('span');
+    badge.className = `badge ${statusBadgeClass(message.status)}`;
+    badge.textContent = message.status;
+    statusCell.appendChild(badge);
+    row.appendChild(statusCell);
+    return row;
+}
+
+async function loadMoreMessages() {
+    const table = document.getElementById('recent-messages');
+    const cursor = table?.dataset.nextCursor;
+    if (!cursor || messagesLoading) return;
+
+    messagesLoading = true;
+    const data = await fetchWithRetry(`/api/messages?cursor=${encodeURIComponent(cursor)}`);
+    messagesLoading = false;
+    // A failed fetch leaves the cursor in place to try again on the next scroll
+    if (!Array.isArray(data?.messages)) return;
+
+    document.getElementById('recent-messages-rows').append(...data.messages.map(createMessageRow));
+    table.dataset.nextCursor = data.next_cursor || '';
+    if (!data.next_cursor) {
+        document.getElementById('recent-messages-more').textContent = 'No older messages';
+        stopMessagesScroll();
+    } else if (messagesObserver) {
+        // Observing again reports the sentinel at once if it is still in view
+        const sentinel = document.getElementById('recent-messages-more');
+        messagesObserver.unobserve(sentinel);
+        messagesObserver.observe(sentinel);
+    }
+}
+
+function startMessagesScroll() {
+    const sentinel = document.getElementById('recent-messages-more');
+    if (!sentinel || !document.getElementById('recent-messages').dataset.nextCursor) return;
+    if (!window.IntersectionObserver) {
+        sentinel.textContent = '';
+        return;
+    }
+    messagesObserver = new IntersectionObserver((entries) => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMoreMessages();
+        }
+    }, { rootMargin: '200px' });
+    messagesObserver.observe(sentinel);
+}
+
+function stopMessagesScroll() {
+    if (messagesObserver) {
+        messagesObserver.disconnect();
+        messagesObserver = null;
+    }
+}
+
+// Live stats arrive over Server-Sent Events; polling is only used while the
+// stream is down or when the browser has no EventSource
+let statsStream = null;
+let streamRetryTimeout = null;
 let queueStatsInterval = null;
 let queueHistoryInterval = null;
 
-function startIntervals() {
+function startStatsPolling() {
     if (!queueStatsInterval) {
+        updateQueueStats();
         queueStatsInterval = setInterval(updateQueueStats, CONFIG.updateInterval);
     }
-    if (!queueHistoryInterval) {
-        queueHistoryInterval = setInterval(updateQueueHistory, CONFIG.historyInterval);
-    }
 }
 
-function stopIntervals() {
+function stopStatsPolling() {
     if (queueStatsInterval) {
         clearInterval(queueStatsInterval);
         queueStatsInterval = null;
     }
+}
+
+function openStatsStream() {
+    if (!window.EventSource) {
+        startStatsPolling();
+        return;
+    }
+    if (statsStream) return;
+
+    statsStream = new EventSource('/api/stream');
+    statsStream.addEventListener('open', stopStatsPolling);
+    statsStream.addEventListener('stats', (event) => {
+        try {
+            applyQueueStats(JSON.parse(event.data));
+        } catch (error) {
+            console.warn('Malformed stats event:', error.message);
+        }
+    });
+    statsStream.addEventListener('error', () => {
+        startStatsPolling();
+        // The browser reconnects on its own unless the server refused the stream
+        if (statsStream && statsStream.readyState === EventSource.CLOSED) {
+            closeStatsStream();
+            streamRetryTimeout = setTimeout(openStatsStream, CONFIG.streamRetryDelay);
+        }
+    });
+}
+
+function closeStatsStream() {
+    if (statsStream) {
+        statsStream.close();
+        statsStream = null;
+    }
+    if (streamRetryTimeout) {
+        clearTimeout(streamRetryTimeout);
+        streamRetryTimeout = null;
+    }
+}
+
+function startIntervals() {
+    openStatsStream();
+    if (!queueHistoryInterval) {
+        queueHistoryInterval = setInterval(updateQueueHistory, CONFIG.historyInterval);
+    }
+}
+
+function stopIntervals() {
+    closeStatsStream();
+    stopStatsPolling();
     if (queueHistoryInterval) {
         clearInterval(queueHistoryInterval);
         queueHistoryInterval = null;
@@ -292,14 +449,15 @@ function stopIntervals() {
 
 // Initial load
 document.addEventListener('DOMContentLoaded', () => {
-    updateQueueStats();
     updateQueueHistory();
     startIntervals();
+    startMessagesScroll();
 });
 
 // Cleanup on page unload
 window.addEventListener('unload', () => {
     stopIntervals();
+    stopMessagesScroll();
     cleanupChart(queueHistoryChart);
     cleanupChart(volumeChart);
 });
@@ -309,7 +467,6 @@ document.addEventListener('visibilitychange', () => {
     if (document.hidden) {
         stopIntervals();
     } else {
-        updateQueueStats();
         updateQueueHistory();
         startIntervals();
     }
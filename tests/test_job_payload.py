@@ -0,0 +1,55 @@
+import pickle
+
+import pytest
+from werkzeug.datastructures import ImmutableMultiDict
+
+from utils.job_payload import PAYLOAD_VERSION, CompactJSONSerializer, build_payload, read_payload
+
+FORM = ImmutableMultiDict({
+    'From': '+15550000001',
+    'To': '+15550000002',
+    'Body': 'Où est ma commande?',
+    'MessageSid': 'SM123',
+    'NumMedia': '1',
+    'AccountSid': 'AC123',
+    'SmsStatus': 'received',
+})
+
+
+def test_build_payload_keeps_only_the_fields_used():
+    assert build_payload(FORM) == {
+        'v': PAYLOAD_VERSION,
+        'From': '+15550000001',
+        'To': '+15550000002',
+        'Body': 'Où est ma commande?',
+        'MessageSid': 'SM123',
+        'NumMedia': 1,
+    }
+
+
+@pytest.mark.parametrize('num_media, expected', [(None, 0), ('', 0), ('2', 2), ('abc', 0), ('1.5', 0)])
+def test_build_payload_parses_num_media_defensively(num_media, expected):
+    form = {'From': '+1'} if num_media is None else {'From': '+1', 'NumMedia': num_media}
+    assert build_payload(form)['NumMedia'] == expected
+
+
+def test_serializer_round_trip_is_compact_json():
+    payload = build_payload(FORM)
+    data = CompactJSONSerializer.dumps(payload)
+    assert data.startswith(b'{"v":')  # no spaces after separators
+    assert 'Où'.encode('utf-8') in data  # not escaped
+    assert CompactJSONSerializer.loads(data) == payload
+    assert CompactJSONSerializer.loads(data.decode('utf-8')) == payload
+
+
+def test_serializer_reads_jobs_pickled_before_the_upgrade():
+    job_data = ('utils.twilio_handler.process_twilio_webhook', None, (FORM, 0), {})
+    loaded = CompactJSONSerializer.loads(pickle.dumps(job_data, protocol=pickle.HIGHEST_PROTOCOL))
+    func_name, _, args, _ = loaded
+    assert func_name == 'utils.twilio_handler.process_twilio_webhook'
+    assert read_payload(args[0]) == build_payload(FORM)
+
+
+def test_read_payload_rejects_unknown_versions():
+    with pytest.raises(ValueError):
+        read_payload({'v': PAYLOAD_VERSION + 1, 'From': '+1'})
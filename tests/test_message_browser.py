@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+
+from utils.message_browser import (
+    MAX_PAGE_SIZE, InvalidQuery, decode_cursor, encode_cursor, pack_cursor, parse_query, unpack_cursor
+)
+from utils.message_search import decode_search_cursor
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 1, 2, 3, 4, 5, 678)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor(datetime(2024, 1, 2), 1)
+    assert '=' not in cursor
+    assert unpack_cursor(cursor) == ['2024-01-02T00:00:00', 1]
+
+
+def test_search_cursor_keeps_the_score_exactly():
+    score = 0.1 + 0.2
+    assert decode_search_cursor(pack_cursor([score, 7])) == (score, 7)
+
+
+@pytest.mark.parametrize('cursor', [
+    '!!!',
+    pack_cursor([1]),
+    pack_cursor(['not a time', 1]),
+    pack_cursor(['2024-01-02T00:00:00', 'x']),
+    'eyJhIjoxfQ',  # {"a":1}: JSON, but not a list
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidQuery):
+        decode_cursor(cursor)
+
+
+def test_parse_query_filters():
+    query = parse_query({'status': 'completed', 'template_id': '3', 'since': '2024-01-01T05:00:00+02:00'})
+    assert query['filters'] == {
+        'status': 'completed',
+        'template_id': 3,
+        'since': datetime(2024, 1, 1, 3, 0),  # naive UTC, as stored
+    }
+    assert query['cursor'] is None
+
+
+def test_parse_query_accepts_z_suffix():
+    assert parse_query({'until': '2024-01-01T00:00:00Z'})['filters']['until'] == datetime(2024, 1, 1)
+
+
+@pytest.mark.parametrize('args', [
+    {'limit': '0'},
+    {'limit': str(MAX_PAGE_SIZE + 1)},
+    {'limit': 'ten'},
+    {'template_id': 'abc'},
+    {'since': 'yesterday'},
+    {'cursor': '!!!'},
+])
+def test_parse_query_rejects(args):
+    with pytest.raises(InvalidQuery):
+        parse_query(args)
@@ -0,0 +1,72 @@
+import pytest
+
+from utils.sms_segments import SegmentBuffer, fits_one_sms, sms_length, split_segments
+
+
+@pytest.mark.parametrize('text, length', [
+    ('hello', 5),
+    ('€', 2),  # GSM-7 extension table: escape plus character
+    ('[x]', 5),
+    ('ç', 1),  # not GSM-7, one UTF-16 code unit
+    ('😀', 2),  # a surrogate pair
+])
+def test_sms_length(text, length):
+    assert sms_length(text) == length
+
+
+@pytest.mark.parametrize('text, fits', [
+    ('a' * 160, True),
+    ('a' * 161, False),
+    ('{' * 80, True),
+    ('{' * 81, False),
+    ('ç' * 70, True),
+    ('ç' * 71, False),
+    ('a' * 69 + '😀', False),
+])
+def test_fits_one_sms(text, fits):
+    assert fits_one_sms(text) is fits
+
+
+def test_segments_end_at_sentence_boundaries():
+    text = 'First sentence here. ' * 12
+    segments = split_segments(text)
+    assert len(segments) == 2
+    assert all(segment.endswith('here.') for segment in segments)
+    assert ' '.join(segments) == text.strip()
+
+
+def test_segments_end_at_word_boundaries_without_sentences():
+    text = ' '.join(['word'] * 100)
+    segments = split_segments(text)
+    assert all(fits_one_sms(segment) for segment in segments)
+    assert ' '.join(segments) == text
+
+
+def test_text_without_spaces_is_cut_at_the_limit():
+    assert [len(segment) for segment in split_segments('x' * 400)] == [160, 160, 80]
+
+
+def test_ucs2_text_uses_the_smaller_limit():
+    text = 'Привет мир. ' * 20
+    segments = split_segments(text)
+    assert len(segments) > 1
+    assert all(sms_length(segment) <= 70 for segment in segments)
+
+
+def test_extended_characters_count_twice():
+    segments = split_segments('{' * 200)
+    assert [sms_length(segment) for segment in segments] == [160, 160, 80]
+
+
+def test_streamed_text_gives_the_same_segments():
+    text = 'The parcel left our warehouse today. Delivery takes two days! ' * 5
+    buffer = SegmentBuffer()
+    segments = []
+    for char in text:
+        segments += buffer.feed(char)
+    segments += buffer.flush()
+    assert segments == split_segments(text)
+
+
+def test_flush_of_empty_buffer():
+    assert SegmentBuffer().flush() == []
@@ -0,0 +1,72 @@
+import random
+
+from utils.template_matcher import KeywordMatcher, TemplateMatch
+
+
+def make_matcher(*keyword_lists):
+    """One template per keyword list, ranked in the order given"""
+    return KeywordMatcher(
+        (TemplateMatch(rank, f"template {rank}", f"reply {rank}"), keywords)
+        for rank, keywords in enumerate(keyword_lists)
+    )
+
+
+def naive_match(keyword_lists, message):
+    """The per-template scan the matcher replaced"""
+    for rank, keywords in enumerate(keyword_lists):
+        for keyword in keywords.split(','):
+            keyword = keyword.strip().lower()
+            if keyword and keyword in message.lower():
+                return rank
+    return None
+
+
+def test_no_match_returns_none():
+    assert make_matcher('refund', 'hours').match('where is my parcel') is None
+
+
+def test_matching_ignores_case_and_keyword_whitespace():
+    matcher = make_matcher(' Opening Hours , open ')
+    assert matcher.match('What are your OPENING HOURS?').id == 0
+    assert matcher.match('are you open today').id == 0
+
+
+def test_highest_ranked_template_wins_wherever_its_keyword_is():
+    matcher = make_matcher('refund', 'order')
+    assert matcher.match('my order needs a refund').id == 0
+    assert matcher.match('a refund for my order').id == 0
+    assert matcher.match('my order').id == 1
+
+
+def test_keyword_found_through_a_failure_link():
+    # "he" ends inside "she", so it is only found by following the suffix link
+    matcher = make_matcher('he', 'she, hers')
+    assert matcher.match('ushers').id == 0
+
+
+def test_keyword_that_is_a_prefix_of_another():
+    matcher = make_matcher('refund status', 'refund')
+    assert matcher.match('refund').id == 1
+    assert matcher.match('what is my refund status').id == 0
+
+
+def test_empty_keywords_never_match():
+    matcher = make_matcher(' , ,', 'hello')
+    assert matcher.match('anything at all') is None
+    assert matcher.match('hello').id == 1
+
+
+def test_agrees_with_the_naive_scan():
+    rng = random.Random(7)
+    alphabet = 'abc '
+    for _ in range(200):
+        keyword_lists = [
+            ','.join(''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+                     for _ in range(rng.randint(1, 3)))
+            for _ in range(rng.randint(1, 5))
+        ]
+        matcher = make_matcher(*keyword_lists)
+        for _ in range(10):
+            message = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+            match = matcher.match(message)
+            assert (match.id if match else None) == naive_match(keyword_lists, message)
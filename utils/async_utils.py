@@ -0,0 +1,18 @@
+import asyncio
+from flask import current_app
+
+async def run_in_app_context(func, *args, **kwargs):
+    """Run blocking database/Redis work in a thread with its own app context.
+
+    Each call gets a fresh app context, and so its own SQLAlchemy session,
+    which keeps concurrent jobs on the event loop from sharing one session.
+    Only plain values should be returned, since ORM objects are detached
+    once the context is torn down.
+    """
+    app = current_app._get_current_object()
+
+    def call():
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    return await asyncio.to_thread(call)
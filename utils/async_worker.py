@@ -0,0 +1,227 @@
+import asyncio
+import signal
+import traceback
+import logging
+from typing import Callable, Dict, List, Optional
+from rq import Queue, Worker
+from rq.exceptions import DequeueTimeout
+from rq.executions import Execution
+from rq.job import JobStatus
+from rq.scheduler import RQScheduler
+from rq.utils import import_attribute, now
+from redis import RedisError
+from utils.redis_handler import record_job_completion
+from utils.metrics import observe_queue_wait, flush_metrics
+from utils.priority_queues import WeightedFairOrder
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEQUEUE_TIMEOUT = 5  # seconds; bounds how long shutdown waits on an idle queue
+HEARTBEAT_INTERVAL = 30  # seconds
+SCHEDULER_INTERVAL = 1  # seconds between moves of due scheduled jobs onto their queues
+
+class AsyncWorker:
+    """Runs many RQ jobs concurrently on one asyncio event loop.
+
+    Jobs are pulled from the same queues the stock worker uses. A job whose
+    function has an ``<name>_async`` coroutine sibling in the same module is
+    run through that coroutine; anything else runs in a thread. At most
+    ``concurrency`` jobs are in flight at once, and each one goes through the
+    same started/finished/failed registries as with the stock worker, so queue
+    statistics stay accurate. With ``weights`` the queues are served by
+    weighted fair scheduling, as in the stock worker. Like a stock worker
+    started with a scheduler, it also enqueues scheduled jobs when due.
+    """
+
+    def __init__(self, queues: List[Queue], connection, app, concurrency: int = 20,
+                 maintenance: Optional[Callable[[], None]] = None,
+                 weights: Optional[Dict[str, int]] = None, serializer=None,
+                 result_ttl: Optional[int] = None):
+        self.queues = queues
+        self.connection = connection
+        self.app = app
+        self.concurrency = concurrency
+        self.maintenance = maintenance
+        # Registered like a regular worker so it shows up in RQ's worker list
+        worker_options = {'default_result_ttl': result_ttl} if result_ttl is not None else {}
+        self.worker = Worker(queues, connection=connection, serializer=serializer, **worker_options)
+        self.scheduler = RQScheduler(queues, connection=connection, interval=SCHEDULER_INTERVAL,
+                                     serializer=serializer)
+        self._weighted = WeightedFairOrder(queues, weights or {})
+        self._stop_requested = False
+
+    def request_stop(self) -> None:
+        logger.info("Async worker stopping after in-flight jobs finish")
+        self._stop_requested = True
+
+    def run(self) -> None:
+        asyncio.run(self._main())
+
+    async def _main(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.request_stop)
+
+        with self.app.app_context():
+            await asyncio.to_thread(self.worker.register_birth)
+            heartbeat = asyncio.create_task(self._heartbeat())
+            scheduler = asyncio.create_task(self._schedule())
+            slots = asyncio.Semaphore(self.concurrency)
+            in_flight = set()
+            logger.info(f"Async worker {self.worker.name} started with concurrency {self.concurrency}")
+
+            try:
+                while not self._stop_requested:
+                    # Only take a job off the queue once there is room to run it
+                    await slots.acquire()
+                    try:
+                        if self.maintenance:
+                            await asyncio.to_thread(self._run_maintenance)
+                        result = await asyncio.to_thread(self._dequeue)
+                    except Exception:
+                        slots.release()
+                        raise
+                    if result is None:
+                        slots.release()
+                        continue
+
+                    task = asyncio.create_task(self._perform(*result))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+                    task.add_done_callback(lambda _: slots.release())
+
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+            finally:
+                heartbeat.cancel()
+                scheduler.cancel()
+                await asyncio.to_thread(self._stop_scheduler)
+                await asyncio.to_thread(self.worker.register_death)
+
+    def _run_maintenance(self) -> None:
+        with self.app.app_context():
+            try:
+                self.maintenance()
+            except Exception as e:
+                logger.error(f"Error running maintenance tasks: {str(e)}")
+
+    def _dequeue(self):
+        try:
+            result = Queue.dequeue_any(
+                self._weighted.order,
+                DEQUEUE_TIMEOUT,
+                connection=self.connection,
+                job_class=self.worker.job_class,
+                serializer=self.worker.serializer
+            )
+        except DequeueTimeout:
+            return None
+        except RedisError as e:
+            logger.error(f"Redis error dequeueing job: {str(e)}")
+            return None
+        if result:
+            self._weighted.served(result[1])
+        return result
+
+    async def _heartbeat(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.worker.heartbeat)
+            except RedisError as e:
+                logger.error(f"Redis error sending worker heartbeat: {str(e)}")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def _schedule(self) -> None:
+        # Only the worker holding a queue's scheduler lock moves its jobs;
+        # the others keep retrying the lock in case that worker dies
+        while True:
+            try:
+                await asyncio.to_thread(self._run_scheduler)
+            except RedisError as e:
+                logger.error(f"Redis error enqueueing scheduled jobs: {str(e)}")
+            await asyncio.sleep(SCHEDULER_INTERVAL)
+
+    def _run_scheduler(self) -> None:
+        if self.scheduler.should_reacquire_locks:
+            self.scheduler.acquire_locks()
+        if self.scheduler.acquired_locks:
+            self.scheduler.enqueue_scheduled_jobs()
+            self.scheduler.heartbeat()
+
+    def _stop_scheduler(self) -> None:
+        try:
+            self.scheduler.release_locks()
+        except RedisError as e:
+            logger.error(f"Redis error releasing scheduler locks: {str(e)}")
+
+    def _resolve(self, job):
+        """Return the coroutine function for a job, or None to run it in a thread"""
+        try:
+            func = import_attribute(f"{job.func_name}_async")
+        except (AttributeError, ImportError, ValueError):
+            return None
+        return func if asyncio.iscoroutinefunction(func) else None
+
+    def _start_job(self, job, queue) -> Execution:
+        timeout = job.timeout or queue.DEFAULT_TIMEOUT
+        # Keep the job in the started registry for as long as it may run
+        ttl = (timeout if timeout > 0 else queue.DEFAULT_TIMEOUT) + 60
+        with self.connection.pipeline() as pipe:
+            execution = Execution.create(job, ttl, pipeline=pipe)
+            job.prepare_for_execution(self.worker.name, pipeline=pipe)
+            pipe.lrem(queue.intermediate_queue_key, 1, job.id)
+            pipe.execute()
+        observe_queue_wait(job)
+        return execution
+
+    def _finish_job(self, job, queue, execution: Execution, result=None, exc_string: Optional[str] = None) -> None:
+        job.ended_at = now()
+        with self.connection.pipeline() as pipe:
+            if exc_string is None:
+                job._result = result
+                result_ttl = job.get_result_ttl(self.worker.default_result_ttl)
+                if result_ttl != 0:
+                    job._handle_success(result_ttl, pipeline=pipe)
+                job.cleanup(result_ttl, pipeline=pipe, remove_from_queue=False)
+                self.worker.increment_successful_job_count(pipeline=pipe)
+            else:
+                job.set_status(JobStatus.FAILED, pipeline=pipe)
+                job._handle_failure(exc_string, pipeline=pipe)
+                self.worker.increment_failed_job_count(pipeline=pipe)
+            self.worker.increment_total_working_time(job.ended_at - job.started_at, pipe)
+            queue.started_job_registry.remove(job, pipeline=pipe)
+            execution.delete(job=job, pipeline=pipe)
+            record_job_completion(self.connection, pipeline=pipe)
+            flush_metrics(self.connection, pipeline=pipe)
+            pipe.execute()
+        if exc_string is None:
+            queue.enqueue_dependents(job)
+
+    async def _perform(self, job, queue) -> None:
+        try:
+            execution = await asyncio.to_thread(self._start_job, job, queue)
+        except Exception as e:
+            logger.error(f"Error starting job {job.id}: {str(e)}")
+            return
+
+        timeout = job.timeout or queue.DEFAULT_TIMEOUT
+        try:
+            coroutine_func = self._resolve(job)
+            if coroutine_func:
+                run = coroutine_func(*job.args, **job.kwargs)
+            else:
+                run = asyncio.to_thread(self._run_sync, job)
+            result = await asyncio.wait_for(run, timeout if timeout > 0 else None)
+        except Exception:
+            logger.error(f"Job {job.id} failed", exc_info=True)
+            await asyncio.to_thread(self._finish_job, job, queue, execution, exc_string=traceback.format_exc())
+            return
+
+        logger.info(f"{queue.name}: Job OK ({job.id})")
+        await asyncio.to_thread(self._finish_job, job, queue, execution, result=result)
+
+    def _run_sync(self, job):
+        with self.app.app_context():
+            return job.func(*job.args, **job.kwargs)
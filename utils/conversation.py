@@ -0,0 +1,63 @@
+import json
+import logging
+from typing import Dict, List
+from redis import RedisError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONVERSATION_PREFIX = "conversation:"  # list per sender, newest message first
+
+# Rough token estimate (about four characters per token for English text)
+# plus the per-message overhead of the chat format
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(content: str) -> int:
+    return len(content) // CHARS_PER_TOKEN + 1 + MESSAGE_OVERHEAD_TOKENS
+
+def get_conversation(redis_conn, from_number: str) -> List[Dict]:
+    """Return the sender's recent messages, oldest first, as chat messages"""
+    if not redis_conn or not from_number:
+        return []
+    try:
+        raw_messages = redis_conn.lrange(CONVERSATION_PREFIX + from_number, 0, -1)
+    except RedisError as e:
+        logger.error(f"Redis error reading conversation: {str(e)}")
+        return []
+    return [json.loads(raw) for raw in reversed(raw_messages)]
+
+def append_exchange(redis_conn, from_number: str, message: str, reply: str,
+                    max_messages: int, ttl: int) -> None:
+    """Add a message and its reply to the sender's window, capped and expiring"""
+    if not redis_conn or not from_number:
+        return
+    key = CONVERSATION_PREFIX + from_number
+    try:
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.lpush(key,
+                   json.dumps({"role": "user", "content": message}),
+                   json.dumps({"role": "assistant", "content": reply}))
+        pipe.ltrim(key, 0, max_messages - 1)
+        pipe.expire(key, ttl)
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error saving conversation: {str(e)}")
+
+def build_chat_messages(history: List[Dict], message: str, token_budget: int) -> List[Dict]:
+    """Keep the most recent history that fits the token budget alongside the new message"""
+    remaining = token_budget - estimate_tokens(message)
+    kept = []
+    for entry in reversed(history):
+        cost = estimate_tokens(entry["content"])
+        if cost > remaining:
+            break
+        kept.append(entry)
+        remaining -= cost
+    # Never open the window on a dangling assistant reply
+    while kept and kept[-1]["role"] == "assistant":
+        kept.pop()
+    kept.reverse()
+    kept.append({"role": "user", "content": message})
+    return kept
@@ -0,0 +1,109 @@
+import json
+import time
+import queue
+import threading
+import logging
+from typing import Dict, Optional
+from redis import RedisError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CHANNEL = "dashboard:events"
+DASHBOARD_LATEST_KEY = "dashboard:latest"  # last published stats, for newly opened streams
+
+CLIENT_BUFFER = 10  # events kept per slow client before the oldest are dropped
+RECONNECT_DELAY = 2  # seconds
+
+def _as_text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def publish_dashboard_stats(redis_conn, stats: Dict, ttl: int = 60) -> None:
+    """Push a stats snapshot to every open dashboard"""
+    if not redis_conn:
+        return
+    payload = json.dumps(stats)
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.set(DASHBOARD_LATEST_KEY, payload, ex=ttl)
+        pipe.publish(DASHBOARD_CHANNEL, payload)
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error publishing dashboard stats: {str(e)}")
+
+def refresh_dashboard_stats(redis_conn, ttl: int = 60) -> None:
+    """Keep the last snapshot current when nothing changed"""
+    if not redis_conn:
+        return
+    try:
+        redis_conn.expire(DASHBOARD_LATEST_KEY, ttl)
+    except RedisError as e:
+        logger.error(f"Redis error refreshing dashboard stats: {str(e)}")
+
+def get_latest_dashboard_stats(redis_conn) -> Optional[str]:
+    """The last published snapshot as JSON, or None if the publisher is not running"""
+    if not redis_conn:
+        return None
+    try:
+        payload = redis_conn.get(DASHBOARD_LATEST_KEY)
+    except RedisError as e:
+        logger.error(f"Redis error reading dashboard stats: {str(e)}")
+        return None
+    return _as_text(payload) if payload else None
+
+class DashboardBroadcaster:
+    """Fans dashboard events out to every stream open in this web process.
+
+    A single Redis subscription is shared by all connected browsers, so the
+    Redis connections and commands used do not grow with the number of
+    viewers. The listener thread is started on first use, which keeps it out
+    of processes forked before any stream was opened.
+    """
+
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._thread = None
+
+    def subscribe(self) -> queue.Queue:
+        client = queue.Queue(maxsize=CLIENT_BUFFER)
+        with self._lock:
+            self._clients.add(client)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen, name="dashboard-events", daemon=True)
+                self._thread.start()
+        return client
+
+    def unsubscribe(self, client: queue.Queue) -> None:
+        with self._lock:
+            self._clients.discard(client)
+
+    def _deliver(self, payload: str) -> None:
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(payload)
+            except queue.Full:
+                # A stalled browser only ever needs the newest snapshot
+                try:
+                    client.get_nowait()
+                except queue.Empty:
+                    pass
+                client.put_nowait(payload)
+
+    def _listen(self) -> None:
+        while True:
+            pubsub = self.redis_conn.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(DASHBOARD_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._deliver(_as_text(message['data']))
+            except RedisError as e:
+                logger.error(f"Redis error on dashboard event subscription: {str(e)}")
+            finally:
+                pubsub.close()
+            time.sleep(RECONNECT_DELAY)
@@ -0,0 +1,141 @@
+import json
+import base64
+import binascii
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import tuple_
+from models import Message, TwilioNumber, db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Query parameter -> Message column, matched exactly
+EXACT_FILTERS = {
+    'status': Message.status,
+    'from_number': Message.from_number,
+    'to_number': Message.to_number,
+    'template_id': Message.template_used,
+    'twilio_number_id': Message.twilio_number_id,
+}
+INTEGER_FILTERS = {'template_id', 'twilio_number_id'}
+
+class InvalidQuery(ValueError):
+    """A filter, cursor or limit the API cannot use; reported as a 400"""
+
+def pack_cursor(values: List) -> str:
+    """Opaque cursor holding the sort key of the last row of a page"""
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def unpack_cursor(cursor: str) -> List:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidQuery(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list):
+        raise InvalidQuery(f"Invalid cursor: {cursor}")
+    return values
+
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    return pack_cursor([timestamp.isoformat(), message_id])
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        timestamp, message_id = unpack_cursor(cursor)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidQuery(f"Invalid cursor: {cursor}") from e
+
+def _parse_time(name: str, value: str) -> datetime:
+    """ISO 8601 time as naive UTC, the way timestamps are stored"""
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError as e:
+        raise InvalidQuery(f"Invalid {name}: {value}") from e
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def parse_query(args, cursor_decoder=decode_cursor) -> Dict:
+    """Filters, cursor and limit from request arguments"""
+    filters = {}
+    for name in EXACT_FILTERS:
+        value = args.get(name)
+        if not value:
+            continue
+        if name in INTEGER_FILTERS:
+            try:
+                value = int(value)
+            except ValueError as e:
+                raise InvalidQuery(f"Invalid {name}: {value}") from e
+        filters[name] = value
+    for name in ('since', 'until'):
+        if args.get(name):
+            filters[name] = _parse_time(name, args[name])
+
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError as e:
+        raise InvalidQuery(f"Invalid limit: {args.get('limit')}") from e
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidQuery(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    cursor = cursor_decoder(args['cursor']) if args.get('cursor') else None
+    return {'filters': filters, 'cursor': cursor, 'limit': limit}
+
+def apply_filters(query, filters: Dict):
+    """Restrict a Message query to the parsed filters"""
+    for name, column in EXACT_FILTERS.items():
+        if name in filters:
+            query = query.filter(column == filters[name])
+    if 'since' in filters:
+        query = query.filter(Message.timestamp >= filters['since'])
+    if 'until' in filters:
+        query = query.filter(Message.timestamp < filters['until'])
+    return query
+
+def browse_messages(filters: Optional[Dict] = None, cursor: Optional[Tuple[datetime, int]] = None,
+                    limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Message], Optional[str]]:
+    """One page of messages, newest first, and the cursor for the next page.
+
+    Pages are keyed on (timestamp, id) rather than an offset, so each page is
+    an index range scan that starts where the last one ended; every filter
+    has a (column, timestamp, id) index, which keeps deep pages as cheap as
+    the first.
+    """
+    query = apply_filters(Message.query, filters or {})
+    if cursor:
+        query = query.filter(tuple_(Message.timestamp, Message.id) < tuple_(*cursor))
+
+    # One extra row tells whether there is a next page
+    rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+def message_to_dict(message: Message, senders: Dict[int, str]) -> Dict:
+    return {
+        'id': message.id,
+        'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+        'processed_at': message.processed_at.isoformat() if message.processed_at else None,
+        'from_number': message.from_number,
+        'to_number': message.to_number,
+        'content': message.content,
+        'response': message.response,
+        'status': message.status,
+        'priority': message.priority,
+        'template_id': message.template_used,
+        'twilio_number_id': message.twilio_number_id,
+        'sender': senders.get(message.twilio_number_id),
+        'message_sid': message.message_sid,
+    }
+
+def serialize_messages(messages: List[Message]) -> List[Dict]:
+    """Messages as JSON-ready dicts, with sender numbers looked up in one query"""
+    number_ids = {message.twilio_number_id for message in messages if message.twilio_number_id}
+    senders = {}
+    if number_ids:
+        senders = dict(db.session.query(TwilioNumber.id, TwilioNumber.phone_number)
+                       .filter(TwilioNumber.id.in_(number_ids)).all())
+    return [message_to_dict(message, senders) for message in messages]
@@ -0,0 +1,140 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from redis import RedisError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COALESCE_PARTS_PREFIX = "coalesce:parts:"  # per sender list of fragments waiting to be processed
+COALESCE_PENDING_PREFIX = "coalesce:pending:"  # id of the job scheduled for the sender's fragments
+COALESCE_WINDOW_KEY = "coalesce:window"  # window set from the admin, in milliseconds
+COALESCE_STATS_KEY = "coalesce:stats"  # fragments, batches
+MAX_COALESCE_WINDOW = 30  # seconds; every inbound message waits this long at most
+
+# Fragments are kept this long past the window, in case workers are behind
+COALESCE_GRACE_MS = 3600 * 1000
+
+# Add a fragment for a sender. Returns nil when coalescing is disabled,
+# {window ms, job id} when this fragment opened a new batch (the caller
+# schedules that job), or {0, batch job id} when it joined a scheduled batch.
+ADD_FRAGMENT_SCRIPT = """
+local window = tonumber(redis.call('GET', KEYS[3]) or ARGV[2])
+if window <= 0 then
+    return false
+end
+local ttl = window + tonumber(ARGV[3])
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[1], ttl)
+redis.call('HINCRBY', KEYS[4], 'fragments', 1)
+if redis.call('SET', KEYS[2], ARGV[4], 'NX', 'PX', ttl) then
+    return {window, ARGV[4]}
+end
+return {0, redis.call('GET', KEYS[2])}
+"""
+
+# Take every fragment for a sender and end the batch, so a fragment arriving
+# from now on opens a new one
+CLAIM_FRAGMENTS_SCRIPT = """
+local parts = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+if #parts > 0 then
+    redis.call('HINCRBY', KEYS[3], 'batches', 1)
+end
+return parts
+"""
+
+# End a batch whose job was never scheduled: drop its fragments, but only if
+# the pending key still names that job
+ABANDON_BATCH_SCRIPT = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+return 0
+"""
+
+_add_script = None
+_claim_script = None
+_abandon_script = None
+
+def _as_text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def add_fragment(redis_conn, from_number: str, body: str, default_window: float,
+                 job_id: str) -> Tuple[Optional[float], Optional[str]]:
+    """Queue a message fragment for its sender.
+
+    Returns (window in seconds, job_id) if this fragment starts a batch and
+    job_id must be scheduled, (0, id of the batch job) if it joined a
+    scheduled batch, or (None, None) when coalescing is off. Raises
+    RedisError if Redis cannot be reached.
+    """
+    global _add_script
+    if _add_script is None:
+        _add_script = redis_conn.register_script(ADD_FRAGMENT_SCRIPT)
+    keys = [f"{COALESCE_PARTS_PREFIX}{from_number}", f"{COALESCE_PENDING_PREFIX}{from_number}",
+            COALESCE_WINDOW_KEY, COALESCE_STATS_KEY]
+    result = _add_script(keys=keys, args=[body or '', int(default_window * 1000), COALESCE_GRACE_MS, job_id],
+                         client=redis_conn)
+    if not result:
+        return None, None
+    window_ms, batch_job_id = result
+    return window_ms / 1000, _as_text(batch_job_id)
+
+def claim_fragments(redis_conn, from_number: str) -> List[str]:
+    """Take the fragments collected for a sender, oldest first"""
+    global _claim_script
+    if _claim_script is None:
+        _claim_script = redis_conn.register_script(CLAIM_FRAGMENTS_SCRIPT)
+    keys = [f"{COALESCE_PARTS_PREFIX}{from_number}", f"{COALESCE_PENDING_PREFIX}{from_number}",
+            COALESCE_STATS_KEY]
+    return [_as_text(part) for part in _claim_script(keys=keys, client=redis_conn)]
+
+def abandon_batch(redis_conn, from_number: str, job_id: str) -> None:
+    """Undo add_fragment after scheduling the batch's job failed.
+
+    Otherwise the sender's texts would keep joining a batch no job will
+    ever claim until the pending key expires.
+    """
+    global _abandon_script
+    try:
+        if _abandon_script is None:
+            _abandon_script = redis_conn.register_script(ABANDON_BATCH_SCRIPT)
+        keys = [f"{COALESCE_PARTS_PREFIX}{from_number}", f"{COALESCE_PENDING_PREFIX}{from_number}"]
+        _abandon_script(keys=keys, args=[job_id], client=redis_conn)
+    except RedisError as e:
+        logger.error(f"Redis error abandoning coalesced batch for {from_number}: {str(e)}")
+
+def combine_fragments(parts: List[str]) -> str:
+    return ' '.join(part.strip() for part in parts if part and part.strip())
+
+def get_coalesce_window(redis_conn, default_window: float) -> float:
+    """The debounce window in seconds, as set from the admin or the config default"""
+    if not redis_conn:
+        return default_window
+    try:
+        window_ms = redis_conn.get(COALESCE_WINDOW_KEY)
+    except RedisError as e:
+        logger.error(f"Redis error reading coalescing window: {str(e)}")
+        return default_window
+    return int(window_ms) / 1000 if window_ms is not None else default_window
+
+def set_coalesce_window(redis_conn, window: float) -> None:
+    """Change the debounce window for every web process; 0 turns coalescing off"""
+    redis_conn.set(COALESCE_WINDOW_KEY, int(max(window, 0) * 1000))
+
+def get_coalesce_stats(redis_conn) -> Dict:
+    """Fragments received while coalescing, jobs run for them, and the LLM calls saved"""
+    stats = {'fragments': 0, 'batches': 0, 'saved_calls': 0}
+    if not redis_conn:
+        return stats
+    try:
+        raw = redis_conn.hgetall(COALESCE_STATS_KEY)
+    except RedisError as e:
+        logger.error(f"Redis error reading coalescing stats: {str(e)}")
+        return stats
+    for field, value in raw.items():
+        stats[_as_text(field)] = int(value)
+    stats['saved_calls'] = max(stats['fragments'] - stats['batches'], 0)
+    return stats
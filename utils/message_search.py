@@ -0,0 +1,121 @@
+import re
+import html
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Double, cast, func, literal_column, table, column, tuple_
+from models import Message, db
+from utils.message_browser import InvalidQuery, apply_filters, pack_cursor, unpack_cursor, DEFAULT_PAGE_SIZE
+
+# Text search configuration of message.search_vector (see migration 0006)
+SEARCH_CONFIG = 'english'
+SEARCH_VECTOR = literal_column('message.search_vector')
+
+# SQLite keeps the index in this FTS5 table, synced by triggers
+FTS_TABLE = table('message_fts', column('rowid'))
+FTS_MATCH = literal_column('message_fts')
+FTS_WEIGHTS = (2.0, 1.0)  # content, response; the same preference setweight gives Postgres
+
+# Control characters cannot occur in SMS text, so they mark matches safely
+# until the snippet is escaped for HTML
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+HEADLINE_OPTIONS = f"StartSel={MATCH_START}, StopSel={MATCH_END}, MaxFragments=2, MaxWords=20, MinWords=8"
+SNIPPET_TOKENS = 16
+
+# A search term: an optionally negated "quoted phrase" or word
+QUERY_TERM = re.compile(r'(-?)(?:"([^"]*)"?|(\S+))')
+WORD = re.compile(r'\w+')
+
+class SearchUnavailable(RuntimeError):
+    """The database has no full-text index to search"""
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        score, message_id = unpack_cursor(cursor)
+        return float(score), int(message_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidQuery(f"Invalid cursor: {cursor}") from e
+
+def _fts5_query(text: str) -> Optional[str]:
+    """Translate web search syntax (words, "phrases", OR, -exclusions) to an FTS5 query.
+
+    Every term is quoted, so punctuation in the input can never be read as
+    FTS5 syntax.
+    """
+    clauses, excluded = [], []
+    join_with_or = False
+    for negated, phrase, word in QUERY_TERM.findall(text):
+        if word == 'OR' and not negated:
+            join_with_or = bool(clauses)
+            continue
+        words = WORD.findall(phrase or word)
+        if not words:
+            continue
+        term = '"' + ' '.join(words) + '"'
+        if negated:
+            excluded.append(term)
+        elif join_with_or:
+            clauses[-1] = f"{clauses[-1]} OR {term}"
+        else:
+            clauses.append(term)
+        join_with_or = False
+    if not clauses:
+        return None
+    query = ' AND '.join(f"({clause})" for clause in clauses)
+    return query + ''.join(f" NOT {term}" for term in excluded)
+
+def _postgres_search(text: str):
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+    # ts_rank_cd returns a real; as a double it survives the round trip
+    # through the cursor exactly, so ties at a page boundary compare equal
+    score = cast(func.ts_rank_cd(SEARCH_VECTOR, tsquery), Double)
+    snippet = func.ts_headline(SEARCH_CONFIG, func.concat_ws(' … ', Message.content, Message.response),
+                               tsquery, HEADLINE_OPTIONS)
+    return db.session.query(Message, score.label('score'), snippet.label('snippet')) \
+        .filter(SEARCH_VECTOR.op('@@')(tsquery)), score
+
+def _sqlite_search(text: str):
+    match = _fts5_query(text)
+    if match is None:
+        return None, None
+    # bm25 is lower for better matches; negated so both backends rank descending
+    score = -func.bm25(FTS_MATCH, *FTS_WEIGHTS)
+    snippet = func.snippet(FTS_MATCH, -1, MATCH_START, MATCH_END, '…', SNIPPET_TOKENS)
+    return db.session.query(Message, score.label('score'), snippet.label('snippet')) \
+        .join(FTS_TABLE, FTS_TABLE.c.rowid == Message.id) \
+        .filter(FTS_MATCH.op('MATCH')(match)), score
+
+def highlight(snippet: Optional[str]) -> str:
+    """HTML-escape a snippet and wrap its matches in <mark>"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+def search_messages(text: str, filters: Optional[Dict] = None, cursor: Optional[Tuple[float, int]] = None,
+                    limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Tuple[Message, float, str]], Optional[str]]:
+    """One page of messages matching text, best match first, and the cursor for the next page.
+
+    Postgres matches against the indexed search_vector column, SQLite against
+    the FTS5 table. Pages are keyed on (score, id), so a page carries on from
+    the previous one's last row even as new messages arrive.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        query, score = _postgres_search(text)
+    elif dialect == 'sqlite':
+        query, score = _sqlite_search(text)
+        if query is None:
+            return [], None
+    else:
+        raise SearchUnavailable(f"Full-text search is not supported on {dialect}")
+
+    query = apply_filters(query, filters or {})
+    if cursor:
+        query = query.filter(tuple_(score, Message.id) < tuple_(*cursor))
+
+    # One extra row tells whether there is a next page
+    rows = query.order_by(score.desc(), Message.id.desc()).limit(limit + 1).all()
+    results = [(message, float(row_score), highlight(snippet)) for message, row_score, snippet in rows]
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    message, last_score, _ = results[-1]
+    return results, pack_cursor([last_score, message.id])
@@ -0,0 +1,359 @@
+import json
+import time
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from redis import RedisError
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from models import Message, db
+from utils.webhook_dedup import record_duplicate
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INFLIGHT_KEY = "messages:inflight"
+INFLIGHT_INDEX_KEY = "messages:inflight:by_time"  # zset of in-flight keys scored by last activity
+WRITE_BEHIND_KEY = "messages:writebehind"
+INFLIGHT_MAX_AGE = 3600  # seconds without activity before an entry is considered abandoned
+REAP_BATCH_SIZE = 500
+
+# Claim up to ARGV[1] completed messages from the head of the write-behind list
+CLAIM_BATCH_SCRIPT = """
+local batch = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #batch > 0 then
+    redis.call('LTRIM', KEYS[1], #batch, -1)
+end
+return batch
+"""
+
+# Move a finished message from the in-flight set to the write-behind list,
+# unless the reaper took it first; returns whether it was moved
+QUEUE_WRITE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[3], ARGV[2])
+return 1
+"""
+
+# Take up to ARGV[2] in-flight records last active before ARGV[1] out of
+# the in-flight set, so only one worker persists each of them
+CLAIM_ABANDONED_SCRIPT = """
+local keys = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local records = {}
+for _, key in ipairs(keys) do
+    local record = redis.call('HGET', KEYS[1], key)
+    redis.call('ZREM', KEYS[2], key)
+    if record then
+        redis.call('HDEL', KEYS[1], key)
+        table.insert(records, record)
+    end
+end
+return records
+"""
+
+_claim_script = None
+_queue_write_script = None
+_claim_abandoned_script = None
+_last_flush = 0.0
+_last_reap = 0.0
+
+def _as_text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def start_message(redis_conn, from_number: str, to_number: str, content: str,
+                  priority: int = 0, twilio_number_id: Optional[int] = None,
+                  message_sid: Optional[str] = None) -> Dict:
+    """Describe an inbound message and publish it as in-flight, without touching the database"""
+    record = {
+        'key': uuid.uuid4().hex,
+        'from_number': from_number,
+        'to_number': to_number,
+        'content': content,
+        'response': None,
+        'status': 'processing',
+        'priority': priority,
+        'timestamp': time.time(),
+        'processed_at': None,
+        'template_used': None,
+        'twilio_number_id': twilio_number_id,
+        'message_sid': message_sid
+    }
+    if redis_conn:
+        try:
+            pipe = redis_conn.pipeline(transaction=True)
+            pipe.hset(INFLIGHT_KEY, record['key'], json.dumps(record))
+            pipe.zadd(INFLIGHT_INDEX_KEY, {record['key']: record['timestamp']})
+            pipe.execute()
+        except RedisError as e:
+            logger.error(f"Redis error registering in-flight message: {str(e)}")
+    return record
+
+def touch_message(redis_conn, record: Dict) -> None:
+    """Mark an in-flight message as still being worked on, e.g. when its reply is deferred"""
+    if not redis_conn:
+        return
+    try:
+        # xx: a record the reaper already took is not put back
+        redis_conn.zadd(INFLIGHT_INDEX_KEY, {record['key']: time.time()}, xx=True)
+    except RedisError as e:
+        logger.error(f"Redis error refreshing in-flight message: {str(e)}")
+
+def _to_row(record: Dict) -> Dict:
+    row = {column: record[column] for column in (
+        'from_number', 'to_number', 'content', 'response', 'status',
+        'priority', 'template_used', 'twilio_number_id'
+    )}
+    row['timestamp'] = datetime.utcfromtimestamp(record['timestamp'])
+    row['processed_at'] = datetime.utcfromtimestamp(record['processed_at']) if record['processed_at'] else None
+    row['message_sid'] = record.get('message_sid')
+    return row
+
+def _insert_messages(rows: List[Dict]) -> int:
+    """Insert message rows, skipping any whose MessageSid is already stored.
+
+    The unique message_sid column backs up the webhook's deduplication; a
+    duplicate that slipped through is dropped here instead of failing the
+    whole insert. Returns the number of rows skipped.
+    """
+    connection = db.session.connection()
+    table = Message.__table__
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).on_conflict_do_nothing(index_elements=['message_sid'])
+    elif connection.dialect.name == 'sqlite':
+        statement = sqlite.insert(table).on_conflict_do_nothing(index_elements=['message_sid'])
+    else:
+        statement = insert(table)
+    # Core execution, so the result carries the number of rows written
+    result = connection.execute(statement, rows)
+    return len(rows) - result.rowcount if result.rowcount >= 0 else 0
+
+def _release_inflight(redis_conn, record: Dict) -> bool:
+    """Take a message out of the in-flight set; False if the reaper took it first"""
+    if not redis_conn:
+        return True
+    try:
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.hdel(INFLIGHT_KEY, record['key'])
+        pipe.zrem(INFLIGHT_INDEX_KEY, record['key'])
+        removed, _ = pipe.execute()
+        return bool(removed)
+    except RedisError as e:
+        logger.error(f"Redis error clearing in-flight message: {str(e)}")
+        return True
+
+def _restore_inflight(redis_conn, record: Dict) -> None:
+    if not redis_conn:
+        return
+    try:
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.hset(INFLIGHT_KEY, record['key'], json.dumps(record))
+        pipe.zadd(INFLIGHT_INDEX_KEY, {record['key']: time.time()})
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error restoring in-flight message: {str(e)}")
+
+def _update_reaped_message(record: Dict) -> bool:
+    """Overwrite the failed row the reaper wrote for this message; False if there is none"""
+    row = _to_row(record)
+    query = Message.query.filter_by(status='failed')
+    if row['message_sid']:
+        query = query.filter_by(message_sid=row['message_sid'])
+    else:
+        query = query.filter_by(from_number=row['from_number'], to_number=row['to_number'],
+                                timestamp=row['timestamp'])
+    updated = query.update({column: row[column] for column in (
+        'response', 'status', 'template_used', 'processed_at'
+    )}, synchronize_session=False)
+    return updated > 0
+
+def complete_message(redis_conn, record: Dict, response: str, status: str,
+                     template_id: Optional[int] = None, write_mode: str = 'immediate') -> None:
+    """Persist a finished message with a single insert, or queue it for a batched one.
+
+    A message the reaper already persisted as abandoned has its row updated
+    instead, so it is never stored twice.
+    """
+    global _queue_write_script
+    record['response'] = response
+    record['status'] = status
+    record['template_used'] = template_id
+    if status == 'completed':
+        record['processed_at'] = time.time()
+
+    if write_mode == 'batched' and redis_conn:
+        try:
+            if _queue_write_script is None:
+                _queue_write_script = redis_conn.register_script(QUEUE_WRITE_SCRIPT)
+            # Leave the in-flight set and join the write-behind list atomically
+            if _queue_write_script(keys=[INFLIGHT_KEY, INFLIGHT_INDEX_KEY, WRITE_BEHIND_KEY],
+                                   args=[record['key'], json.dumps(record)], client=redis_conn):
+                return
+            claimed = False
+        except RedisError as e:
+            logger.error(f"Redis error queueing message write, inserting directly: {str(e)}")
+            claimed = _release_inflight(redis_conn, record)
+    else:
+        claimed = _release_inflight(redis_conn, record)
+
+    try:
+        if not claimed and _update_reaped_message(record):
+            db.session.commit()
+            logger.info(f"Message {record['key']} finished after it was persisted as abandoned - row updated")
+            return
+        skipped = _insert_messages([_to_row(record)])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if claimed:
+            # Left in flight, the reaper persists it if nothing else does
+            _restore_inflight(redis_conn, record)
+        raise
+    if skipped:
+        logger.warning(f"Message {record.get('message_sid')} was already stored - dropped duplicate")
+        record_duplicate(redis_conn)
+
+def flush_message_batch(redis_conn, batch_size: int = 500) -> int:
+    """Insert up to batch_size write-behind messages in one transaction"""
+    global _claim_script
+    if not redis_conn:
+        return 0
+
+    try:
+        if _claim_script is None:
+            _claim_script = redis_conn.register_script(CLAIM_BATCH_SCRIPT)
+        batch = _claim_script(keys=[WRITE_BEHIND_KEY], args=[batch_size], client=redis_conn)
+    except RedisError as e:
+        logger.error(f"Redis error claiming message batch: {str(e)}")
+        return 0
+
+    if not batch:
+        return 0
+
+    try:
+        skipped = _insert_messages([_to_row(json.loads(raw)) for raw in batch])
+        db.session.commit()
+        logger.info(f"Wrote {len(batch)} messages in one batch")
+        for _ in range(skipped):
+            record_duplicate(redis_conn)
+        return len(batch)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error writing message batch, requeueing: {str(e)}")
+        try:
+            # Put the batch back at the head, in its original order
+            redis_conn.lpush(WRITE_BEHIND_KEY, *reversed(batch))
+        except RedisError as e:
+            logger.error(f"Redis error requeueing message batch: {str(e)}")
+        return 0
+
+def maybe_flush_message_batch(redis_conn, interval: float, batch_size: int) -> None:
+    """Drain the write-behind list at most once per interval in this process"""
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush < interval:
+        return
+    _last_flush = now
+    while flush_message_batch(redis_conn, batch_size) == batch_size:
+        pass
+
+def _index_unindexed_messages(redis_conn) -> None:
+    """Add in-flight records the index does not know yet, e.g. started before it existed"""
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hlen(INFLIGHT_KEY)
+    pipe.zcard(INFLIGHT_INDEX_KEY)
+    inflight_count, indexed_count = pipe.execute()
+    if inflight_count <= indexed_count:
+        return
+    for key, raw in redis_conn.hscan_iter(INFLIGHT_KEY, count=REAP_BATCH_SIZE):
+        redis_conn.zadd(INFLIGHT_INDEX_KEY, {key: json.loads(raw)['timestamp']}, nx=True)
+
+def reap_abandoned_messages(redis_conn) -> int:
+    """Persist messages a worker stopped processing as failed rows.
+
+    A worker that dies mid-job leaves its record in the in-flight set; once
+    it has been idle for INFLIGHT_MAX_AGE it is taken out and written with
+    status 'failed', so the message stays on record. Returns the number
+    persisted.
+    """
+    global _claim_abandoned_script
+    if not redis_conn:
+        return 0
+
+    try:
+        _index_unindexed_messages(redis_conn)
+        if _claim_abandoned_script is None:
+            _claim_abandoned_script = redis_conn.register_script(CLAIM_ABANDONED_SCRIPT)
+        batch = _claim_abandoned_script(keys=[INFLIGHT_KEY, INFLIGHT_INDEX_KEY],
+                                        args=[time.time() - INFLIGHT_MAX_AGE, REAP_BATCH_SIZE],
+                                        client=redis_conn)
+    except RedisError as e:
+        logger.error(f"Redis error claiming abandoned messages: {str(e)}")
+        return 0
+
+    if not batch:
+        return 0
+
+    records = [json.loads(raw) for raw in batch]
+    for record in records:
+        record['status'] = 'failed'
+        record['response'] = f"Abandoned: processing did not finish within {INFLIGHT_MAX_AGE}s"
+    try:
+        _insert_messages([_to_row(record) for record in records])
+        db.session.commit()
+        logger.warning(f"Persisted {len(records)} abandoned messages as failed")
+        return len(records)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error persisting abandoned messages, putting them back: {str(e)}")
+        try:
+            pipe = redis_conn.pipeline(transaction=True)
+            for raw, record in zip(batch, records):
+                pipe.hset(INFLIGHT_KEY, record['key'], raw)
+                pipe.zadd(INFLIGHT_INDEX_KEY, {record['key']: record['timestamp']})
+            pipe.execute()
+        except RedisError as e:
+            logger.error(f"Redis error restoring abandoned messages: {str(e)}")
+        return 0
+
+def maybe_reap_abandoned_messages(redis_conn, interval: float) -> None:
+    """Persist abandoned messages at most once per interval in this process"""
+    global _last_reap
+    now = time.monotonic()
+    if now - _last_reap < interval:
+        return
+    _last_reap = now
+    while reap_abandoned_messages(redis_conn) == REAP_BATCH_SIZE:
+        pass
+
+def get_unpersisted_messages(redis_conn, limit: int = 50) -> List[Dict]:
+    """In-flight and not yet written messages, newest first, for the dashboard.
+
+    Reads only the newest limit in-flight records through the index; records
+    past INFLIGHT_MAX_AGE are left for the workers to persist.
+    """
+    if not redis_conn:
+        return []
+
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.zrevrangebyscore(INFLIGHT_INDEX_KEY, '+inf', time.time() - INFLIGHT_MAX_AGE, start=0, num=limit)
+        pipe.lrange(WRITE_BEHIND_KEY, -limit, -1)
+        keys, pending_writes = pipe.execute()
+        inflight = redis_conn.hmget(INFLIGHT_KEY, keys) if keys else []
+    except RedisError as e:
+        logger.error(f"Redis error reading in-flight messages: {str(e)}")
+        return []
+
+    # A record completed between the two reads is simply missing
+    records = [json.loads(raw) for raw in inflight if raw is not None]
+    records.extend(json.loads(raw) for raw in pending_writes)
+
+    records.sort(key=lambda record: record['timestamp'], reverse=True)
+    for record in records[:limit]:
+        record['timestamp'] = datetime.utcfromtimestamp(record['timestamp'])
+    return records[:limit]
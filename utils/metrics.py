@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from redis import RedisError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGE_METRICS_KEY = "metrics:stage_seconds"  # series|bucket -> count, series|sum, series|count
+STAGE_METRIC_NAME = "sms_stage_duration_seconds"
+POOL_STATS_KEY = "metrics:redis_pool"  # host:pid -> latest pool stats of that process
+POOL_STATS_MAX_AGE = 300  # seconds before a process that stopped reporting is left out
+
+# Upper bounds in seconds; OpenAI calls take seconds, Redis-backed stages milliseconds
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Observations made by jobs in this process and not yet written to Redis
+_pending: List[Tuple[str, float]] = []
+_pending_lock = threading.Lock()
+_last_pool_report = 0.0
+
+def _series_id(stage: str, labels: Dict[str, str]) -> str:
+    return json.dumps([stage, sorted((key, str(value)) for key, value in labels.items())],
+                      separators=(',', ':'))
+
+def _bucket_field(seconds: float) -> str:
+    for bound in STAGE_BUCKETS:
+        if seconds <= bound:
+            return f"le={bound:g}"
+    return "le=+Inf"
+
+def observe(stage: str, seconds: float, **labels) -> None:
+    """Record how long a message spent in a stage; written to Redis by flush_metrics"""
+    with _pending_lock:
+        _pending.append((_series_id(stage, labels), seconds))
+
+@contextmanager
+def stage_timer(stage: str, **labels) -> Iterator[Dict[str, str]]:
+    """Time the block as one observation of stage.
+
+    Yields the labels, so the block can fill in values it only learns while
+    running (which sender was picked, whether a template matched). The time is
+    recorded even if the block raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(stage, time.perf_counter() - start, **labels)
+
+def observe_queue_wait(job) -> None:
+    """Record the time a job spent queued, from enqueue (or leaving the scheduler) to start"""
+    if not job.enqueued_at or not job.started_at:
+        return
+    # RQ reads timestamps back from Redis as naive UTC but sets started_at aware
+    enqueued_at, started_at = (moment.replace(tzinfo=None) for moment in (job.enqueued_at, job.started_at))
+    observe('queue_wait', max((started_at - enqueued_at).total_seconds(), 0), queue=job.origin)
+
+def flush_metrics(redis_conn, pipeline=None) -> None:
+    """Add this process's pending observations to the shared histograms.
+
+    Observations are summed per series and bucket first, so a job costs a
+    handful of HINCRBY calls in one round trip however many stages it timed.
+    """
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, []
+    if not pending or not redis_conn:
+        return
+
+    counts = defaultdict(int)
+    sums = defaultdict(float)
+    for series, seconds in pending:
+        counts[f"{series}|{_bucket_field(seconds)}"] += 1
+        counts[f"{series}|count"] += 1
+        sums[f"{series}|sum"] += seconds
+    try:
+        pipe = pipeline if pipeline is not None else redis_conn.pipeline(transaction=False)
+        for field, count in counts.items():
+            pipe.hincrby(STAGE_METRICS_KEY, field, count)
+        for field, total in sums.items():
+            pipe.hincrbyfloat(STAGE_METRICS_KEY, field, total)
+        if pipeline is None:
+            pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error writing stage metrics: {str(e)}")
+
+def record_pool_stats(redis_conn, role: str, stats: Optional[Dict]) -> None:
+    """Publish this process's connection pool stats for /metrics"""
+    if not redis_conn or not stats:
+        return
+    try:
+        redis_conn.hset(POOL_STATS_KEY, f"{socket.gethostname()}:{os.getpid()}",
+                        json.dumps({**stats, 'role': role, 'reported_at': time.time()}))
+    except RedisError as e:
+        logger.error(f"Redis error recording pool stats: {str(e)}")
+
+def maybe_record_pool_stats(redis_conn, role: str, stats: Optional[Dict], interval: float) -> None:
+    """Publish pool stats at most once per interval in this process"""
+    global _last_pool_report
+    now = time.monotonic()
+    if now - _last_pool_report < interval:
+        return
+    _last_pool_report = now
+    record_pool_stats(redis_conn, role, stats)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(pairs) -> str:
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in pairs)
+
+# name, type, help, field of a process's pool stats (None: per purpose, below)
+POOL_METRICS = (
+    ('redis_pool_max_connections', 'gauge', "Size of the process's Redis connection pool.", 'max_connections'),
+    ('redis_pool_connections_open', 'gauge', "Connections the pool has opened.", 'created'),
+    ('redis_pool_connections_in_use', 'gauge', "Connections checked out right now.", 'in_use'),
+    ('redis_pool_connections_peak', 'gauge', "Most connections checked out at once.", 'peak_in_use'),
+    ('redis_pool_exhausted_total', 'counter', "Callers that gave up waiting for a connection.", 'exhausted'),
+)
+# name, type, help, field of the per purpose usage
+POOL_PURPOSE_METRICS = (
+    ('redis_pool_checkouts_total', 'counter', "Connections taken from the pool.", 'checkouts'),
+    ('redis_pool_wait_seconds_total', 'counter', "Time spent getting a connection from the pool.", 'wait_seconds'),
+    ('redis_pool_wait_seconds_max', 'gauge', "Longest wait for a connection.", 'max_wait_seconds'),
+)
+
+def _render_pool_metrics(redis_conn) -> List[str]:
+    try:
+        raw = redis_conn.hgetall(POOL_STATS_KEY)
+    except RedisError as e:
+        logger.error(f"Redis error reading pool stats: {str(e)}")
+        return []
+
+    processes = []
+    cutoff = time.time() - POOL_STATS_MAX_AGE
+    for process, value in sorted(raw.items()):
+        stats = json.loads(value)
+        if stats.get('reported_at', 0) >= cutoff:
+            process = process.decode('utf-8') if isinstance(process, bytes) else process
+            processes.append(([('process', process), ('role', stats.get('role', ''))], stats))
+
+    lines = []
+    for name, kind, description, field in POOL_METRICS:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{{{_label_text(pairs)}}} {stats.get(field, 0)}" for pairs, stats in processes]
+    for name, kind, description, field in POOL_PURPOSE_METRICS:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        for pairs, stats in processes:
+            for purpose, usage in sorted(stats.get('purposes', {}).items()):
+                lines.append(f"{name}{{{_label_text(pairs + [('purpose', purpose)])}}} {usage.get(field, 0):g}")
+    return lines
+
+def render_metrics(redis_conn) -> str:
+    """The stage histograms and Redis pool stats in the Prometheus text exposition format"""
+    lines = [
+        f"# HELP {STAGE_METRIC_NAME} Time a message spends in each processing stage.",
+        f"# TYPE {STAGE_METRIC_NAME} histogram",
+    ]
+    if not redis_conn:
+        return '\n'.join(lines) + '\n'
+    try:
+        raw = redis_conn.hgetall(STAGE_METRICS_KEY)
+    except RedisError as e:
+        logger.error(f"Redis error reading stage metrics: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+    series = defaultdict(dict)
+    for field, value in raw.items():
+        field = field.decode('utf-8') if isinstance(field, bytes) else field
+        series_id, _, name = field.rpartition('|')
+        series[series_id][name] = float(value) if name == 'sum' else int(value)
+
+    for series_id in sorted(series):
+        values = series[series_id]
+        stage, labels = json.loads(series_id)
+        pairs = [('stage', stage)] + [tuple(pair) for pair in labels]
+        cumulative = 0
+        for bound in STAGE_BUCKETS:
+            cumulative += values.get(f"le={bound:g}", 0)
+            lines.append(f'{STAGE_METRIC_NAME}_bucket{{{_label_text(pairs + [("le", f"{bound:g}")])}}} '
+                         f'{cumulative}')
+        lines.append(f'{STAGE_METRIC_NAME}_bucket{{{_label_text(pairs + [("le", "+Inf")])}}} '
+                     f'{values.get("count", 0)}')
+        lines.append(f"{STAGE_METRIC_NAME}_sum{{{_label_text(pairs)}}} {values.get('sum', 0):.6f}")
+        lines.append(f"{STAGE_METRIC_NAME}_count{{{_label_text(pairs)}}} {values.get('count', 0)}")
+    lines += _render_pool_metrics(redis_conn)
+    return '\n'.join(lines) + '\n'
@@ -1,39 +1,265 @@
 import os
-from openai import OpenAI
-from models import MessageTemplate, db
+import time
+import asyncio
+import threading
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIError
+from models import MessageTemplate
+from utils.redis_helper import get_redis_connection
+from utils.template_matcher import KeywordMatcher, TemplateMatch, get_template_version
+from utils.template_usage import record_template_usage
+from utils.response_cache import get_cached_response, cache_response
+from utils.conversation import get_conversation, append_exchange, build_chat_messages
+from utils.metrics import observe, stage_timer
+from utils.sms_segments import SegmentBuffer
+from config import Config
+from utils.async_utils import run_in_app_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
+async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+OPENAI_MODEL = "gpt-4"
+FALLBACK_RESPONSE = "I apologize, but I'm unable to process your request at the moment."
+# What a failed or broken off OpenAI stream raises
+STREAM_ERRORS = (APIError, httpx.HTTPError)
+
+# Compiled matcher shared by every job in this process, rebuilt when the
+# template version in Redis changes
+_matcher_lock = threading.Lock()
+_matcher = None
+_matcher_version = None
+
+def _build_template_matcher() -> KeywordMatcher:
+    templates = MessageTemplate.query.filter_by(active=True)\
+        .order_by(MessageTemplate.id)\
+        .all()
+    return KeywordMatcher(
+        (TemplateMatch(t.id, t.name, t.response_template), t.trigger_keywords)
+        for t in templates
+    )
+
+def get_template_matcher() -> KeywordMatcher:
+    """Return the compiled matcher, rebuilding it only if templates changed"""
+    global _matcher, _matcher_version
 
-def find_matching_template(message: str) -> MessageTemplate:
+    version = get_template_version(get_redis_connection())
+    with _matcher_lock:
+        # Without a readable version we cannot tell if the cache is stale
+        if _matcher is None or version is None or version != _matcher_version:
+            _matcher = _build_template_matcher()
+            _matcher_version = version
+            logger.info(f"Compiled {len(_matcher.templates)} templates (version {version})")
+        return _matcher
+
+def find_matching_template(message: str) -> Optional[TemplateMatch]:
     """Find a matching template based on keywords in the message."""
-    templates = MessageTemplate.query.filter_by(active=True).all()
-    
-    for template in templates:
-        keywords = [k.strip().lower() for k in template.trigger_keywords.split(',')]
-        message_lower = message.lower()
-        
-        if any(keyword in message_lower for keyword in keywords):
-            template.usage_count += 1
-            db.session.commit()
-            return template
-    
-    return None
-
-def generate_response(message: str) -> str:
+    with stage_timer('template_match', template_hit='false') as labels:
+        template = get_template_matcher().match(message)
+        labels['template_hit'] = 'true' if template else 'false'
+
+    if template:
+        record_template_usage(get_redis_connection(), template.id)
+
+    return template
+
+def _load_context(redis_conn, message: str, from_number: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+    """Return the chat messages to send OpenAI and a cached reply to exactly those, if any.
+
+    Cached replies are keyed on the trimmed history as well as the message,
+    so one is reused only for the same prompt, and earlier replies
+    (templates included) do not turn the cache off for the sender.
+    """
+    history = get_conversation(redis_conn, from_number)
+    chat_messages = build_chat_messages(history, message, Config.CONVERSATION_TOKEN_BUDGET)
+    cached = get_cached_response(redis_conn, message, OPENAI_MODEL, chat_messages[:-1])
+    return chat_messages, cached
+
+def _remember_reply(redis_conn, from_number: Optional[str], message: str, reply: str,
+                    cache_context: Optional[List[Dict]] = None) -> None:
+    """Add the exchange to the conversation and, given the context it was generated with, cache the reply"""
+    append_exchange(redis_conn, from_number, message, reply,
+                    Config.CONVERSATION_MAX_MESSAGES, Config.CONVERSATION_TTL)
+    if cache_context is not None:
+        cache_response(redis_conn, message, OPENAI_MODEL, reply, cache_context)
+
+def _stream_text(chat_messages: List[Dict]) -> Iterator[str]:
+    """The text of each chunk of a streamed completion"""
+    for chunk in openai_client.chat.completions.create(model=OPENAI_MODEL, messages=chat_messages, stream=True):
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            yield text
+
+async def _stream_text_async(chat_messages: List[Dict]) -> AsyncIterator[str]:
+    stream = await async_openai_client.chat.completions.create(model=OPENAI_MODEL, messages=chat_messages,
+                                                               stream=True)
+    async for chunk in stream:
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            yield text
+
+def _stream_completion(chat_messages: List[Dict], on_segment: Callable[[str], None]) -> Tuple[Optional[str], bool]:
+    """Stream a completion, handing each SMS-sized segment to on_segment as soon as it is complete.
+
+    Returns the full text and whether the stream finished, or (None, False)
+    if OpenAI failed before any text arrived. A stream that breaks off after
+    some text arrived still delivers that text. Only OpenAI errors are
+    handled here; an error from on_segment propagates.
+
+    openai_call is timed over the reads from the stream only, as the time
+    on_segment spends sending is recorded by its own stages.
+    """
+    segments = SegmentBuffer()
+    parts = []
+    complete = True
+    waited = 0.0
     try:
+        texts = _stream_text(chat_messages)
+        while True:
+            start = time.perf_counter()
+            try:
+                text = next(texts)
+            except StopIteration:
+                break
+            except STREAM_ERRORS as e:
+                if not parts:
+                    logger.error(f"OpenAI API error: {str(e)}")
+                    return None, False
+                logger.error(f"OpenAI stream interrupted, sending the partial reply: {str(e)}")
+                complete = False
+                break
+            finally:
+                waited += time.perf_counter() - start
+            parts.append(text)
+            for segment in segments.feed(text):
+                on_segment(segment)
+    finally:
+        observe('openai_call', waited, model=OPENAI_MODEL, stream='true')
+    for segment in segments.flush():
+        on_segment(segment)
+    return ''.join(parts), complete
+
+async def _stream_completion_async(chat_messages: List[Dict],
+                                   on_segment: Callable[[str], Awaitable[None]]) -> Tuple[Optional[str], bool]:
+    """Asyncio variant of _stream_completion"""
+    segments = SegmentBuffer()
+    parts = []
+    complete = True
+    waited = 0.0
+    try:
+        texts = _stream_text_async(chat_messages)
+        while True:
+            start = time.perf_counter()
+            try:
+                text = await anext(texts)
+            except StopAsyncIteration:
+                break
+            except STREAM_ERRORS as e:
+                if not parts:
+                    logger.error(f"OpenAI API error: {str(e)}")
+                    return None, False
+                logger.error(f"OpenAI stream interrupted, sending the partial reply: {str(e)}")
+                complete = False
+                break
+            finally:
+                waited += time.perf_counter() - start
+            parts.append(text)
+            for segment in segments.feed(text):
+                await on_segment(segment)
+    finally:
+        observe('openai_call', waited, model=OPENAI_MODEL, stream='true')
+    for segment in segments.flush():
+        await on_segment(segment)
+    return ''.join(parts), complete
+
+def generate_reply(message: str, from_number: Optional[str] = None,
+                   on_segment: Optional[Callable[[str], None]] = None) -> Tuple[str, Optional[int]]:
+    """Return the reply text and the id of the template that produced it, if any.
+
+    With on_segment, an OpenAI reply is streamed and passed to on_segment in
+    SMS-sized segments while it is generated; template and cached replies
+    are only returned.
+    """
+    try:
+        redis_conn = get_redis_connection('cache')
+
         # First check for matching template
         template = find_matching_template(message)
         
         if template:
-            return template.response_template
+            _remember_reply(redis_conn, from_number, message, template.response_template)
+            return template.response_template, template.id
+
+        # Then for an answer already generated for the same question
+        chat_messages, cached = _load_context(redis_conn, message, from_number)
+        if cached is not None:
+            _remember_reply(redis_conn, from_number, message, cached)
+            return cached, None
             
-        # If no template matches, use OpenAI
-        response = openai_client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": message}]
-        )
-        return response.choices[0].message.content
+        # If no template matches, use OpenAI with the recent conversation
+        if not on_segment:
+            with stage_timer('openai_call', model=OPENAI_MODEL):
+                response = openai_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=chat_messages
+                )
+            reply = response.choices[0].message.content
+            _remember_reply(redis_conn, from_number, message, reply, chat_messages[:-1])
+            return reply, None
     except Exception as e:
-        print(f"OpenAI API error: {str(e)}")
-        return "I apologize, but I'm unable to process your request at the moment."
+        logger.error(f"OpenAI API error: {str(e)}")
+        return FALLBACK_RESPONSE, None
+
+    # Streamed outside the handler above, so an error sending a segment
+    # reaches the caller instead of passing for an OpenAI failure
+    reply, complete = _stream_completion(chat_messages, on_segment)
+    if reply is None:
+        return FALLBACK_RESPONSE, None
+    _remember_reply(redis_conn, from_number, message, reply, chat_messages[:-1] if complete else None)
+    return reply, None
+
+def generate_response(message: str, from_number: Optional[str] = None) -> str:
+    return generate_reply(message, from_number)[0]
+
+async def generate_reply_async(message: str, from_number: Optional[str] = None,
+                               on_segment: Optional[Callable[[str], Awaitable[None]]] = None
+                               ) -> Tuple[str, Optional[int]]:
+    """Same as generate_reply, awaiting OpenAI instead of blocking on it"""
+    try:
+        redis_conn = get_redis_connection('cache')
+        template = await run_in_app_context(find_matching_template, message)
+
+        if template:
+            await asyncio.to_thread(_remember_reply, redis_conn, from_number, message, template.response_template)
+            return template.response_template, template.id
+
+        chat_messages, cached = await asyncio.to_thread(_load_context, redis_conn, message, from_number)
+        if cached is not None:
+            await asyncio.to_thread(_remember_reply, redis_conn, from_number, message, cached)
+            return cached, None
+
+        if not on_segment:
+            with stage_timer('openai_call', model=OPENAI_MODEL):
+                response = await async_openai_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=chat_messages
+                )
+            reply = response.choices[0].message.content
+            await asyncio.to_thread(_remember_reply, redis_conn, from_number, message, reply, chat_messages[:-1])
+            return reply, None
+    except Exception as e:
+        logger.error(f"OpenAI API error: {str(e)}")
+        return FALLBACK_RESPONSE, None
+
+    reply, complete = await _stream_completion_async(chat_messages, on_segment)
+    if reply is None:
+        return FALLBACK_RESPONSE, None
+    await asyncio.to_thread(_remember_reply, redis_conn, from_number, message, reply,
+                            chat_messages[:-1] if complete else None)
+    return reply, None
@@ -0,0 +1,79 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from rq import Queue
+from redis import RedisError
+from config import Config
+from utils.sender_allocator import lookup_number_priority
+from utils.job_payload import CompactJSONSerializer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUE_HIGH = 'messages_high'
+QUEUE_DEFAULT = 'messages'
+QUEUE_LOW = 'messages_low'
+QUEUE_NAMES = (QUEUE_HIGH, QUEUE_DEFAULT, QUEUE_LOW)
+
+def get_queue(name: str, connection) -> Queue:
+    """A message queue; jobs on every message queue are stored as compact JSON"""
+    return Queue(name, connection=connection, serializer=CompactJSONSerializer)
+
+def get_queues(connection) -> List[Queue]:
+    """The message queues, highest priority first"""
+    return [get_queue(name, connection) for name in QUEUE_NAMES]
+
+def queue_for_priority(priority: int) -> str:
+    """Name of the queue that serves messages of the given priority"""
+    if priority >= Config.HIGH_PRIORITY_THRESHOLD:
+        return QUEUE_HIGH
+    if priority <= Config.LOW_PRIORITY_THRESHOLD:
+        return QUEUE_LOW
+    return QUEUE_DEFAULT
+
+def classify_message(redis_conn, from_number: Optional[str], to_number: Optional[str]) -> Tuple[str, int]:
+    """Pick the queue and message priority for an inbound message.
+
+    Allowlisted senders always go to the high queue. Otherwise the priority
+    of the number the message was sent to decides.
+    """
+    priority = 0
+    if redis_conn and to_number:
+        try:
+            priority = lookup_number_priority(redis_conn, to_number) or 0
+        except RedisError as e:
+            logger.error(f"Redis error looking up number priority: {str(e)}")
+
+    if from_number in Config.PRIORITY_SENDERS:
+        priority = max(priority, Config.HIGH_PRIORITY_THRESHOLD)
+    return queue_for_priority(priority), priority
+
+class WeightedFairOrder:
+    """Smooth weighted round-robin over a set of queues.
+
+    After every dequeue the queue that was served is charged and the queues
+    are reordered by remaining credit, so under load each queue is tried
+    first in proportion to its weight (6:3:1 gives high, default, high, low,
+    high, default, ...). A lower priority queue therefore always gets its
+    share, while an empty queue simply falls through to the next one.
+    """
+
+    def __init__(self, queues: List[Queue], weights: Dict[str, int]):
+        self.queues = list(queues)
+        self.weights = {queue.name: max(weights.get(queue.name, 1), 1) for queue in self.queues}
+        self.total = sum(self.weights.values())
+        self.credit = {queue.name: 0 for queue in self.queues}
+        self.order = sorted(self.queues, key=lambda queue: -self.weights[queue.name])
+
+    def served(self, queue: Queue) -> List[Queue]:
+        """Account for a job taken from queue and return the order for the next dequeue"""
+        for name, weight in self.weights.items():
+            self.credit[name] += weight
+        if queue.name in self.credit:
+            self.credit[queue.name] -= self.total
+        # Bound the credit an idle queue can build up, so it cannot monopolise
+        # the worker once it fills again
+        for name in self.credit:
+            self.credit[name] = max(-self.total, min(self.credit[name], self.total))
+        self.order = sorted(self.queues, key=lambda q: (-self.credit[q.name], -self.weights[q.name]))
+        return self.order
@@ -0,0 +1,121 @@
+import uuid
+import threading
+import logging
+from typing import Optional
+from redis import RedisError
+from utils.redis_handler import get_queue_stats, get_processing_stats, record_queue_stats
+from utils.dashboard_events import publish_dashboard_stats, refresh_dashboard_stats
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SAMPLER_LOCK_KEY = "queue:sampler:lock"
+
+# Extend the lock only if this sampler still holds it
+RENEW_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class QueueStatsSampler:
+    """Records queue statistics on a fixed cadence, independently of page views.
+
+    Each sample is also published to open dashboards, but only when it
+    differs from the previous one.
+
+    Any number of samplers may run across replicas; a Redis lock with a TTL
+    makes exactly one of them the active sampler. The others keep trying to
+    take the lock, so one of them takes over within ``lock_ttl`` seconds if
+    the active sampler dies. Retention needs no trimming pass: every rollup
+    bucket carries its own expiry.
+    """
+
+    def __init__(self, redis_conn, queues, interval: float = 10.0, lock_ttl: float = 30.0):
+        self.redis_conn = redis_conn
+        self.queues = queues
+        self.interval = interval
+        self.lock_ttl = lock_ttl
+        self.token = uuid.uuid4().hex
+        self.is_leader = False
+        self._last_published = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._renew_script = redis_conn.register_script(RENEW_LOCK_SCRIPT)
+        self._release_script = redis_conn.register_script(RELEASE_LOCK_SCRIPT)
+
+    def _hold_lock(self) -> bool:
+        """Take or extend the sampler lock; returns whether this sampler holds it"""
+        ttl_ms = int(self.lock_ttl * 1000)
+        try:
+            if self.is_leader:
+                held = bool(self._renew_script(keys=[SAMPLER_LOCK_KEY], args=[self.token, ttl_ms]))
+            else:
+                held = bool(self.redis_conn.set(SAMPLER_LOCK_KEY, self.token, nx=True, px=ttl_ms))
+        except RedisError as e:
+            logger.error(f"Redis error refreshing sampler lock: {str(e)}")
+            held = False
+
+        if held != self.is_leader:
+            logger.info("Queue sampler is now active" if held else "Queue sampler lost its lock - standing by")
+            self._last_published = None
+        self.is_leader = held
+        return held
+
+    def sample_once(self) -> None:
+        if not self._hold_lock():
+            return
+        stats = get_queue_stats(self.queues)
+        record_queue_stats(self.redis_conn, self.queues, stats)
+
+        snapshot = {'queue': stats, 'processing': get_processing_stats(self.redis_conn)}
+        # Long enough to survive a missed tick, short enough to go stale if we stop
+        ttl = int(max(self.interval * 3, 15))
+        if snapshot != self._last_published:
+            publish_dashboard_stats(self.redis_conn, snapshot, ttl)
+            self._last_published = snapshot
+        else:
+            refresh_dashboard_stats(self.redis_conn, ttl)
+
+    def run(self) -> None:
+        """Sample until stop() is called"""
+        logger.info(f"Queue sampler started (every {self.interval}s)")
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.sample_once()
+                except Exception as e:
+                    logger.error(f"Error sampling queue stats: {str(e)}")
+                self._stop.wait(self.interval)
+        finally:
+            # Let a standby take over right away instead of after the TTL
+            self._release()
+
+    def start(self) -> threading.Thread:
+        """Run the sampler on a daemon thread next to other work in this process"""
+        self._thread = threading.Thread(target=self.run, name="queue-stats-sampler", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 1)
+
+    def _release(self) -> None:
+        if not self.is_leader:
+            return
+        try:
+            self._release_script(keys=[SAMPLER_LOCK_KEY], args=[self.token])
+        except RedisError as e:
+            logger.error(f"Redis error releasing sampler lock: {str(e)}")
+        self.is_leader = False
@@ -1,7 +1,7 @@
-import json
 import time
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Dict, List, Optional
 import logging
 from redis import RedisError, ResponseError
 
@@ -9,104 +9,205 @@ from redis import RedisError, ResponseError
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_queue_stats(queue):
-    """Get detailed queue statistics"""
+PROCESSING_COUNTERS_KEY = "processing:counters"
+PROCESSING_VOLUME_PREFIX = "processing:volume:"
+
+# Queue history is kept as fixed rollup buckets: resolution (seconds) -> retention (seconds)
+QUEUE_ROLLUP_PREFIX = "queue:rollup:"
+HISTORY_RESOLUTIONS = {60: 86400, 300: 7 * 86400, 3600: 30 * 86400}
+MAX_HISTORY_POINTS = 360
+QUEUE_STATES = ('queued', 'started', 'finished', 'failed', 'deferred', 'scheduled')
+
+# Update min/max/last per state in one bucket per resolution.
+# KEYS are the bucket hashes; ARGV holds one TTL per key, then state/value pairs.
+RECORD_ROLLUP_SCRIPT = """
+local first_pair = #KEYS + 1
+for k, key in ipairs(KEYS) do
+    local fields = {}
+    for i = first_pair, #ARGV, 2 do
+        local state, value = ARGV[i], tonumber(ARGV[i + 1])
+        local low = tonumber(redis.call('HGET', key, state .. ':min'))
+        local high = tonumber(redis.call('HGET', key, state .. ':max'))
+        table.insert(fields, state .. ':last')
+        table.insert(fields, value)
+        if not low or value < low then
+            table.insert(fields, state .. ':min')
+            table.insert(fields, value)
+        end
+        if not high or value > high then
+            table.insert(fields, state .. ':max')
+            table.insert(fields, value)
+        end
+    end
+    redis.call('HSET', key, unpack(fields))
+    redis.call('EXPIRE', key, ARGV[k])
+end
+return #KEYS
+"""
+
+# All counts for one queue and the enqueue time of its oldest queued job.
+# KEYS: queue list, then failed/finished/started/deferred/scheduled registries.
+# ARGV: now, job key prefix. Expired registry entries are not counted,
+# matching RQ's cleanup on count.
+QUEUE_SNAPSHOT_SCRIPT = """
+local now = ARGV[1]
+local counts = {redis.call('LLEN', KEYS[1])}
+for i = 2, 5 do
+    table.insert(counts, redis.call('ZCOUNT', KEYS[i], '(' .. now, '+inf'))
+end
+table.insert(counts, redis.call('ZCARD', KEYS[6]))
+
+local oldest = false
+local head = redis.call('LINDEX', KEYS[1], 0)
+if head then
+    oldest = redis.call('HGET', ARGV[2] .. head, 'enqueued_at') or false
+end
+table.insert(counts, oldest)
+return counts
+"""
+
+QUEUE_THROUGHPUT_PREFIX = "queue:throughput:"  # jobs finished per second
+THROUGHPUT_WINDOW = 10  # seconds averaged for jobs per second
+QUEUE_STATS_CACHE_TTL = 1.0  # seconds a snapshot is shared between callers
+
+_record_rollup_script = None
+_queue_snapshot_script = None
+_queue_snapshot_lock = threading.Lock()
+_queue_snapshot_cache = {}  # queue names -> (expires, stats)
+
+def get_default_queue_stats() -> Dict:
+    stats = {state: 0 for state in QUEUE_STATES}
+    stats.update({'oldest_job_age': 0, 'jobs_per_second': 0, 'queues': []})
+    return stats
+
+def _job_age(enqueued_at) -> float:
+    if not enqueued_at:
+        return 0
+    enqueued_at = datetime.strptime(_as_text(enqueued_at), '%Y-%m-%dT%H:%M:%S.%fZ')
+    return round(max((datetime.utcnow() - enqueued_at).total_seconds(), 0), 1)
+
+def _fetch_queue_stats(queues) -> Dict:
+    global _queue_snapshot_script
+    connection = queues[0].connection
+    if _queue_snapshot_script is None:
+        _queue_snapshot_script = connection.register_script(QUEUE_SNAPSHOT_SCRIPT)
+
+    now = time.time()
+    second = int(now)
+    pipe = connection.pipeline(transaction=False)
+    for queue in queues:
+        _queue_snapshot_script(
+            keys=[
+                queue.key,
+                queue.failed_job_registry.key,
+                queue.finished_job_registry.key,
+                queue.started_job_registry.key,
+                queue.deferred_job_registry.key,
+                queue.scheduled_job_registry.key,
+            ],
+            args=[now, queue.job_class.redis_job_namespace_prefix],
+            client=pipe
+        )
+    # Completed seconds only, so a partly counted current second does not drag the rate down
+    pipe.mget([f"{QUEUE_THROUGHPUT_PREFIX}{second - i}" for i in range(1, THROUGHPUT_WINDOW + 1)])
+    *snapshots, throughput = pipe.execute()
+
+    stats = get_default_queue_stats()
+    for queue, counts in zip(queues, snapshots):
+        queue_stats = dict(zip(('queued', 'failed', 'finished', 'started', 'deferred', 'scheduled'), counts))
+        queue_stats['oldest_job_age'] = _job_age(counts[6])
+        for state in QUEUE_STATES:
+            stats[state] += queue_stats[state]
+        stats['oldest_job_age'] = max(stats['oldest_job_age'], queue_stats['oldest_job_age'])
+        stats['queues'].append({'name': queue.name, **queue_stats})
+    stats['jobs_per_second'] = round(sum(int(count) for count in throughput if count) / THROUGHPUT_WINDOW, 2)
+    return stats
+
+def get_queue_stats(queues):
+    """Get detailed statistics for the queues, totalled and per queue, from one snapshot
+    shared for QUEUE_STATS_CACHE_TTL seconds"""
+    cache_key = tuple(queue.name for queue in queues)
     try:
-        return {
-            'queued': len(queue),
-            'failed': len(queue.failed_job_registry),
-            'finished': len(queue.finished_job_registry),
-            'started': len(queue.started_job_registry),
-            'deferred': len(queue.deferred_job_registry),
-            'scheduled': len(queue.scheduled_job_registry)
-        }
+        with _queue_snapshot_lock:
+            # Requests arriving while a fetch is in flight wait for it and reuse it
+            cached = _queue_snapshot_cache.get(cache_key)
+            if cached and cached[0] > time.monotonic():
+                return dict(cached[1])
+            stats = _fetch_queue_stats(queues)
+            _queue_snapshot_cache[cache_key] = (time.monotonic() + QUEUE_STATS_CACHE_TTL, stats)
+            return dict(stats)
     except Exception as e:
         logger.error(f"Error getting queue stats: {str(e)}")
-        return {
-            'queued': 0,
-            'failed': 0,
-            'finished': 0,
-            'started': 0,
-            'deferred': 0,
-            'scheduled': 0
-        }
-
-def _decode_history_point(point) -> Dict:
-    """Helper function to decode and validate history points"""
-    if isinstance(point, bytes):
-        point = point.decode('utf-8')
+        return get_default_queue_stats()
+
+def record_job_completion(redis_conn, pipeline=None) -> None:
+    """Count a finished job (successful or not) towards the jobs-per-second rate"""
+    key = f"{QUEUE_THROUGHPUT_PREFIX}{int(time.time())}"
     try:
-        data = json.loads(point)
-        
-        # Ensure all required fields exist with default values
-        default_data = {
-            'timestamp': datetime.utcnow().timestamp(),
-            'queued': 0,
-            'started': 0,
-            'failed': 0,
-            'finished': 0,
-            'deferred': 0,
-            'scheduled': 0
-        }
-        
-        # Update defaults with actual data, ensuring numeric values
-        for key in default_data:
-            if key in data:
-                try:
-                    default_data[key] = float(data[key]) if key == 'timestamp' else int(data[key])
-                except (ValueError, TypeError):
-                    logger.warning(f"Invalid value for {key} in history point, using default")
-        
-        return default_data
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error in history point: {str(e)}")
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error processing history point: {str(e)}")
-        raise
+        pipe = pipeline if pipeline is not None else redis_conn.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, THROUGHPUT_WINDOW * 2)
+        if pipeline is None:
+            pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error counting job completion: {str(e)}")
+
+def choose_history_resolution(period_hours: float, requested: Optional[int] = None) -> int:
+    """Finest rollup resolution that keeps the period under MAX_HISTORY_POINTS buckets.
+
+    A requested resolution is honoured unless it would exceed that bound.
+    """
+    period = period_hours * 3600
+    for resolution in sorted(HISTORY_RESOLUTIONS):
+        if requested and resolution < requested:
+            continue
+        if period / resolution <= MAX_HISTORY_POINTS:
+            return resolution
+    return max(HISTORY_RESOLUTIONS)
 
-def get_queue_history(redis_conn, period_hours=24) -> List[Dict]:
-    """Get queue history for the specified period with improved error handling"""
+def _rollup_key(resolution: int, bucket: int) -> str:
+    return f"{QUEUE_ROLLUP_PREFIX}{resolution}:{bucket}"
+
+def get_queue_history(redis_conn, period_hours=24, resolution=None) -> List[Dict]:
+    """Get pre-aggregated queue history, one point per rollup bucket in the period"""
     if not redis_conn:
         logger.warning("Redis connection not available")
         return []
 
+    resolution = choose_history_resolution(period_hours, resolution)
+    now = int(time.time())
+    last_bucket = now - now % resolution
+    first_bucket = last_bucket - int(period_hours * 3600) // resolution * resolution
+    buckets = range(max(first_bucket, last_bucket - (MAX_HISTORY_POINTS - 1) * resolution),
+                    last_bucket + 1, resolution)
+    fields = [f"{state}:{agg}" for state in QUEUE_STATES for agg in ('last', 'min', 'max')]
+
     max_retries = 3
     retry_delay = 1  # seconds
     current_retry = 0
 
     while current_retry < max_retries:
         try:
-            now = datetime.utcnow()
-            start_time = now - timedelta(hours=period_hours)
-            history_key = "queue:history"
-            
-            # Get all history points within the time range
-            raw_history = redis_conn.zrangebyscore(
-                history_key,
-                start_time.timestamp(),
-                now.timestamp()
-            )
-            
-            if not raw_history:
-                logger.info("No queue history data found for the specified period")
-                return []
-                
+            # Bucket keys are derived from the time range, so every bucket
+            # in the period is read in a single round trip
+            pipe = redis_conn.pipeline(transaction=False)
+            for bucket in buckets:
+                pipe.hmget(_rollup_key(resolution, bucket), fields)
+            rows = pipe.execute()
+
             history_data = []
-            for point in raw_history:
-                try:
-                    decoded_point = _decode_history_point(point)
-                    history_data.append(decoded_point)
-                except Exception as e:
-                    logger.warning(f"Skipping malformed history point: {str(e)}")
-                    continue
-            
-            # Sort by timestamp and ensure we have at least some valid points
-            if history_data:
-                history_data.sort(key=lambda x: x['timestamp'])
-                logger.info(f"Successfully retrieved {len(history_data)} history points")
-                return history_data
-            return []
+            for bucket, values in zip(buckets, rows):
+                if values[0] is None:
+                    continue  # nothing was recorded in this bucket
+                point = {'timestamp': bucket, 'resolution': resolution}
+                for field, value in zip(fields, values):
+                    state, agg = field.split(':')
+                    point[state if agg == 'last' else f"{state}_{agg}"] = int(value or 0)
+                history_data.append(point)
+
+            if not history_data:
+                logger.info("No queue history data found for the specified period")
+            return history_data
 
         except RedisError as e:
             current_retry += 1
@@ -120,35 +221,37 @@ def get_queue_history(redis_conn, period_hours=24) -> List[Dict]:
             logger.error(f"Unexpected error in queue history: {str(e)}")
             return []
 
-def record_queue_stats(redis_conn, queue):
-    """Record current queue statistics for historical tracking"""
+def record_queue_stats(redis_conn, queues, stats: Optional[Dict] = None):
+    """Fold the current (or given) queue statistics into the 1m/5m/1h rollup buckets"""
+    global _record_rollup_script
     if not redis_conn:
         logger.warning("Redis connection not available - skipping stats recording")
         return
 
     try:
-        stats = get_queue_stats(queue)
-        stats['timestamp'] = datetime.utcnow().timestamp()
-        
-        # Store in a sorted set with timestamp as score
-        redis_conn.zadd(
-            "queue:history",
-            {json.dumps(stats): stats['timestamp']}
-        )
-        
-        # Trim old entries (keep last 7 days)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        redis_conn.zremrangebyscore(
-            "queue:history",
-            0,
-            week_ago.timestamp()
-        )
+        stats = stats or get_queue_stats(queues)
+        now = int(time.time())
+        keys = [_rollup_key(resolution, now - now % resolution) for resolution in HISTORY_RESOLUTIONS]
+        args = [HISTORY_RESOLUTIONS[resolution] for resolution in HISTORY_RESOLUTIONS]
+        for state in QUEUE_STATES:
+            args.extend([state, stats[state]])
+
+        if _record_rollup_script is None:
+            _record_rollup_script = redis_conn.register_script(RECORD_ROLLUP_SCRIPT)
+        _record_rollup_script(keys=keys, args=args, client=redis_conn)
         logger.info("Queue stats recorded successfully")
     except RedisError as e:
         logger.error(f"Redis error recording queue stats: {str(e)}")
     except Exception as e:
         logger.error(f"Error recording queue stats: {str(e)}")
 
+def _as_text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def _hourly_volume_keys(now: datetime) -> List[str]:
+    """Hour buckets for the last 24 hours, newest first"""
+    return [(now - timedelta(hours=i)).strftime('%Y-%m-%d-%H') for i in range(24)]
+
 def get_processing_stats(redis_conn) -> Dict:
     """Get message processing statistics"""
     if not redis_conn:
@@ -156,16 +259,33 @@ def get_processing_stats(redis_conn) -> Dict:
         return get_default_processing_stats()
 
     try:
-        stats_key = "processing:stats"
-        raw_stats = redis_conn.get(stats_key)
-        
-        if raw_stats:
-            try:
-                return json.loads(raw_stats)
-            except json.JSONDecodeError as e:
-                logger.error(f"Error decoding processing stats: {str(e)}")
-                return get_default_processing_stats()
-        return get_default_processing_stats()
+        hours = _hourly_volume_keys(datetime.utcnow())
+
+        # Counters and the whole 24h volume window in a single round trip
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.hgetall(PROCESSING_COUNTERS_KEY)
+        pipe.mget([f"{PROCESSING_VOLUME_PREFIX}{hour}" for hour in hours])
+        raw_counters, raw_volume = pipe.execute()
+
+        counters = {_as_text(k): _as_text(v) for k, v in raw_counters.items()}
+        total_processed = int(counters.get('total_processed', 0))
+        success_count = int(counters.get('success_count', 0))
+        total_time = float(counters.get('total_time', 0))
+
+        stats = get_default_processing_stats()
+        stats['duplicates_suppressed'] = int(counters.get('duplicates_suppressed', 0))
+        first_sms_count = int(counters.get('first_sms_count', 0))
+        if first_sms_count:
+            stats['avg_time_to_first_sms'] = float(counters.get('first_sms_time', 0)) / first_sms_count
+        if total_processed:
+            stats['total_processed'] = total_processed
+            stats['avg_processing_time'] = total_time / total_processed
+            stats['success_rate'] = (success_count / total_processed) * 100
+        stats['hourly_volume'] = [
+            {'hour': hour, 'count': int(count) if count else 0}
+            for hour, count in zip(hours, raw_volume)
+        ]
+        return stats
     except RedisError as e:
         logger.error(f"Redis error getting processing stats: {str(e)}")
         return get_default_processing_stats()
@@ -179,63 +299,41 @@ def get_default_processing_stats() -> Dict:
         'avg_processing_time': 0,
         'total_processed': 0,
         'success_rate': 100,
+        'duplicates_suppressed': 0,
+        'avg_time_to_first_sms': 0,
         'hourly_volume': []
     }
 
+def record_first_sms(redis_conn, seconds: float) -> None:
+    """Count the time from the start of processing to the first SMS of a reply"""
+    if not redis_conn:
+        return
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.hincrby(PROCESSING_COUNTERS_KEY, 'first_sms_count', 1)
+        pipe.hincrbyfloat(PROCESSING_COUNTERS_KEY, 'first_sms_time', seconds)
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error recording time to first SMS: {str(e)}")
+
 def update_processing_stats(redis_conn, processing_time: float, success: bool):
-    """Update message processing statistics"""
+    """Update message processing statistics atomically in one round trip"""
     if not redis_conn:
         logger.warning("Redis connection not available - skipping stats update")
         return
 
     try:
-        stats_key = "processing:stats"
-        stats = get_processing_stats(redis_conn)
-        
-        # Update average processing time
-        total_time = stats['avg_processing_time'] * stats['total_processed']
-        stats['total_processed'] += 1
-        stats['avg_processing_time'] = (total_time + processing_time) / stats['total_processed']
-        
-        # Update success rate
-        success_count = (stats['success_rate'] / 100) * (stats['total_processed'] - 1)
+        volume_key = f"{PROCESSING_VOLUME_PREFIX}{datetime.utcnow().strftime('%Y-%m-%d-%H')}"
+
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.hincrby(PROCESSING_COUNTERS_KEY, 'total_processed', 1)
         if success:
-            success_count += 1
-        stats['success_rate'] = (success_count / stats['total_processed']) * 100
-        
-        # Update hourly volume with improved error handling
-        current_hour = datetime.utcnow().strftime('%Y-%m-%d-%H')
-        volume_key = f"processing:volume:{current_hour}"
-        
-        try:
-            redis_conn.incr(volume_key)
-            redis_conn.expire(volume_key, 86400)  # Expire after 24 hours
-        except RedisError as e:
-            logger.error(f"Error updating volume stats: {str(e)}")
-        
-        # Get last 24 hours volume with improved error handling
-        hourly_volume = []
-        for i in range(24):
-            try:
-                hour_key = (datetime.utcnow() - timedelta(hours=i)).strftime('%Y-%m-%d-%H')
-                count = redis_conn.get(f"processing:volume:{hour_key}")
-                hourly_volume.append({
-                    'hour': hour_key,
-                    'count': int(count) if count else 0
-                })
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error parsing volume count: {str(e)}")
-                hourly_volume.append({'hour': hour_key, 'count': 0})
-            except RedisError as e:
-                logger.error(f"Redis error fetching volume: {str(e)}")
-                hourly_volume.append({'hour': hour_key, 'count': 0})
-        
-        stats['hourly_volume'] = hourly_volume
-        
-        # Save updated stats
-        try:
-            redis_conn.set(stats_key, json.dumps(stats))
-        except RedisError as e:
-            logger.error(f"Redis error saving processing stats: {str(e)}")
+            pipe.hincrby(PROCESSING_COUNTERS_KEY, 'success_count', 1)
+        pipe.hincrbyfloat(PROCESSING_COUNTERS_KEY, 'total_time', processing_time)
+        pipe.incr(volume_key)
+        pipe.expire(volume_key, 86400)  # Expire after 24 hours
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error updating processing stats: {str(e)}")
     except Exception as e:
         logger.error(f"Error updating processing stats: {str(e)}")
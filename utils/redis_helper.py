@@ -1,15 +1,212 @@
 import os
-from redis import Redis, ConnectionError, TimeoutError
-from typing import Optional
+import time
+import threading
+import contextvars
+from queue import Empty
+from redis import Redis, BlockingConnectionPool, ConnectionError, TimeoutError
+from redis.client import Pipeline
+from typing import Callable, Dict, Optional
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class CircuitBreaker:
+    """Cached Redis health, driven by the outcome of real commands.
+
+    The circuit opens after a run of consecutive connection failures. While
+    it is open a background thread probes Redis and closes the circuit on the
+    first success; while it is closed no extra commands are ever sent.
+    """
+
+    def __init__(self, failure_threshold: int = 3, probe_interval: float = 2.0,
+                 probe: Optional[Callable[[], None]] = None):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open = False
+        self._probe_thread = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def record_success(self) -> None:
+        if self._failures or self._open:
+            with self._lock:
+                if self._open:
+                    logger.info("Redis reachable again - closing circuit")
+                self._failures = 0
+                self._open = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if not self._open and self._failures >= self.failure_threshold:
+                logger.error(f"Redis failed {self._failures} times in a row - opening circuit")
+                self._open = True
+        self.ensure_probe()
+
+    def ensure_probe(self) -> None:
+        """Start the background probe if the circuit is open and none is running"""
+        with self._lock:
+            # Threads do not survive fork(), so a copied thread reports not alive
+            if not self._open or not self.probe or (self._probe_thread and self._probe_thread.is_alive()):
+                return
+            self._probe_thread = threading.Thread(
+                target=self._probe_loop, name="redis-circuit-probe", daemon=True
+            )
+            self._probe_thread.start()
+
+    def _probe_loop(self) -> None:
+        while self._open:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe()
+            except (ConnectionError, TimeoutError) as e:
+                logger.warning(f"Redis probe failed: {str(e)}")
+
+# What the client that is taking a connection from the pool is used for
+_current_purpose = contextvars.ContextVar('redis_purpose', default='default')
+
+class PoolExhaustedError(ConnectionError):
+    """No pooled connection became free in time; Redis itself may be fine"""
+
+class _InstrumentedPool(BlockingConnectionPool):
+    """Blocking pool that records how busy it is and how long callers wait.
+
+    Clients share one pool per process; max_connections bounds the sockets
+    the process opens and callers queue for a free one for up to timeout
+    seconds. Utilisation and wait times are kept per purpose so the pool
+    can be sized for the webhook's concurrency.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+        super().__init__(*args, **kwargs)
+
+    def _reset_stats(self) -> None:
+        self._checked_out = set()
+        self._peak_in_use = 0
+        self._exhausted = 0
+        self._purposes: Dict[str, Dict[str, float]] = {}
+
+    def get_connection(self, command_name=None, *keys, **options):
+        start = time.perf_counter()
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except ConnectionError as e:
+            if isinstance(e.__context__, Empty):
+                with self._stats_lock:
+                    self._exhausted += 1
+                raise PoolExhaustedError(
+                    f"No Redis connection free after {self.timeout}s ({self.max_connections} in use)"
+                ) from e
+            raise
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self._checked_out.add(id(connection))
+            self._peak_in_use = max(self._peak_in_use, len(self._checked_out))
+            usage = self._purposes.setdefault(_current_purpose.get(),
+                                              {'checkouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0})
+            usage['checkouts'] += 1
+            usage['wait_seconds'] += waited
+            usage['max_wait_seconds'] = max(usage['max_wait_seconds'], waited)
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        with self._stats_lock:
+            self._checked_out.discard(id(connection))
+
+    def reset_after_fork(self) -> None:
+        """Drop the parent's connections and counters; the child opens its own"""
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+        self.reset()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                'max_connections': self.max_connections,
+                'created': len(self._connections),
+                'in_use': len(self._checked_out),
+                'peak_in_use': self._peak_in_use,
+                'exhausted': self._exhausted,
+                'purposes': {purpose: dict(usage) for purpose, usage in self._purposes.items()},
+            }
+
+class _TrackedPipeline(Pipeline):
+    """Pipeline that reports the outcome of every execute() to the circuit breaker"""
+
+    def __init__(self, circuit_breaker: CircuitBreaker, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.circuit_breaker = circuit_breaker
+
+    purpose = 'default'
+
+    def execute(self, raise_on_error=True):
+        token = _current_purpose.set(self.purpose)
+        try:
+            result = super().execute(raise_on_error)
+        except PoolExhaustedError:
+            raise
+        except (ConnectionError, TimeoutError):
+            self.circuit_breaker.record_failure()
+            raise
+        finally:
+            _current_purpose.reset(token)
+        self.circuit_breaker.record_success()
+        return result
+
+class _TrackedRedis(Redis):
+    """Redis client that reports the outcome of every command to the circuit breaker"""
+
+    circuit_breaker: Optional[CircuitBreaker] = None
+    purpose = 'default'
+
+    def execute_command(self, *args, **options):
+        token = _current_purpose.set(self.purpose)
+        try:
+            result = super().execute_command(*args, **options)
+        except PoolExhaustedError:
+            # A busy pool says nothing about Redis health
+            raise
+        except (ConnectionError, TimeoutError):
+            if self.circuit_breaker:
+                self.circuit_breaker.record_failure()
+            raise
+        finally:
+            _current_purpose.reset(token)
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
+        return result
+
+    def pipeline(self, transaction=True, shard_hint=None) -> Pipeline:
+        if not self.circuit_breaker:
+            return super().pipeline(transaction, shard_hint)
+        pipe = _TrackedPipeline(
+            self.circuit_breaker, self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+        pipe.purpose = self.purpose
+        return pipe
+
 class RedisHelper:
+    """Process-wide Redis access: one connection pool shared by per-purpose clients.
+
+    Clients for the queues, stats and cache (and the default one) all draw
+    from the same pool, which is replaced in a forked child so RQ work horses
+    never share sockets with their parent.
+    """
     _instance = None
+    _pool = None
     _redis_conn = None
+    _clients: Dict[str, Redis] = {}
+    _circuit_breaker = None
 
     def __new__(cls):
         if cls._instance is None:
@@ -17,56 +214,109 @@ class RedisHelper:
         return cls._instance
 
     def __init__(self):
+        if self._circuit_breaker is None:
+            RedisHelper._circuit_breaker = CircuitBreaker(
+                failure_threshold=int(os.environ.get('REDIS_CIRCUIT_FAILURE_THRESHOLD', 3)),
+                probe_interval=float(os.environ.get('REDIS_CIRCUIT_PROBE_INTERVAL', 2.0)),
+                probe=self._probe
+            )
         if self._redis_conn is None:
             self._initialize_connection()
 
+    @staticmethod
+    def _create_pool() -> _InstrumentedPool:
+        """Pool for REDIS_URL, or a local Redis.
+
+        Responses are never decoded: RQ stores binary job data, and every
+        client shares the pool's connection settings.
+        """
+        options = {
+            'max_connections': int(os.environ.get('REDIS_POOL_SIZE', 50)),
+            'timeout': float(os.environ.get('REDIS_POOL_TIMEOUT', 5)),
+            'decode_responses': False,
+        }
+        redis_url = os.environ.get('REDIS_URL')
+        if redis_url:
+            return _InstrumentedPool.from_url(redis_url, **options)
+        return _InstrumentedPool(host='localhost', port=6379, socket_timeout=5, retry_on_timeout=True, **options)
+
+    def _create_client(self, purpose: str) -> Redis:
+        client = _TrackedRedis(connection_pool=self._pool)
+        client.circuit_breaker = self._circuit_breaker
+        client.purpose = purpose
+        return client
+
     def _initialize_connection(self) -> None:
         """Initialize Redis connection with retries and proper error handling"""
-        redis_url = os.environ.get('REDIS_URL')
         max_retries = 3
         retry_count = 0
 
         while retry_count < max_retries:
             try:
-                # Use Redis URL if available, otherwise use default local connection
-                if redis_url:
-                    self._redis_conn = Redis.from_url(redis_url)
-                else:
-                    self._redis_conn = Redis(
-                        host='localhost',
-                        port=6379,
-                        decode_responses=True,
-                        socket_timeout=5,
-                        retry_on_timeout=True
-                    )
+                if RedisHelper._pool is None:
+                    RedisHelper._pool = self._create_pool()
+                RedisHelper._redis_conn = self._create_client('default')
                 # Test connection
                 self._redis_conn.ping()
-                logger.info("Successfully connected to Redis")
+                logger.info(f"Successfully connected to Redis (pool of {self._pool.max_connections})")
                 break
             except (ConnectionError, TimeoutError) as e:
                 retry_count += 1
                 logger.warning(f"Redis connection attempt {retry_count} failed: {str(e)}")
                 if retry_count == max_retries:
                     logger.error("Failed to connect to Redis after maximum retries")
-                    self._redis_conn = None
+                    RedisHelper._redis_conn = None
                     raise
 
-    def get_connection(self) -> Optional[Redis]:
-        """Get Redis connection with automatic reconnection"""
+    def get_connection(self, purpose: Optional[str] = None) -> Optional[Redis]:
+        """Get Redis connection with automatic reconnection.
+
+        Pass a purpose ("queue", "stats", "cache") to get a client whose pool
+        usage is reported under that name; it shares the one pool.
+        """
         if self._redis_conn is None:
             try:
                 self._initialize_connection()
             except (ConnectionError, TimeoutError) as e:
                 logger.error(f"Failed to establish Redis connection: {str(e)}")
                 return None
-        return self._redis_conn
+        # A connection set from outside (no pool of ours) serves every purpose
+        if purpose is None or self._pool is None:
+            return self._redis_conn
+        if purpose not in self._clients:
+            self._clients[purpose] = self._create_client(purpose)
+        return self._clients[purpose]
+
+    def pool_stats(self) -> Optional[Dict]:
+        """Connections open and in use in this process, and time spent waiting for one"""
+        return self._pool.stats() if self._pool is not None else None
+
+    def _probe(self) -> None:
+        redis_conn = self.get_connection()
+        if redis_conn is not None:
+            redis_conn.ping()
 
     def health_check(self) -> bool:
-        """Check if Redis connection is healthy"""
-        try:
-            if self._redis_conn:
-                self._redis_conn.ping()
-                return True
+        """Check if Redis is healthy from cached state, without a round trip"""
+        if self._redis_conn is None:
             return False
-        except (ConnectionError, TimeoutError):
+        if self._circuit_breaker.is_open:
+            self._circuit_breaker.ensure_probe()
             return False
+        return True
+
+def _reset_pool_after_fork() -> None:
+    # redis-py would notice the new pid on next use; resetting here also
+    # clears the parent's counters and happens before any job code runs
+    if RedisHelper._pool is not None:
+        RedisHelper._pool.reset_after_fork()
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+def get_redis_connection(purpose: Optional[str] = None) -> Optional[Redis]:
+    """Shared connection for code running outside a request, or None if Redis is down"""
+    try:
+        return RedisHelper().get_connection(purpose)
+    except (ConnectionError, TimeoutError) as e:
+        logger.error(f"Redis unavailable: {str(e)}")
+        return None
@@ -0,0 +1,358 @@
+import re
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+from redis import RedisError
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_ENTRY_PREFIX = "response_cache:entry:"  # hash: message, model, response, hits, created
+CACHE_LRU_KEY = "response_cache:lru"  # zset: digest -> last access time
+CACHE_EXPIRY_KEY = "response_cache:expiry"  # zset: digest -> time the entry key expires
+CACHE_SIZES_KEY = "response_cache:sizes"  # digest -> bytes held by the entry
+CACHE_STATS_KEY = "response_cache:stats"  # hits, local_hits, misses, stores, evictions, bytes
+CACHE_VERSION_KEY = "response_cache:version"  # bumped on clear so local copies are dropped
+
+LOCAL_SYNC_INTERVAL = 1.0  # seconds between version checks from the in-process tier
+LOCAL_TTL = 300  # seconds a reply is served from the in-process tier without asking Redis
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+# Return the cached response and count the hit, or count a miss.
+# The entry is checked and touched atomically so a hit on an entry that is
+# expiring cannot recreate it without a TTL.
+LOOKUP_SCRIPT = """
+local response = redis.call('HGET', KEYS[1], 'response')
+if not response then
+    redis.call('HINCRBY', KEYS[3], 'misses', 1)
+    return false
+end
+redis.call('HINCRBY', KEYS[1], 'hits', 1)
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+redis.call('HINCRBY', KEYS[3], 'hits', 1)
+return response
+"""
+
+# Store an entry, then evict least recently used entries until the cache
+# fits in ARGV[5] bytes. Entry keys expire TTL seconds after they are
+# stored, however recently they were read, so the accounting of entries
+# past their expiry time is dropped first; an entry gone for any other
+# reason is dropped, not counted as an eviction, when eviction reaches it.
+STORE_SCRIPT = """
+local prefix, digest = ARGV[1], ARGV[2]
+local now, ttl, max_bytes, size = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+
+local function forget(member)
+    local held = tonumber(redis.call('HGET', KEYS[2], member) or '0')
+    redis.call('HDEL', KEYS[2], member)
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZREM', KEYS[4], member)
+    redis.call('HINCRBY', KEYS[3], 'bytes', -held)
+end
+
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', now)) do
+    forget(member)
+end
+if redis.call('HEXISTS', KEYS[2], digest) == 1 then
+    forget(digest)
+end
+
+local entry = prefix .. digest
+redis.call('HSET', entry, 'message', ARGV[7], 'model', ARGV[8], 'response', ARGV[9],
+           'hits', 0, 'created', now)
+redis.call('EXPIRE', entry, ttl)
+redis.call('ZADD', KEYS[1], now, digest)
+redis.call('ZADD', KEYS[4], now + ttl, digest)
+redis.call('HSET', KEYS[2], digest, size)
+redis.call('HINCRBY', KEYS[3], 'stores', 1)
+local total = redis.call('HINCRBY', KEYS[3], 'bytes', size)
+
+local evicted = 0
+while total > max_bytes do
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+    if not oldest or oldest == digest then
+        break
+    end
+    if redis.call('EXISTS', prefix .. oldest) == 1 then
+        redis.call('DEL', prefix .. oldest)
+        evicted = evicted + 1
+    end
+    forget(oldest)
+    total = tonumber(redis.call('HGET', KEYS[3], 'bytes'))
+end
+if evicted > 0 then
+    redis.call('HINCRBY', KEYS[3], 'evictions', evicted)
+end
+return evicted
+"""
+
+# Apply hits served from an in-process tier and return the cache version.
+# ARGV is the entry prefix and the time, then digest/count pairs.
+SYNC_LOCAL_HITS_SCRIPT = """
+local total = 0
+for i = 3, #ARGV, 2 do
+    local entry = ARGV[1] .. ARGV[i]
+    if redis.call('EXISTS', entry) == 1 then
+        redis.call('HINCRBY', entry, 'hits', ARGV[i + 1])
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[i])
+    end
+    total = total + tonumber(ARGV[i + 1])
+end
+if total > 0 then
+    redis.call('HINCRBY', KEYS[2], 'local_hits', total)
+end
+return redis.call('GET', KEYS[3]) or '0'
+"""
+
+# Drop one entry and start a new version so workers forget their local copy
+REMOVE_SCRIPT = """
+local held = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or '0')
+redis.call('DEL', ARGV[1] .. ARGV[2])
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('ZREM', KEYS[4], ARGV[2])
+redis.call('HDEL', KEYS[2], ARGV[2])
+redis.call('HINCRBY', KEYS[3], 'bytes', -held)
+return redis.call('INCR', KEYS[5])
+"""
+
+# Drop every entry and start a new version
+CLEAR_SCRIPT = """
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    redis.call('DEL', ARGV[1] .. member)
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[4])
+redis.call('HSET', KEYS[3], 'bytes', 0)
+return redis.call('INCR', KEYS[5])
+"""
+
+_scripts = {}
+
+# In-process tier: digest -> (response, expiry), least recently used first.
+# Off unless enabled by a process that serves many jobs, like the async
+# worker; a forked RQ work horse would start every job with it empty.
+_local_enabled = False
+_local_lock = threading.Lock()
+_local_entries = OrderedDict()
+_local_hits = {}
+_local_version = None
+_last_sync = 0.0
+
+def _as_text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def _script(redis_conn, source: str):
+    if source not in _scripts:
+        _scripts[source] = redis_conn.register_script(source)
+    return _scripts[source]
+
+def normalize_message(message: str) -> str:
+    """Fold case, punctuation and whitespace so near-identical questions share an entry"""
+    message = _PUNCTUATION.sub(' ', message.lower())
+    return _WHITESPACE.sub(' ', message).strip()
+
+def cache_digest(message: str, model: str, context: Optional[List[Dict]] = None) -> str:
+    """Key of a reply to message after the context (earlier chat messages) it was generated with"""
+    normalized = normalize_message(message)
+    turns = ''.join(f"{entry['role']}\0{normalize_message(entry['content'])}\0" for entry in context or [])
+    return hashlib.sha256(f"{model}\0{turns}{normalized}".encode('utf-8')).hexdigest()
+
+def enable_local_tier() -> None:
+    """Keep recently used replies in this process too, in front of Redis"""
+    global _local_enabled
+    _local_enabled = Config.RESPONSE_CACHE_LOCAL_SIZE > 0
+
+def _local_get(digest: str) -> Optional[str]:
+    if not _local_enabled:
+        return None
+    with _local_lock:
+        cached = _local_entries.get(digest)
+        if cached is None:
+            return None
+        response, expires = cached
+        if expires < time.monotonic():
+            del _local_entries[digest]
+            return None
+        _local_entries.move_to_end(digest)
+        _local_hits[digest] = _local_hits.get(digest, 0) + 1
+        return response
+
+def _local_put(digest: str, response: str) -> None:
+    if not _local_enabled:
+        return
+    with _local_lock:
+        _local_entries[digest] = (response, time.monotonic() + min(LOCAL_TTL, Config.RESPONSE_CACHE_TTL))
+        _local_entries.move_to_end(digest)
+        while len(_local_entries) > Config.RESPONSE_CACHE_LOCAL_SIZE:
+            _local_entries.popitem(last=False)
+
+def _sync_local(redis_conn) -> None:
+    """Report local hits and drop the local tier if the cache was cleared elsewhere"""
+    global _local_version, _last_sync
+    if not _local_enabled:
+        return
+    now = time.monotonic()
+    if now - _last_sync < LOCAL_SYNC_INTERVAL:
+        return
+    _last_sync = now
+
+    with _local_lock:
+        hits = dict(_local_hits)
+        _local_hits.clear()
+    args = [CACHE_ENTRY_PREFIX, time.time()]
+    for digest, count in hits.items():
+        args.extend([digest, count])
+
+    try:
+        version = _as_text(_script(redis_conn, SYNC_LOCAL_HITS_SCRIPT)(
+            keys=[CACHE_LRU_KEY, CACHE_STATS_KEY, CACHE_VERSION_KEY],
+            args=args, client=redis_conn
+        ))
+    except RedisError as e:
+        logger.error(f"Redis error syncing local response cache: {str(e)}")
+        # Without a version we cannot tell whether local entries are stale
+        version = None
+
+    with _local_lock:
+        if version is None or version != _local_version:
+            _local_entries.clear()
+            _local_version = version
+
+def get_cached_response(redis_conn, message: str, model: str,
+                        context: Optional[List[Dict]] = None) -> Optional[str]:
+    """Return a cached reply for the message after context, checking this process before Redis"""
+    if not Config.RESPONSE_CACHE_ENABLED or not redis_conn:
+        return None
+
+    _sync_local(redis_conn)
+    digest = cache_digest(message, model, context)
+    response = _local_get(digest)
+    if response is not None:
+        return response
+
+    try:
+        response = _script(redis_conn, LOOKUP_SCRIPT)(
+            keys=[CACHE_ENTRY_PREFIX + digest, CACHE_LRU_KEY, CACHE_STATS_KEY],
+            args=[digest, time.time()],
+            client=redis_conn
+        )
+    except RedisError as e:
+        logger.error(f"Redis error reading response cache: {str(e)}")
+        return None
+
+    if response is None:
+        return None
+    response = _as_text(response)
+    _local_put(digest, response)
+    return response
+
+def cache_response(redis_conn, message: str, model: str, response: str,
+                   context: Optional[List[Dict]] = None) -> None:
+    """Store a generated reply, evicting the least recently used entries past the memory cap"""
+    if not Config.RESPONSE_CACHE_ENABLED or not redis_conn or not response:
+        return
+
+    digest = cache_digest(message, model, context)
+    normalized = normalize_message(message)
+    size = len(normalized.encode('utf-8')) + len(response.encode('utf-8')) + len(model)
+    try:
+        evicted = _script(redis_conn, STORE_SCRIPT)(
+            keys=[CACHE_LRU_KEY, CACHE_SIZES_KEY, CACHE_STATS_KEY, CACHE_EXPIRY_KEY],
+            args=[CACHE_ENTRY_PREFIX, digest, time.time(), Config.RESPONSE_CACHE_TTL,
+                  Config.RESPONSE_CACHE_MAX_BYTES, size, normalized, model, response],
+            client=redis_conn
+        )
+        if evicted:
+            logger.info(f"Response cache evicted {evicted} entries")
+    except RedisError as e:
+        logger.error(f"Redis error writing response cache: {str(e)}")
+        return
+    _local_put(digest, response)
+
+def get_response_cache_stats(redis_conn) -> Dict:
+    """Hit/miss counters, hit rate and memory use"""
+    stats = {'hits': 0, 'local_hits': 0, 'misses': 0, 'stores': 0,
+             'evictions': 0, 'bytes': 0, 'entries': 0, 'hit_rate': 0}
+    if not redis_conn:
+        return stats
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.hgetall(CACHE_STATS_KEY)
+        pipe.zcard(CACHE_LRU_KEY)
+        raw_stats, entries = pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error reading response cache stats: {str(e)}")
+        return stats
+
+    for field, value in raw_stats.items():
+        stats[_as_text(field)] = int(value)
+    stats['entries'] = entries
+    hits = stats['hits'] + stats['local_hits']
+    lookups = hits + stats['misses']
+    stats['hit_rate'] = round(hits / lookups * 100, 1) if lookups else 0
+    return stats
+
+def get_cached_entries(redis_conn, limit: int = 100) -> List[Dict]:
+    """The most recently used entries, most hit first"""
+    if not redis_conn:
+        return []
+    try:
+        digests = [_as_text(d) for d in redis_conn.zrevrange(CACHE_LRU_KEY, 0, limit - 1)]
+        pipe = redis_conn.pipeline(transaction=False)
+        for digest in digests:
+            pipe.hgetall(CACHE_ENTRY_PREFIX + digest)
+        raw_entries = pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error reading response cache entries: {str(e)}")
+        return []
+
+    entries = []
+    for digest, raw in zip(digests, raw_entries):
+        if not raw:
+            continue  # expired
+        entry = {_as_text(field): _as_text(value) for field, value in raw.items()}
+        entry['digest'] = digest
+        entry['hits'] = int(entry.get('hits', 0))
+        entry['created'] = datetime.utcfromtimestamp(float(entry.get('created', 0)))
+        entries.append(entry)
+    entries.sort(key=lambda entry: entry['hits'], reverse=True)
+    return entries
+
+def clear_response_cache(redis_conn) -> None:
+    """Drop every cached reply, including the in-process copies in all workers"""
+    if not redis_conn:
+        logger.warning("Redis connection not available - skipping response cache clear")
+        return
+    try:
+        _script(redis_conn, CLEAR_SCRIPT)(
+            keys=[CACHE_LRU_KEY, CACHE_SIZES_KEY, CACHE_STATS_KEY, CACHE_EXPIRY_KEY, CACHE_VERSION_KEY],
+            args=[CACHE_ENTRY_PREFIX],
+            client=redis_conn
+        )
+        logger.info("Response cache cleared")
+    except RedisError as e:
+        logger.error(f"Redis error clearing response cache: {str(e)}")
+    with _local_lock:
+        _local_entries.clear()
+
+def remove_cached_response(redis_conn, digest: str) -> None:
+    """Drop a single entry; other workers stop serving it after their next sync"""
+    if not redis_conn:
+        return
+    try:
+        _script(redis_conn, REMOVE_SCRIPT)(
+            keys=[CACHE_LRU_KEY, CACHE_SIZES_KEY, CACHE_STATS_KEY, CACHE_EXPIRY_KEY, CACHE_VERSION_KEY],
+            args=[CACHE_ENTRY_PREFIX, digest],
+            client=redis_conn
+        )
+    except RedisError as e:
+        logger.error(f"Redis error removing cached response: {str(e)}")
+    with _local_lock:
+        _local_entries.pop(digest, None)
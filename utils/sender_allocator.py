@@ -0,0 +1,288 @@
+import time
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+from redis import RedisError
+from sqlalchemy import case, func, update
+from models import TwilioNumber, db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Active numbers by load: score = daily count - priority * PRIORITY_WEIGHT, so the
+# lowest score is the highest priority number with the fewest messages today
+SENDER_POOL_KEY = "twilio:senders"
+SENDER_PHONES_KEY = "twilio:senders:phones"
+SENDER_IDS_KEY = "twilio:senders:ids"  # phone number -> id, for every number
+SENDER_PRIORITIES_KEY = "twilio:senders:priorities"  # phone number -> priority, for every number
+SENDER_USAGE_KEY = "twilio:senders:usage"  # messages not yet written back
+SENDER_LAST_USED_KEY = "twilio:senders:last_used"
+SENDER_POOL_BUILT_KEY = "twilio:senders:built"
+SENDER_RATES_KEY = "twilio:senders:rates"  # number id -> messages per second, for active numbers
+SENDER_BUCKET_PREFIX = "twilio:senders:bucket:"  # per number token bucket: tokens, updated
+
+PRIORITY_WEIGHT = 1_000_000_000
+
+# Pick the least loaded number that may send right now and count the send, in
+# a single round trip. Each number has a token bucket refilled at its send
+# rate; numbers are tried in pool order and the first with a whole token wins.
+# A preferred number (ARGV[5]) that is still active is the only candidate, so
+# the segments of one reply come from the same number.
+# Returns -1 if the pool was never built, nil if there is no active number,
+# {1, phone} on success and {0, ms} with the shortest wait when every number
+# is out of tokens. Redis time is used so all workers share one clock.
+ALLOCATE_SENDER_SCRIPT = """
+if redis.call('EXISTS', KEYS[5]) == 0 then
+    return -1
+end
+local candidates
+local preferred = ARGV[5] ~= '' and redis.call('HGET', KEYS[7], ARGV[5])
+if preferred and redis.call('ZSCORE', KEYS[1], preferred) then
+    candidates = {preferred}
+else
+    candidates = redis.call('ZRANGE', KEYS[1], 0, -1)
+end
+if #candidates == 0 then
+    return false
+end
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local default_rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local shortest_wait = nil
+
+for _, number_id in ipairs(candidates) do
+    local rate = tonumber(redis.call('HGET', KEYS[6], number_id)) or default_rate
+    local picked = rate <= 0
+    if not picked then
+        local bucket_key = ARGV[4] .. number_id
+        local capacity = math.max(rate * burst, 1)
+        local bucket = redis.call('HMGET', bucket_key, 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+        if tokens >= 1 then
+            picked = true
+            redis.call('HSET', bucket_key, 'tokens', tostring(tokens - 1), 'updated', tostring(now))
+            -- An untouched bucket is full again after capacity / rate seconds
+            redis.call('PEXPIRE', bucket_key, math.ceil(capacity / rate * 1000) + 1000)
+        else
+            local wait = (1 - tokens) / rate
+            if not shortest_wait or wait < shortest_wait then
+                shortest_wait = wait
+            end
+        end
+    end
+    if picked then
+        redis.call('ZINCRBY', KEYS[1], 1, number_id)
+        redis.call('HINCRBY', KEYS[3], number_id, 1)
+        redis.call('HSET', KEYS[4], number_id, ARGV[1])
+        return {1, redis.call('HGET', KEYS[2], number_id)}
+    end
+end
+return {0, math.ceil(shortest_wait * 1000)}
+"""
+
+class SenderRateLimited(Exception):
+    """Every active number is at its send rate; retry after ``retry_after`` seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"All sender numbers are rate limited, retry in {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+_allocate_script = None
+_last_flush = 0.0
+
+def _sender_score(priority: Optional[int], daily_count: int) -> int:
+    return daily_count - (priority or 0) * PRIORITY_WEIGHT
+
+def _as_text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def rebuild_sender_pool(redis_conn) -> None:
+    """Load active numbers from the database into the Redis allocator"""
+    if not redis_conn:
+        logger.warning("Redis connection not available - skipping sender pool rebuild")
+        return
+
+    try:
+        pending = get_pending_sender_usage(redis_conn)
+        all_numbers = TwilioNumber.query.all()
+        numbers = [number for number in all_numbers if number.is_active]
+
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.delete(SENDER_POOL_KEY, SENDER_PHONES_KEY, SENDER_IDS_KEY, SENDER_PRIORITIES_KEY, SENDER_RATES_KEY)
+        if all_numbers:
+            pipe.hset(SENDER_IDS_KEY, mapping={number.phone_number: number.id for number in all_numbers})
+            pipe.hset(SENDER_PRIORITIES_KEY,
+                      mapping={number.phone_number: number.priority or 0 for number in all_numbers})
+        if numbers:
+            pipe.zadd(SENDER_POOL_KEY, {
+                number.id: _sender_score(
+                    number.priority,
+                    (number.daily_message_count or 0) + pending.get(number.id, {}).get('count', 0)
+                )
+                for number in numbers
+            })
+            pipe.hset(SENDER_PHONES_KEY, mapping={number.id: number.phone_number for number in numbers})
+            rates = {number.id: number.send_rate for number in numbers if number.send_rate is not None}
+            if rates:
+                pipe.hset(SENDER_RATES_KEY, mapping=rates)
+        pipe.set(SENDER_POOL_BUILT_KEY, 1)
+        pipe.execute()
+        logger.info(f"Sender pool rebuilt with {len(numbers)} active numbers")
+    except RedisError as e:
+        logger.error(f"Redis error rebuilding sender pool: {str(e)}")
+
+def allocate_sender(redis_conn, default_rate: float = 1.0, burst: float = 1.0,
+                    preferred: Optional[str] = None) -> Optional[str]:
+    """Atomically pick the best sender number that is under its send rate and
+    count the message against it. A preferred number is kept as long as it is
+    active, waiting for its rate rather than switching numbers.
+
+    Returns None when there is no active number and raises SenderRateLimited
+    when every active number is out of tokens. Raises RedisError if Redis
+    cannot be reached, so callers can fall back to the database.
+    """
+    global _allocate_script
+    if _allocate_script is None:
+        _allocate_script = redis_conn.register_script(ALLOCATE_SENDER_SCRIPT)
+
+    keys = [SENDER_POOL_KEY, SENDER_PHONES_KEY, SENDER_USAGE_KEY,
+            SENDER_LAST_USED_KEY, SENDER_POOL_BUILT_KEY, SENDER_RATES_KEY, SENDER_IDS_KEY]
+    args = [time.time(), default_rate, burst, SENDER_BUCKET_PREFIX, preferred or '']
+
+    result = _allocate_script(keys=keys, args=args, client=redis_conn)
+    if result == -1:
+        # First use, or Redis was flushed: build from the table and retry once
+        rebuild_sender_pool(redis_conn)
+        result = _allocate_script(keys=keys, args=args, client=redis_conn)
+        if result == -1:
+            return None
+    if not result:
+        return None
+    allocated, value = result
+    if not allocated:
+        raise SenderRateLimited(int(value) / 1000)
+    return _as_text(value)
+
+def lookup_number_id(redis_conn, phone_number: str) -> Optional[int]:
+    """Map one of our phone numbers to its TwilioNumber id without a database query.
+
+    Raises RedisError if Redis cannot be reached.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.exists(SENDER_POOL_BUILT_KEY)
+    pipe.hget(SENDER_IDS_KEY, phone_number)
+    built, number_id = pipe.execute()
+    if not built:
+        rebuild_sender_pool(redis_conn)
+        number_id = redis_conn.hget(SENDER_IDS_KEY, phone_number)
+    return int(number_id) if number_id else None
+
+def lookup_number_priority(redis_conn, phone_number: str) -> Optional[int]:
+    """Priority of one of our phone numbers without a database query.
+
+    Raises RedisError if Redis cannot be reached.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.exists(SENDER_POOL_BUILT_KEY)
+    pipe.hget(SENDER_PRIORITIES_KEY, phone_number)
+    built, priority = pipe.execute()
+    if not built:
+        rebuild_sender_pool(redis_conn)
+        priority = redis_conn.hget(SENDER_PRIORITIES_KEY, phone_number)
+    return int(priority) if priority is not None else None
+
+def get_pending_sender_usage(redis_conn) -> Dict[int, Dict]:
+    """Return per-number sends counted in Redis that are not yet in the database"""
+    if not redis_conn:
+        return {}
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.hgetall(SENDER_USAGE_KEY)
+        pipe.hgetall(SENDER_LAST_USED_KEY)
+        raw_counts, raw_last_used = pipe.execute()
+        return _merge_usage(raw_counts, raw_last_used)
+    except (RedisError, ValueError) as e:
+        logger.error(f"Error reading pending sender usage: {str(e)}")
+        return {}
+
+def _merge_usage(raw_counts, raw_last_used) -> Dict[int, Dict]:
+    usage = {int(number_id): {'count': int(count), 'last_used': None}
+             for number_id, count in raw_counts.items()}
+    for number_id, timestamp in raw_last_used.items():
+        entry = usage.setdefault(int(number_id), {'count': 0, 'last_used': None})
+        entry['last_used'] = datetime.utcfromtimestamp(float(timestamp))
+    return usage
+
+def flush_sender_usage(redis_conn) -> int:
+    """Write buffered send counts and last-used times back to TwilioNumber in one UPDATE"""
+    if not redis_conn:
+        logger.warning("Redis connection not available - skipping sender usage flush")
+        return 0
+
+    try:
+        # Read and reset atomically so sends counted meanwhile are kept for the next flush
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.hgetall(SENDER_USAGE_KEY)
+        pipe.hgetall(SENDER_LAST_USED_KEY)
+        pipe.delete(SENDER_USAGE_KEY, SENDER_LAST_USED_KEY)
+        raw_counts, raw_last_used, _ = pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error claiming sender usage: {str(e)}")
+        return 0
+
+    usage = _merge_usage(raw_counts, raw_last_used)
+    if not usage:
+        return 0
+
+    counts = {number_id: entry['count'] for number_id, entry in usage.items()}
+    last_used = {number_id: entry['last_used'] for number_id, entry in usage.items() if entry['last_used']}
+    try:
+        values = {
+            'daily_message_count': func.coalesce(TwilioNumber.daily_message_count, 0)
+            + case(counts, value=TwilioNumber.id, else_=0)
+        }
+        if last_used:
+            values['last_used'] = case(last_used, value=TwilioNumber.id, else_=TwilioNumber.last_used)
+        db.session.execute(
+            update(TwilioNumber).where(TwilioNumber.id.in_(usage)).values(**values)
+        )
+        db.session.commit()
+        logger.info(f"Flushed sender usage for {len(usage)} numbers")
+        return len(usage)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error flushing sender usage, restoring counters: {str(e)}")
+        try:
+            pipe = redis_conn.pipeline()
+            for number_id, count in counts.items():
+                pipe.hincrby(SENDER_USAGE_KEY, number_id, count)
+            if raw_last_used:
+                pipe.hset(SENDER_LAST_USED_KEY, mapping=raw_last_used)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(f"Redis error restoring sender usage: {str(e)}")
+        return 0
+
+def maybe_flush_sender_usage(redis_conn, interval: float) -> None:
+    """Flush buffered sender usage at most once per interval in this process"""
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush < interval:
+        return
+    _last_flush = now
+    flush_sender_usage(redis_conn)
+
+def reset_sender_usage(redis_conn) -> None:
+    """Drop buffered counts after the daily counts were reset in the database"""
+    if not redis_conn:
+        return
+    try:
+        redis_conn.delete(SENDER_USAGE_KEY)
+    except RedisError as e:
+        logger.error(f"Redis error resetting sender usage: {str(e)}")
+    rebuild_sender_pool(redis_conn)
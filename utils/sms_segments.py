@@ -0,0 +1,89 @@
+import re
+from typing import List
+
+# A single SMS holds 160 characters of the GSM 03.38 alphabet, or 70 UTF-16
+# code units once any other character forces UCS-2
+GSM7_SEGMENT_LIMIT = 160
+UCS2_SEGMENT_LIMIT = 70
+
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Sent as an escape plus the character, so each counts twice
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+# The end of a sentence: closing punctuation, optionally quoted or bracketed,
+# followed by whitespace
+SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*(?=\s)")
+WORD_END = re.compile(r"\S(?=\s)")
+
+def is_gsm7(text: str) -> bool:
+    return all(char in GSM7_BASIC or char in GSM7_EXTENDED for char in text)
+
+def sms_length(text: str) -> int:
+    """Length in the units the segment limit is counted in"""
+    if is_gsm7(text):
+        return sum(2 if char in GSM7_EXTENDED else 1 for char in text)
+    return len(text.encode('utf-16-le')) // 2
+
+def segment_limit(text: str) -> int:
+    return GSM7_SEGMENT_LIMIT if is_gsm7(text) else UCS2_SEGMENT_LIMIT
+
+def fits_one_sms(text: str) -> bool:
+    return sms_length(text) <= segment_limit(text)
+
+def _longest_fitting_prefix(text: str) -> int:
+    """Number of characters of text that fit in one SMS"""
+    gsm7 = True
+    gsm7_length = ucs2_length = 0
+    for index, char in enumerate(text):
+        if gsm7 and char not in GSM7_BASIC and char not in GSM7_EXTENDED:
+            gsm7 = False
+        gsm7_length += 2 if char in GSM7_EXTENDED else 1
+        ucs2_length += 2 if ord(char) > 0xFFFF else 1
+        if (gsm7_length > GSM7_SEGMENT_LIMIT) if gsm7 else (ucs2_length > UCS2_SEGMENT_LIMIT):
+            return index
+    return len(text)
+
+def _cut_point(text: str) -> int:
+    """Where to end the next segment: the last sentence end that fits, else the last word end"""
+    limit = _longest_fitting_prefix(text)
+    for pattern in (SENTENCE_END, WORD_END):
+        ends = [match.end() for match in pattern.finditer(text, 0, limit + 1) if match.end() <= limit]
+        if ends:
+            return ends[-1]
+    return max(limit, 1)
+
+class SegmentBuffer:
+    """Cuts text arriving in pieces into SMS-sized segments.
+
+    A segment is released as soon as the text after it no longer fits in
+    the same SMS, so each one is sent while the rest is still being
+    generated. Segments end at sentence boundaries where possible, then at
+    word boundaries.
+    """
+
+    def __init__(self):
+        self._text = ''
+
+    def feed(self, text: str) -> List[str]:
+        """Add text; returns the segments it completed"""
+        self._text += text
+        segments = []
+        while not fits_one_sms(self._text.strip()):
+            cut = _cut_point(self._text.lstrip())
+            remaining = self._text.lstrip()
+            segments.append(remaining[:cut].strip())
+            self._text = remaining[cut:]
+        return segments
+
+    def flush(self) -> List[str]:
+        """The last segment, once all text has arrived"""
+        text, self._text = self._text.strip(), ''
+        return [text] if text else []
+
+def split_segments(text: str) -> List[str]:
+    """Split a complete text into SMS-sized segments"""
+    segments = SegmentBuffer()
+    return segments.feed(text) + segments.flush()
@@ -0,0 +1,109 @@
+from collections import deque, namedtuple
+from typing import Iterable, Optional, Tuple
+import logging
+from redis import RedisError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEMPLATE_VERSION_KEY = "templates:version"
+
+TemplateMatch = namedtuple('TemplateMatch', ['id', 'name', 'response_template'])
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over the trigger keywords of all active templates.
+
+    Templates are ranked in the order they are given; when a message contains
+    keywords of several templates the highest ranked one wins, which mirrors
+    the first-match behaviour of the old per-template scan.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[TemplateMatch, str]]):
+        self.templates = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+
+        for rank, (template, trigger_keywords) in enumerate(entries):
+            self.templates.append(template)
+            for keyword in trigger_keywords.split(','):
+                keyword = keyword.strip().lower()
+                # An empty keyword would match every message
+                if keyword:
+                    self._add_keyword(keyword, rank)
+        self._build_failure_links()
+
+    def _add_keyword(self, keyword: str, rank: int) -> None:
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = next_node
+        if self._best[node] is None or rank < self._best[node]:
+            self._best[node] = rank
+
+    def _build_failure_links(self) -> None:
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self._goto[node].items():
+                pending.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                link = self._goto[fallback].get(char, 0)
+                self._fail[child] = link if link != child else 0
+                # Fold the outputs of the suffix into this node so a single
+                # lookup per character is enough while scanning
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (self._best[child] is None or inherited < self._best[child]):
+                    self._best[child] = inherited
+
+    def match(self, message: str) -> Optional[TemplateMatch]:
+        """Return the best ranked template with a keyword in the message, in one pass"""
+        goto = self._goto
+        fail = self._fail
+        best_per_node = self._best
+        node = 0
+        best = None
+
+        for char in message.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            rank = best_per_node[node]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+                if best == 0:
+                    break
+
+        return self.templates[best] if best is not None else None
+
+def get_template_version(redis_conn) -> Optional[str]:
+    """Return the current template version, or None if it cannot be read"""
+    if not redis_conn:
+        return None
+    try:
+        version = redis_conn.get(TEMPLATE_VERSION_KEY)
+        if isinstance(version, bytes):
+            version = version.decode('utf-8')
+        return version or '0'
+    except RedisError as e:
+        logger.error(f"Redis error reading template version: {str(e)}")
+        return None
+
+def bump_template_version(redis_conn) -> None:
+    """Signal every worker process that the compiled matcher is stale"""
+    if not redis_conn:
+        logger.warning("Redis connection not available - skipping template version bump")
+        return
+    try:
+        redis_conn.incr(TEMPLATE_VERSION_KEY)
+    except RedisError as e:
+        logger.error(f"Redis error bumping template version: {str(e)}")
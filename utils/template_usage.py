@@ -0,0 +1,86 @@
+import time
+import logging
+from typing import Dict
+from redis import RedisError
+from sqlalchemy import case, func, update
+from models import MessageTemplate, db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEMPLATE_USAGE_KEY = "templates:usage"
+
+_last_flush = 0.0
+
+def record_template_usage(redis_conn, template_id: int) -> None:
+    """Count a template hit in Redis instead of updating its row"""
+    if not redis_conn:
+        logger.warning("Redis connection not available - skipping template usage")
+        return
+    try:
+        redis_conn.hincrby(TEMPLATE_USAGE_KEY, template_id, 1)
+    except RedisError as e:
+        logger.error(f"Redis error recording template usage: {str(e)}")
+
+def get_pending_template_usage(redis_conn) -> Dict[int, int]:
+    """Return the usage counted in Redis that is not yet in the database"""
+    if not redis_conn:
+        return {}
+    try:
+        raw_counts = redis_conn.hgetall(TEMPLATE_USAGE_KEY)
+        return {int(template_id): int(count) for template_id, count in raw_counts.items()}
+    except (RedisError, ValueError) as e:
+        logger.error(f"Error reading pending template usage: {str(e)}")
+        return {}
+
+def flush_template_usage(redis_conn) -> int:
+    """Move buffered usage counts into MessageTemplate.usage_count in one UPDATE"""
+    if not redis_conn:
+        logger.warning("Redis connection not available - skipping usage flush")
+        return 0
+
+    try:
+        # Read and reset atomically so hits counted meanwhile are kept for the next flush
+        pipe = redis_conn.pipeline()
+        pipe.hgetall(TEMPLATE_USAGE_KEY)
+        pipe.delete(TEMPLATE_USAGE_KEY)
+        raw_counts, _ = pipe.execute()
+    except RedisError as e:
+        logger.error(f"Redis error claiming template usage: {str(e)}")
+        return 0
+
+    counts = {int(template_id): int(count) for template_id, count in raw_counts.items()}
+    if not counts:
+        return 0
+
+    try:
+        db.session.execute(
+            update(MessageTemplate)
+            .where(MessageTemplate.id.in_(counts))
+            .values(usage_count=func.coalesce(MessageTemplate.usage_count, 0)
+                    + case(counts, value=MessageTemplate.id, else_=0))
+        )
+        db.session.commit()
+        logger.info(f"Flushed usage counts for {len(counts)} templates")
+        return len(counts)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error flushing template usage, restoring counters: {str(e)}")
+        try:
+            pipe = redis_conn.pipeline()
+            for template_id, count in counts.items():
+                pipe.hincrby(TEMPLATE_USAGE_KEY, template_id, count)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(f"Redis error restoring template usage: {str(e)}")
+        return 0
+
+def maybe_flush_template_usage(redis_conn, interval: float) -> None:
+    """Flush buffered usage counts at most once per interval in this process"""
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush < interval:
+        return
+    _last_flush = now
+    flush_template_usage(redis_conn)
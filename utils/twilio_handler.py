@@ -1,20 +1,60 @@
 import os
-from datetime import datetime
+import time
+import random
+import logging
+from datetime import datetime, timedelta
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 from models import Message, TwilioNumber, db
-from utils.openai_handler import generate_response
+from utils.openai_handler import generate_reply, generate_reply_async
+from utils.async_utils import run_in_app_context
+from utils.redis_helper import get_redis_connection
+from utils.sender_allocator import allocate_sender, lookup_number_id, reset_sender_usage, SenderRateLimited
+from utils.priority_queues import get_queue, queue_for_priority
+from utils.job_payload import read_payload
+from utils.message_coalescer import claim_fragments, combine_fragments
+from utils.message_store import start_message, complete_message, touch_message
+from utils.metrics import observe, stage_timer
+from utils.redis_handler import record_first_sms
+from config import Config
+from redis import RedisError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
 
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+DEFER_JITTER = 0.5  # seconds; spreads deferred replies that hit the same empty bucket
+
+def _create_client(**kwargs) -> Client:
+    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, **kwargs)
+    if Config.TWILIO_API_BASE_URL:
+        twilio_client.api.base_url = Config.TWILIO_API_BASE_URL.rstrip('/')
+    return twilio_client
+
+client = _create_client()
+# The aiohttp session behind the async client must be created on the event loop
+_async_client = None
+
+def _get_async_client() -> Client:
+    global _async_client
+    if _async_client is None:
+        _async_client = _create_client(http_client=AsyncTwilioHttpClient())
+    return _async_client
 
-def get_available_number():
-    """Get the most suitable Twilio number based on priority and load balancing"""
-    # Get active numbers ordered by priority (highest first) and message count (lowest first)
-    available_number = TwilioNumber.query.filter_by(is_active=True)\
-        .order_by(TwilioNumber.priority.desc(), TwilioNumber.daily_message_count)\
-        .first()
+def _allocate_from_database(preferred=None):
+    """Pick a sender with a row update; only used when Redis is unavailable"""
+    available_number = None
+    if preferred:
+        available_number = TwilioNumber.query.filter_by(is_active=True, phone_number=preferred).first()
+    if not available_number:
+        # Get active numbers ordered by priority (highest first) and message count (lowest first)
+        available_number = TwilioNumber.query.filter_by(is_active=True)\
+            .order_by(TwilioNumber.priority.desc(), TwilioNumber.daily_message_count)\
+            .first()
     
     if available_number:
         # Update usage statistics
@@ -22,64 +62,327 @@ def get_available_number():
         available_number.last_used = datetime.utcnow()
         db.session.commit()
         return available_number.phone_number
+    return None
+
+def get_available_number(preferred=None):
+    """Get the most suitable Twilio number based on priority and load balancing,
+    or the preferred number while it is active"""
+    redis_conn = get_redis_connection()
+    try:
+        if redis_conn:
+            phone_number = allocate_sender(redis_conn, Config.DEFAULT_SEND_RATE, Config.SEND_BURST_SECONDS,
+                                           preferred)
+        else:
+            phone_number = _allocate_from_database(preferred)
+    except RedisError as e:
+        logger.error(f"Sender allocator unavailable, using database: {str(e)}")
+        phone_number = _allocate_from_database(preferred)
+
+    if phone_number:
+        return phone_number
     
     # Fallback to default number if no numbers are available
     return os.environ.get("TWILIO_PHONE_NUMBER")
 
-def send_message(to_number: str, message: str, priority: int = 0):
-    """Send message with priority handling"""
+def _allocate_sender(preferred=None):
+    with stage_timer('sender_allocation', sender='none') as labels:
+        from_number = get_available_number(preferred)
+        labels['sender'] = from_number or 'none'
+    return from_number
+
+def send_message(to_number: str, message: str, priority: int = 0, from_number=None):
+    """Send message with priority handling.
+
+    from_number is a sender already allocated for this message; without it
+    one is allocated. Raises SenderRateLimited when no number may send yet,
+    or Twilio answered 429, so the caller can retry later instead of
+    dropping the reply.
+    """
     try:
-        from_number = get_available_number()
-        message = client.messages.create(
-            body=message,
-            from_=from_number,
-            to=to_number
-        )
+        from_number = from_number or _allocate_sender()
+        with stage_timer('twilio_send', sender=from_number or 'none'):
+            message = client.messages.create(
+                body=message,
+                from_=from_number,
+                to=to_number
+            )
         return message.sid
+    except SenderRateLimited:
+        raise
+    except TwilioRestException as e:
+        if e.status == 429:
+            raise SenderRateLimited(Config.SEND_RETRY_AFTER) from e
+        logger.error(f"Twilio error: {str(e)}")
+        return None
     except Exception as e:
-        print(f"Twilio error: {str(e)}")
+        logger.error(f"Twilio error: {str(e)}")
+        return None
+
+async def send_message_async(to_number: str, message: str, priority: int = 0, from_number=None):
+    """Same as send_message, awaiting Twilio instead of blocking on it"""
+    try:
+        from_number = from_number or await run_in_app_context(_allocate_sender)
+        with stage_timer('twilio_send', sender=from_number or 'none'):
+            message = await _get_async_client().messages.create_async(
+                body=message,
+                from_=from_number,
+                to=to_number
+            )
+        return message.sid
+    except SenderRateLimited:
+        raise
+    except TwilioRestException as e:
+        if e.status == 429:
+            raise SenderRateLimited(Config.SEND_RETRY_AFTER) from e
+        logger.error(f"Twilio error: {str(e)}")
         return None
+    except Exception as e:
+        logger.error(f"Twilio error: {str(e)}")
+        return None
+
+def _lookup_number_id(redis_conn, to_number: str):
+    """Get the TwilioNumber id for the number the message was sent to"""
+    if redis_conn:
+        try:
+            return lookup_number_id(redis_conn, to_number)
+        except RedisError as e:
+            logger.error(f"Redis error looking up number, using database: {str(e)}")
+    twilio_number = TwilioNumber.query.filter_by(phone_number=to_number).first()
+    return twilio_number.id if twilio_number else None
+
+def _start_message(from_number: str, to_number: str, message_body: str, priority: int, message_sid=None):
+    """Register the message as in-flight; nothing is written to the database yet"""
+    redis_conn = get_redis_connection()
+    with stage_timer('message_start'):
+        twilio_number_id = _lookup_number_id(redis_conn, to_number)
+        return start_message(redis_conn, from_number, to_number, message_body, priority, twilio_number_id,
+                             message_sid)
+
+def _complete_message(record, response: str, status: str, template_id=None) -> None:
+    """Persist the finished message in a single insert (or hand it to the batch writer)"""
+    with stage_timer('final_commit', status=status):
+        complete_message(get_redis_connection(), record, response, status, template_id,
+                         write_mode=Config.MESSAGE_WRITE_MODE)
+
+def _touch_message(record) -> None:
+    """Tell the reaper the message is still being worked on"""
+    touch_message(get_redis_connection(), record)
+
+def _record_first_sms(record, streamed: bool) -> None:
+    """Report how long the sender waited, from the start of processing to the first SMS of the reply"""
+    seconds = max(time.time() - record['timestamp'], 0)
+    observe('first_sms', seconds, streamed='true' if streamed else 'false')
+    record_first_sms(get_redis_connection(), seconds)
+
+class _SegmentSender:
+    """Sends the segments of a streamed reply in order, all from one number.
+
+    Once that number is rate limited the remaining segments are kept, in
+    order, so the caller can defer them and send them from the same number.
+    from_number is the number earlier segments of the reply went out from.
+    """
+
+    def __init__(self, record, from_number=None):
+        self.record = record
+        self.from_number = from_number
+        self.started = False
+        self.unsent = []
+        self.retry_after = None
+
+    def __call__(self, segment: str) -> None:
+        self.started = True
+        if self.unsent:
+            self.unsent.append(segment)
+            return
+        try:
+            from_number = _allocate_sender(self.from_number)
+            send_message(self.record['from_number'], segment, self.record['priority'], from_number)
+            if self.from_number is None:
+                _record_first_sms(self.record, streamed=True)
+            self.from_number = from_number
+        except SenderRateLimited as e:
+            self.retry_after = e.retry_after
+            self.unsent.append(segment)
+
+    async def send_async(self, segment: str) -> None:
+        self.started = True
+        if self.unsent:
+            self.unsent.append(segment)
+            return
+        try:
+            from_number = await run_in_app_context(_allocate_sender, self.from_number)
+            await send_message_async(self.record['from_number'], segment, self.record['priority'], from_number)
+            if self.from_number is None:
+                await run_in_app_context(_record_first_sms, self.record, True)
+            self.from_number = from_number
+        except SenderRateLimited as e:
+            self.retry_after = e.retry_after
+            self.unsent.append(segment)
+
+def _defer_reply(record, response: str, template_id, retry_after: float, attempt: int,
+                 unsent=None, from_number=None) -> None:
+    """Schedule another send attempt once a sender number has a token again.
+
+    unsent is the list of segments of a streamed reply still to be sent,
+    from from_number when earlier segments went out; otherwise the whole
+    response is.
+    """
+    if attempt > Config.SEND_MAX_DEFERRALS:
+        logger.error(f"Giving up on reply to {record['from_number']} after {attempt - 1} rate limited attempts")
+        _complete_message(record, f"Rate limited: not sent after {attempt - 1} attempts", 'failed', template_id)
+        return
+    queue = get_queue(queue_for_priority(record['priority']), get_redis_connection())
+    delay = retry_after + random.uniform(0, DEFER_JITTER)
+    queue.enqueue_in(timedelta(seconds=delay), deliver_reply, record, response, template_id, attempt,
+                     unsent, from_number)
+    # Waiting for a sender is not abandonment, so the reaper's clock starts over
+    _touch_message(record)
+    logger.info(f"Senders rate limited, reply to {record['from_number']} deferred by {delay:.2f}s")
+
+def _defer_segments(record, response: str, template_id, segments: _SegmentSender, unsent, attempt: int) -> None:
+    """Defer the segments still unsent after a delivery attempt.
+
+    An attempt that sent some segments made progress, so the count of
+    attempts starts over rather than giving up on a long reply.
+    """
+    attempt = attempt + 1 if len(segments.unsent) == len(unsent) else 1
+    _defer_reply(record, response, template_id, segments.retry_after, attempt, segments.unsent,
+                 segments.from_number)
+
+def deliver_reply(record, response: str, template_id=None, attempt: int = 1, unsent=None, from_number=None):
+    """Send a reply that was generated earlier but deferred by the send rate limit"""
+    _touch_message(record)
+    try:
+        if unsent is not None:
+            segments = _SegmentSender(record, from_number)
+            for segment in unsent:
+                segments(segment)
+            if segments.unsent:
+                _defer_segments(record, response, template_id, segments, unsent, attempt)
+                return
+        else:
+            send_message(record['from_number'], response, record['priority'])
+            _record_first_sms(record, streamed=False)
+        _complete_message(record, response, 'completed', template_id)
+    except SenderRateLimited as e:
+        _defer_reply(record, response, template_id, e.retry_after, attempt + 1)
+    except Exception as e:
+        db.session.rollback()
+        _complete_message(record, str(e), 'failed')
+
+async def deliver_reply_async(record, response: str, template_id=None, attempt: int = 1, unsent=None,
+                              from_number=None):
+    """Asyncio variant of deliver_reply, run by the async worker mode"""
+    await run_in_app_context(_touch_message, record)
+    try:
+        if unsent is not None:
+            segments = _SegmentSender(record, from_number)
+            for segment in unsent:
+                await segments.send_async(segment)
+            if segments.unsent:
+                await run_in_app_context(_defer_segments, record, response, template_id, segments, unsent, attempt)
+                return
+        else:
+            await send_message_async(record['from_number'], response, record['priority'])
+            await run_in_app_context(_record_first_sms, record, False)
+        await run_in_app_context(_complete_message, record, response, 'completed', template_id)
+    except SenderRateLimited as e:
+        await run_in_app_context(_defer_reply, record, response, template_id, e.retry_after, attempt + 1)
+    except Exception as e:
+        await run_in_app_context(_complete_message, record, str(e), 'failed')
 
 def process_twilio_webhook(form_data, priority: int = 0):
     """Process incoming webhook with priority support"""
+    form_data = read_payload(form_data)
     from_number = form_data.get('From')
     message_body = form_data.get('Body')
     to_number = form_data.get('To')
     
-    # Get the TwilioNumber record for this number
-    twilio_number = TwilioNumber.query.filter_by(phone_number=to_number).first()
-    
-    # Create message record
-    message = Message(
-        from_number=from_number,
-        to_number=to_number,
-        content=message_body,
-        status='processing',
-        priority=priority,
-        twilio_number_id=twilio_number.id if twilio_number else None
-    )
-    db.session.add(message)
-    db.session.commit()
+    record = _start_message(from_number, to_number, message_body, priority, form_data.get('MessageSid'))
     
     try:
-        # Generate response using OpenAI
-        response = generate_response(message_body)
+        # Generate response using a template or OpenAI. When streaming, an
+        # OpenAI reply is sent segment by segment while the rest is generated
+        segments = _SegmentSender(record) if Config.STREAM_REPLIES else None
+        response, template_id = generate_reply(message_body, from_number, segments)
+        if segments and segments.started:
+            if segments.unsent:
+                _defer_reply(record, response, template_id, segments.retry_after, 1, segments.unsent,
+                             segments.from_number)
+            else:
+                _complete_message(record, response, 'completed', template_id)
+            return
         
-        # Send response via Twilio
-        send_message(from_number, response, priority)
+        # Send response via Twilio, or try again later if every number is at its rate
+        try:
+            send_message(from_number, response, priority)
+            _record_first_sms(record, streamed=False)
+        except SenderRateLimited as e:
+            _defer_reply(record, response, template_id, e.retry_after, 1)
+            return
         
-        # Update message record
-        message.response = response
-        message.status = 'completed'
-        message.processed_at = datetime.utcnow()
-        db.session.commit()
+        # Persist the finished message
+        _complete_message(record, response, 'completed', template_id)
         
     except Exception as e:
-        message.status = 'failed'
-        message.response = str(e)
-        db.session.commit()
+        db.session.rollback()
+        _complete_message(record, str(e), 'failed')
+
+async def process_twilio_webhook_async(form_data, priority: int = 0):
+    """Asyncio variant of process_twilio_webhook, run by the async worker mode"""
+    form_data = read_payload(form_data)
+    from_number = form_data.get('From')
+    message_body = form_data.get('Body')
+    to_number = form_data.get('To')
+
+    record = await run_in_app_context(_start_message, from_number, to_number, message_body, priority,
+                                      form_data.get('MessageSid'))
+
+    try:
+        segments = _SegmentSender(record) if Config.STREAM_REPLIES else None
+        response, template_id = await generate_reply_async(message_body, from_number,
+                                                           segments.send_async if segments else None)
+        if segments and segments.started:
+            if segments.unsent:
+                await run_in_app_context(_defer_reply, record, response, template_id, segments.retry_after, 1,
+                                         segments.unsent, segments.from_number)
+            else:
+                await run_in_app_context(_complete_message, record, response, 'completed', template_id)
+            return
+        try:
+            await send_message_async(from_number, response, priority)
+            await run_in_app_context(_record_first_sms, record, False)
+        except SenderRateLimited as e:
+            await run_in_app_context(_defer_reply, record, response, template_id, e.retry_after, 1)
+            return
+        await run_in_app_context(_complete_message, record, response, 'completed', template_id)
+    except Exception as e:
+        await run_in_app_context(_complete_message, record, str(e), 'failed')
+
+def _claim_coalesced(form_data):
+    """Collect a sender's fragments into one message; None if another job took them"""
+    form_data = read_payload(form_data)
+    parts = claim_fragments(get_redis_connection(), form_data.get('From'))
+    if not parts:
+        return None
+    if len(parts) > 1:
+        logger.info(f"Coalesced {len(parts)} fragments from {form_data.get('From')}")
+    return {**form_data, 'Body': combine_fragments(parts)}
+
+def process_coalesced_messages(form_data, priority: int = 0):
+    """Process everything a sender sent within the coalescing window as one message"""
+    combined = _claim_coalesced(form_data)
+    if combined:
+        process_twilio_webhook(combined, priority)
+
+async def process_coalesced_messages_async(form_data, priority: int = 0):
+    """Asyncio variant of process_coalesced_messages, run by the async worker mode"""
+    combined = await run_in_app_context(_claim_coalesced, form_data)
+    if combined:
+        await process_twilio_webhook_async(combined, priority)
 
 def reset_daily_counts():
     """Reset daily message counts for all numbers"""
     TwilioNumber.query.update({TwilioNumber.daily_message_count: 0})
     db.session.commit()
+    reset_sender_usage(get_redis_connection())
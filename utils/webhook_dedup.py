@@ -0,0 +1,72 @@
+import logging
+from typing import Optional
+from redis import RedisError
+from utils.redis_handler import PROCESSING_COUNTERS_KEY
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MESSAGE_SID_PREFIX = "webhook:sid:"  # Twilio MessageSid -> id of the job that handles it
+DUPLICATES_FIELD = "duplicates_suppressed"  # counter in the processing counters hash
+
+# Claim a MessageSid for a job. Returns nil for a new message, or the id of
+# the job that already took it, counting the duplicate.
+CLAIM_SID_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return false
+end
+redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+return redis.call('GET', KEYS[1])
+"""
+
+# Forget a claim, but only if it still belongs to the given job
+RELEASE_SID_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_claim_script = None
+_release_script = None
+
+def _as_text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def claim_message_sid(redis_conn, message_sid: str, job_id: str, ttl: int) -> Optional[str]:
+    """Record that job_id handles this message.
+
+    Returns None for a first delivery, or the original job id when Twilio is
+    retrying a webhook we already accepted. Raises RedisError if Redis cannot
+    be reached.
+    """
+    global _claim_script
+    if _claim_script is None:
+        _claim_script = redis_conn.register_script(CLAIM_SID_SCRIPT)
+    original = _claim_script(keys=[f"{MESSAGE_SID_PREFIX}{message_sid}", PROCESSING_COUNTERS_KEY],
+                             args=[job_id, ttl, DUPLICATES_FIELD], client=redis_conn)
+    return _as_text(original) if original else None
+
+def point_message_sid(redis_conn, message_sid: str, job_id: str, ttl: int) -> None:
+    """Point a claimed MessageSid at the job that ends up handling it"""
+    redis_conn.set(f"{MESSAGE_SID_PREFIX}{message_sid}", job_id, xx=True, ex=ttl)
+
+def release_message_sid(redis_conn, message_sid: str, job_id: str) -> None:
+    """Drop a claim whose job was never enqueued, so Twilio's retry is accepted"""
+    global _release_script
+    try:
+        if _release_script is None:
+            _release_script = redis_conn.register_script(RELEASE_SID_SCRIPT)
+        _release_script(keys=[f"{MESSAGE_SID_PREFIX}{message_sid}"], args=[job_id], client=redis_conn)
+    except RedisError as e:
+        logger.error(f"Redis error releasing message sid {message_sid}: {str(e)}")
+
+def record_duplicate(redis_conn) -> None:
+    """Count a duplicate caught by the database rather than at the webhook"""
+    if not redis_conn:
+        return
+    try:
+        redis_conn.hincrby(PROCESSING_COUNTERS_KEY, DUPLICATES_FIELD, 1)
+    except RedisError as e:
+        logger.error(f"Redis error counting duplicate message: {str(e)}")
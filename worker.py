@@ -1,35 +1,167 @@
 import os
+import argparse
 import logging
-from rq import Worker, Queue
+from rq import Worker
+from app import app
+from models import db
+from config import Config
 from utils.redis_helper import RedisHelper
+from utils.openai_handler import get_template_matcher
+from utils.template_usage import maybe_flush_template_usage
+from utils.sender_allocator import maybe_flush_sender_usage
+from utils.message_store import maybe_flush_message_batch, maybe_reap_abandoned_messages
+from utils.async_worker import AsyncWorker
+from utils.response_cache import enable_local_tier
+from utils.queue_sampler import QueueStatsSampler
+from utils.redis_handler import record_job_completion
+from utils.priority_queues import get_queues, WeightedFairOrder
+from utils.job_payload import CompactJSONSerializer
+from utils.metrics import observe_queue_wait, flush_metrics, maybe_record_pool_stats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def initialize_worker():
+IDLE_WAKEUP_INTERVAL = 5  # seconds an idle worker waits for a job before running periodic tasks
+
+def run_pre_job_tasks(redis_conn):
+    """Refresh shared job state and run periodic write-backs"""
+    try:
+        get_template_matcher()
+        maybe_flush_template_usage(redis_conn, Config.TEMPLATE_USAGE_FLUSH_INTERVAL)
+        maybe_flush_sender_usage(redis_conn, Config.SENDER_USAGE_FLUSH_INTERVAL)
+        if Config.MESSAGE_WRITE_MODE == 'batched':
+            maybe_flush_message_batch(redis_conn, Config.MESSAGE_WRITE_FLUSH_INTERVAL,
+                                      Config.MESSAGE_WRITE_BATCH_SIZE)
+        maybe_reap_abandoned_messages(redis_conn, Config.INFLIGHT_REAP_INTERVAL)
+        maybe_record_pool_stats(redis_conn, 'worker', RedisHelper().pool_stats(), Config.POOL_STATS_INTERVAL)
+    except Exception as e:
+        logger.error(f"Error running pre-job tasks: {str(e)}")
+    finally:
+        db.session.remove()
+
+class MessageWorker(Worker):
+    """RQ worker that keeps shared job state warm in the parent process.
+
+    Every job runs in a forked work horse, so anything compiled inside the
+    horse is thrown away when the job ends. Refreshing it here, right before
+    the fork, lets every horse inherit an up-to-date copy. Periodic write-backs
+    of buffered counters and messages also run here so they happen once per
+    process, and as RQ maintenance tasks between waits for jobs, so they keep
+    running while no messages arrive.
+
+    Queues are served by weighted fair scheduling (Config.QUEUE_WEIGHTS)
+    rather than strict priority, so low priority messages are never starved.
+    """
+
+    def __init__(self, queues, *args, **kwargs):
+        super().__init__(queues, *args, **kwargs)
+        self._weighted = WeightedFairOrder(self.queues, Config.QUEUE_WEIGHTS)
+        self._ordered_queues = self._weighted.order
+
+    @property
+    def dequeue_timeout(self) -> int:
+        # Stop waiting for a job often enough that idle workers still run periodic tasks
+        return min(super().dequeue_timeout, IDLE_WAKEUP_INTERVAL)
+
+    @property
+    def should_run_maintenance_tasks(self):
+        # The periodic tasks throttle themselves, so they are offered every wake-up
+        return True
+
+    def run_maintenance_tasks(self):
+        run_pre_job_tasks(self.connection)
+        # RQ's own registry cleaning keeps its usual interval
+        if super().should_run_maintenance_tasks:
+            super().run_maintenance_tasks()
+
+    def reorder_queues(self, reference_queue):
+        self._ordered_queues = self._weighted.served(reference_queue)
+
+    def execute_job(self, job, queue):
+        run_pre_job_tasks(self.connection)
+        super().execute_job(job, queue)
+
+    def prepare_job_execution(self, job, remove_from_intermediate_queue=False):
+        super().prepare_job_execution(job, remove_from_intermediate_queue)
+        observe_queue_wait(job)
+
+    def handle_job_success(self, job, queue, started_job_registry):
+        super().handle_job_success(job, queue, started_job_registry)
+        record_job_completion(self.connection)
+        # Stage timings live in the work horse, so write them before it exits
+        flush_metrics(self.connection)
+
+    def handle_job_failure(self, job, queue, started_job_registry=None, exc_string=''):
+        super().handle_job_failure(job, queue, started_job_registry, exc_string)
+        record_job_completion(self.connection)
+        flush_metrics(self.connection)
+
+    def main_work_horse(self, job, queue):
+        # Pooled database connections must not be shared with the parent
+        db.engine.dispose(close=False)
+        super().main_work_horse(job, queue)
+
+def initialize_worker(use_async=False, concurrency=None):
     redis_helper = RedisHelper()
-    redis_conn = redis_helper.get_connection()
+    # Dequeues block on a connection, so they get a client of their own on the pool
+    redis_conn = redis_helper.get_connection('queue')
     
     if not redis_conn:
         logger.error("Failed to connect to Redis - worker cannot start")
         return None, None
         
     try:
-        queue = Queue('messages', connection=redis_conn)
-        worker = Worker([queue], connection=redis_conn)
+        queues = get_queues(redis_conn)
+        if use_async:
+            # One process serves every job, so replies it has seen stay in memory
+            enable_local_tier()
+            worker = AsyncWorker(
+                queues, redis_conn, app,
+                concurrency=concurrency or Config.WORKER_CONCURRENCY,
+                maintenance=lambda: run_pre_job_tasks(redis_conn),
+                weights=Config.QUEUE_WEIGHTS,
+                serializer=CompactJSONSerializer,
+                result_ttl=Config.JOB_RESULT_TTL
+            )
+        else:
+            worker = MessageWorker(queues, connection=redis_conn, serializer=CompactJSONSerializer,
+                                   default_result_ttl=Config.JOB_RESULT_TTL)
         logger.info("Worker initialized successfully")
-        return queue, worker
+        return queues, worker
     except Exception as e:
         logger.error(f"Error initializing worker: {str(e)}")
         return None, None
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Process queued Twilio messages")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        default=Config.WORKER_MODE == 'async',
+                        help="run many jobs concurrently on an asyncio event loop")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="maximum jobs in flight in async mode")
+    parser.add_argument('--with-sampler', action='store_true',
+                        help="also record queue statistics on a background thread")
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    queue, worker = initialize_worker()
+    args = parse_args()
+    queues, worker = initialize_worker(args.use_async, args.concurrency)
     if worker:
+        if args.with_sampler:
+            QueueStatsSampler(queues[0].connection, queues,
+                              interval=Config.QUEUE_SAMPLE_INTERVAL,
+                              lock_ttl=Config.QUEUE_SAMPLER_LOCK_TTL).start()
         try:
             logger.info("Starting worker...")
-            worker.work()
+            if args.use_async:
+                worker.run()
+            else:
+                # Jobs use the database, so they need the app context, which the
+                # forked work horses inherit from here
+                with app.app_context():
+                    # The scheduler enqueues replies deferred by the send rate limit
+                    worker.work(with_scheduler=True)
         except KeyboardInterrupt:
             logger.info("Worker stopped by user")
         except Exception as e: